@@ -0,0 +1,109 @@
+"""
+Кеш аутентифицированных пользователей
+
+get_current_user вызывается на каждый запрос, и полная проверка HS256 JWT
+заметна в профиле. Кеш хранит уже найденного пользователя по SHA-256
+токена (сам токен в памяти не держим) вместе со сроком жизни записи:
+не дольше AUTH_CACHE_TTL секунд и не дольше exp самого токена.
+
+Размер ограничен AUTH_CACHE_SIZE, при переполнении вытесняются давно не
+использованные записи (LRU). Изменение или удаление пользователя
+админом сбрасывает все его записи, чтобы отозванный доступ пропадал
+сразу, а не по истечении TTL.
+
+Пользователь читается из хранилища асинхронно, и сброс может прийти, пока
+чтение ещё идёт. Поэтому кеш ведёт счётчик поколений: get_current_user
+запоминает generation до чтения и передаёт его в put, а put не сохраняет
+пользователя, сброшенного после этого момента, - иначе прочитанная до
+изменения запись жила бы в кеше до конца TTL. Помнятся только последние
+MAX_INVALIDATIONS сбросов: чтение, начатое раньше самого старого из них,
+в кеш не попадает.
+"""
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+import hashlib
+import os
+import time
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "300"))
+
+# Сброс нужен, пока идут начатые до него чтения пользователя - миллисекунды
+MAX_INVALIDATIONS = 1024
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class PrincipalCache:
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[bytes, Tuple[dict, float]]" = OrderedDict()  # digest -> (user, expires_at)
+        self._by_user: Dict[str, Set[bytes]] = {}  # user_id -> {digests}
+        self.generation = 0  # растёт с каждым invalidate_user
+        # user_id -> поколение последнего сброса, от старых к новым
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._forgotten = 0  # поколение последнего вытесненного сброса
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, token: str) -> Optional[dict]:
+        digest = token_digest(token)
+        entry = self._entries.get(digest)
+        if entry is None:
+            return None
+
+        user, expires_at = entry
+        if time.time() >= expires_at:
+            self._remove(digest)
+            return None
+
+        self._entries.move_to_end(digest)
+        return user
+
+    def put(self, token: str, user: dict, token_exp: float, generation: Optional[int] = None):
+        """
+        Запомнить пользователя для токена; token_exp - exp из JWT (unix time),
+        generation - значение self.generation до чтения пользователя
+        """
+        if self.max_size <= 0:
+            return
+        if generation is not None and (
+            generation < self._forgotten or self._invalidated.get(user["id"], 0) > generation
+        ):
+            return
+
+        digest = token_digest(token)
+        self._remove(digest)
+        self._entries[digest] = (user, min(time.time() + self.ttl, token_exp))
+        self._by_user.setdefault(user["id"], set()).add(digest)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, user_id: str):
+        self.generation += 1
+        self._invalidated[user_id] = self.generation
+        self._invalidated.move_to_end(user_id)
+        while len(self._invalidated) > MAX_INVALIDATIONS:
+            self._forgotten = self._invalidated.popitem(last=False)[1]
+        for digest in self._by_user.pop(user_id, ()):
+            self._entries.pop(digest, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def _remove(self, digest: bytes):
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        user_id = entry[0]["id"]
+        digests = self._by_user.get(user_id)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[user_id]
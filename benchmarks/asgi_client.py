@@ -0,0 +1,109 @@
+"""
+Минимальный ASGI-клиент для бенчмарков
+
+Вызывает приложение FastAPI прямо в процессе, без сети и без сторонних
+HTTP-клиентов, поэтому в замерах только стоимость самого приложения.
+"""
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+import asyncio
+import json
+
+
+class Response:
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes):
+        self.status_code = status
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in headers}
+        self.content = body
+
+    def json(self):
+        return json.loads(self.content)
+
+
+async def request(
+    app,
+    method: str,
+    path: str,
+    json_body=None,
+    form: Optional[Dict[str, str]] = None,
+    params: Optional[Dict[str, str]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    body: bytes = b""
+) -> Response:
+    raw_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+    if json_body is not None:
+        body = json.dumps(json_body).encode("utf-8")
+        raw_headers.append((b"content-type", b"application/json"))
+    elif form is not None:
+        body = urlencode(form).encode("utf-8")
+        raw_headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+    raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": urlencode(params or {}).encode("latin-1"),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+
+    done = asyncio.Event()
+    request_sent = False
+    status = 500
+    response_headers: List[Tuple[bytes, bytes]] = []
+    chunks: List[bytes] = []
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, response_headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return Response(status, response_headers, b"".join(chunks))
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Запустить startup/shutdown приложения по протоколу ASGI lifespan"""
+    incoming: asyncio.Queue = asyncio.Queue()
+    outgoing: asyncio.Queue = asyncio.Queue()
+
+    async def receive():
+        return await incoming.get()
+
+    async def send(message):
+        await outgoing.put(message)
+
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send))
+    await incoming.put({"type": "lifespan.startup"})
+    message = await outgoing.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(f"Startup failed: {message}")
+    try:
+        yield
+    finally:
+        await incoming.put({"type": "lifespan.shutdown"})
+        await outgoing.get()
+        await task
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк сериализации при рассылке в группу
+
+Сравнивает CPU-время одной рассылки сообщения группе из N участников:
+
+- per-recipient: как раньше, send_json на каждого участника (json.dumps
+  одного и того же dict N раз);
+- encode-once: текущий путь ConnectionManager - Frame кодируется один раз
+  и всем участникам уходит готовый текст.
+
+Сокеты поддельные и ничего не пишут в сеть, поэтому разница - это чистая
+стоимость сериализации и постановки в очереди.
+
+Запуск:
+    python benchmarks/bench_broadcast_serialization.py [--members 2000] [--rounds 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PUBSUB_BACKEND", "local")
+
+import main
+from frames import orjson
+
+
+class FakeWebSocket:
+    """Сокет, который только считает отправленные кадры"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent += 1
+
+    async def send_json(self, data):
+        # То же, что делает starlette.WebSocket.send_json
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+def make_message(group_id: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "sender_id": str(uuid.uuid4()),
+        "sender_name": "Иван Тестов",
+        "content": "Всем привет! Начинаем обсуждение проекта, повестка во вложении.",
+        "recipient_id": None,
+        "group_id": group_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "type": "group",
+        "file_url": "/files/3f2a9c.pdf",
+        "file_name": "agenda.pdf",
+        "file_size": 183204
+    }
+
+
+async def wait_drained(sockets, expected: int):
+    while sum(ws.sent for ws in sockets) < expected:
+        await asyncio.sleep(0)
+
+
+async def run(members: int, rounds: int) -> dict:
+    manager = main.manager
+    await manager.startup()
+
+    group_id = str(uuid.uuid4())
+    member_ids = [str(uuid.uuid4()) for _ in range(members)]
+    await main.storage.create_group({
+        "id": group_id,
+        "name": "bench",
+        "description": None,
+        "members": member_ids,
+        "created_at": datetime.utcnow().isoformat(),
+        "created_by": member_ids[0]
+    })
+
+    sockets = []
+    for member_id in member_ids:
+        ws = FakeWebSocket()
+        sockets.append(ws)
+        await manager.connect(ws, member_id)
+
+    message = make_message(group_id)
+
+    # per-recipient: json.dumps на каждого участника
+    start = time.process_time()
+    for _ in range(rounds):
+        for ws in sockets:
+            await ws.send_json(message)
+    per_recipient = (time.process_time() - start) / rounds
+
+    for ws in sockets:
+        ws.sent = 0
+
+    # encode-once: текущий путь рассылки
+    start = time.process_time()
+    for _ in range(rounds):
+        await manager.broadcast_to_group(message, group_id)
+    await wait_drained(sockets, members * rounds)
+    encode_once = (time.process_time() - start) / rounds
+
+    for member_id in member_ids:
+        await manager.disconnect(member_id)
+    await manager.shutdown()
+
+    return {
+        "members": members,
+        "rounds": rounds,
+        "encoder": "orjson" if orjson is not None else "json",
+        "per_recipient_ms": round(per_recipient * 1000, 3),
+        "encode_once_ms": round(encode_once * 1000, 3),
+        "speedup": round(per_recipient / encode_once, 2) if encode_once else None
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    # Логирование отправок не относится к сериализации - глушим его
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = asyncio.run(run(args.members, args.rounds))
+
+    print(f"Рассылка группе из {result['members']} участников, encoder={result['encoder']}")
+    print(f"  per-recipient json.dumps: {result['per_recipient_ms']} ms CPU")
+    print(f"  encode-once Frame:        {result['encode_once_ms']} ms CPU")
+    print(f"  ускорение: x{result['speedup']}")
+
+
+if __name__ == "__main__":
+    main_cli()
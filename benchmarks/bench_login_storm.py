@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк "утреннего шторма логинов"
+
+Пока идут N одновременных POST /token, отдельная задача непрерывно дёргает
+не связанный с логином GET /api и замеряет его задержку. Прогон делается
+дважды:
+
+- inline: bcrypt прямо в обработчике, как было раньше - event loop стоит,
+  пока считается хеш, и задержка /api растёт до сотен миллисекунд;
+- offload: bcrypt в пуле потоков (passwords.py) - /api отвечает сразу.
+
+Запуск:
+    python benchmarks/bench_login_storm.py [--users 16] [--logins 64]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PUBSUB_BACKEND", "local")
+
+import bcrypt
+
+import main
+import passwords
+from asgi_client import lifespan, request
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def inline_verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Старое поведение: bcrypt синхронно в event loop"""
+    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+
+
+async def storm(usernames, logins: int) -> dict:
+    stop = asyncio.Event()
+    probe_latencies = []
+
+    async def probe():
+        # Задержка считается от момента, когда запрос должен был уйти, а не
+        # от фактического старта: иначе время простоя event loop не попадёт
+        # в замер (coordinated omission)
+        interval = 0.005
+        intended = time.perf_counter()
+        while not stop.is_set():
+            await request(main.app, "GET", "/api")
+            finished = time.perf_counter()
+            probe_latencies.append(finished - intended)
+            intended = max(intended + interval, finished)
+            await asyncio.sleep(max(0.0, intended - time.perf_counter()))
+
+    async def login(i: int):
+        username = usernames[i % len(usernames)]
+        response = await request(main.app, "POST", "/token", form={"username": username, "password": "password123"})
+        assert response.status_code == 200, response.content
+
+    probe_task = asyncio.create_task(probe())
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    return {
+        "logins": logins,
+        "storm_seconds": round(elapsed, 3),
+        "probe_requests": len(probe_latencies),
+        "probe_p50_ms": round(percentile(probe_latencies, 0.50) * 1000, 2),
+        "probe_p99_ms": round(percentile(probe_latencies, 0.99) * 1000, 2),
+        "probe_max_ms": round(max(probe_latencies, default=0) * 1000, 2),
+    }
+
+
+async def run(users: int, logins: int) -> dict:
+    results = {}
+    async with lifespan(main.app):
+        usernames = []
+        for i in range(users):
+            username = f"storm_user_{i}"
+            response = await request(main.app, "POST", "/register", json_body={
+                "username": username,
+                "email": f"{username}@company.com",
+                "password": "password123",
+                "full_name": f"Storm User {i}"
+            })
+            assert response.status_code == 200, response.content
+            usernames.append(username)
+
+        original = main.verify_password
+        main.verify_password = inline_verify_password
+        try:
+            results["inline"] = await storm(usernames, logins)
+        finally:
+            main.verify_password = original
+        results["offload"] = await storm(usernames, logins)
+    return results
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=64)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.users, args.logins))
+
+    print(f"Шторм из {args.logins} логинов, BCRYPT_ROUNDS={passwords.BCRYPT_ROUNDS}, "
+          f"BCRYPT_MAX_CONCURRENCY={passwords.BCRYPT_MAX_CONCURRENCY}")
+    for mode, result in results.items():
+        print(f"  {mode:8s} шторм {result['storm_seconds']} s, GET /api: "
+              f"p50={result['probe_p50_ms']} ms p99={result['probe_p99_ms']} ms "
+              f"max={result['probe_max_ms']} ms ({result['probe_requests']} запросов)")
+
+
+if __name__ == "__main__":
+    main_cli()
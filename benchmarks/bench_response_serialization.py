@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк сериализации списочных ответов
+
+Сравнивает CPU-время обработчика вместе с сериализацией ответа:
+
+- models: прежний путь - копия каждого dict, datetime.fromisoformat,
+  модель Pydantic на элемент, затем валидация и сериализация FastAPI по
+  response_model (serialize_response + JSONResponse);
+- bulk: текущие обработчики - поля моделей берутся из dict как есть, и
+  тело кодируется одним вызовом (serialization.JSONBody).
+
+Перед замером тела ответов обоих путей сравниваются побайтно для
+GET /messages, /messages/search, /sync, POST /messages/batch,
+GET /conversations и /groups - и с orjson, и со стандартным json.
+Несовпадение завершает бенчмарк с ошибкой.
+
+Запуск:
+    python benchmarks/bench_response_serialization.py [--page-size 500] [--groups 200] [--rounds 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PUBSUB_BACKEND", "local")
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+import frames
+import main
+from main import (
+    ConversationHistory, ConversationSummary, GroupResponse, MessageResponse, SyncResponse,
+    api_conversation_key, file_preview_fields, message_files, storage
+)
+
+CONTENTS = [
+    "Всем привет! Начинаем обсуждение проекта, повестка во вложении.",
+    'Цитата: "кавычки", обратный слеш \\ и перевод\nстроки\tс табуляцией',
+    "Emoji 🚀 и иероглифы 漢字, управляющий символ \x01",
+    "short",
+]
+
+
+# Прежний путь, как он был в обработчиках main.py
+
+def legacy_message_response(message: dict, files: dict) -> MessageResponse:
+    msg_copy = message.copy()
+    msg_copy["timestamp"] = datetime.fromisoformat(message["timestamp"])
+    msg_copy.update(file_preview_fields(message, files))
+    return MessageResponse(**msg_copy)
+
+
+async def legacy_render(response_model, content) -> bytes:
+    """Что FastAPI делает с результатом обработчика при response_model"""
+    field = create_response_field(name="response", type_=response_model, mode="serialization")
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+
+async def legacy_messages(group_id: str, limit: int) -> bytes:
+    messages = await storage.group_history(group_id, limit, None, None)
+    files = await message_files(messages)
+    return await legacy_render(List[MessageResponse], [legacy_message_response(msg, files) for msg in messages])
+
+
+async def legacy_search(user_id: str, query: str, limit: int) -> bytes:
+    found = await storage.search_messages(user_id, query, limit, None)
+    files = await message_files(found)
+    return await legacy_render(List[MessageResponse], [legacy_message_response(msg, files) for msg in found])
+
+
+async def legacy_sync(user_id: str, limit: int) -> bytes:
+    messages = await storage.sync_messages(user_id, 0, limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    files = await message_files(messages)
+    page = {
+        "messages": [{**msg, **file_preview_fields(msg, files)} for msg in messages],
+        "last_seq": messages[-1]["seq"] if messages else 0,
+        "has_more": has_more
+    }
+    return await legacy_render(SyncResponse, page)
+
+
+async def legacy_batch(user_id: str, conversations: List[str], limit: int) -> bytes:
+    group_ids = [key.partition(":")[2] for key in conversations if key.startswith("group:")]
+    peer_ids = [key.partition(":")[2] for key in conversations if key.startswith("user:")]
+    latest = await storage.latest_messages(user_id, group_ids, peer_ids, limit)
+    files = await message_files([msg for _, messages in latest.values() for msg in messages])
+    return await legacy_render(List[ConversationHistory], [
+        ConversationHistory(
+            conversation=key,
+            total=latest[key][0],
+            messages=[legacy_message_response(msg, files) for msg in latest[key][1]]
+        )
+        for key in conversations if key in latest
+    ])
+
+
+async def legacy_conversations(user_id: str) -> bytes:
+    summaries = await storage.conversation_summaries(user_id)
+    summaries.sort(
+        key=lambda summary: summary["last_message"]["timestamp"] if summary["last_message"] else "",
+        reverse=True
+    )
+    files = await message_files([summary["last_message"] for summary in summaries if summary["last_message"]])
+    return await legacy_render(List[ConversationSummary], [
+        ConversationSummary(
+            conversation=api_conversation_key(summary["key"], user_id),
+            message_count=summary["message_count"],
+            unread_count=summary["unread_count"],
+            last_read_message_id=summary["last_read_message_id"],
+            last_message=legacy_message_response(summary["last_message"], files) if summary["last_message"] else None
+        )
+        for summary in summaries
+    ])
+
+
+async def legacy_groups(user_id: str) -> bytes:
+    result = []
+    for group in await storage.list_user_groups(user_id):
+        group_copy = group.copy()
+        group_copy["created_at"] = datetime.fromisoformat(group["created_at"])
+        result.append(GroupResponse(**group_copy))
+    return await legacy_render(List[GroupResponse], result)
+
+
+# Данные
+
+async def seed(page_size: int, groups: int) -> dict:
+    user = {"id": str(uuid.uuid4()), "full_name": "Иван Тестов"}
+    peer_id = str(uuid.uuid4())
+    group_ids = [str(uuid.uuid4()) for _ in range(groups)]
+    started = datetime(2024, 1, 1)
+    for i, group_id in enumerate(group_ids):
+        await storage.create_group({
+            "id": group_id,
+            "name": f"Группа {i}",
+            "description": None if i % 3 else f"Описание \"{i}\"",
+            "members": [user["id"], peer_id],
+            # Целые секунды - isoformat без микросекунд
+            "created_at": (started + timedelta(seconds=i)).isoformat(),
+            "created_by": user["id"]
+        })
+
+    file_id = str(uuid.uuid4())
+    await storage.add_file({
+        "id": file_id, "sha256": "0" * 64, "filename": "photo.png", "content_type": "image/png",
+        "size": 183204, "uploaded_by": user["id"], "uploaded_at": started.isoformat(),
+        "width": None, "height": None, "previews": None
+    })
+    # Превью - как их записывает ThumbnailPipeline, с лишним для ответа sha256
+    await storage.update_file(file_id, {"width": 1920, "height": 1080, "previews": {
+        size: {"url": f"/files/{file_id}-{size}.jpg", "width": width, "height": height, "sha256": "1" * 64}
+        for size, width, height in (("small", 160, 90), ("medium", 640, 360))
+    }})
+
+    for i in range(page_size):
+        with_file = i % 5 == 0
+        group_message = i % 4 != 3
+        await storage.add_message({
+            "id": str(uuid.uuid4()),
+            "sender_id": user["id"] if i % 2 else peer_id,
+            "sender_name": user["full_name"],
+            "content": f"{CONTENTS[i % len(CONTENTS)]} отчёт {i}",
+            "recipient_id": None if group_message else peer_id,
+            "group_id": group_ids[0] if group_message else None,
+            "timestamp": (started + timedelta(seconds=i, microseconds=(i % 7) * 1000)).isoformat(),
+            "type": "group" if group_message else "personal",
+            "file_url": f"/files/{file_id}.png" if with_file else None,
+            "file_name": "photo.png" if with_file else None,
+            "file_size": 183204 if with_file else None
+        })
+
+    return {"user": user, "peer_id": peer_id, "group_id": group_ids[0]}
+
+
+def cases(data: dict, page_size: int):
+    """(название, прежний путь, текущий обработчик) - оба возвращают корутину"""
+    user, group_id = data["user"], data["group_id"]
+    conversations = [f"group:{group_id}", f"user:{data['peer_id']}"]
+    return [
+        ("GET /messages",
+         lambda: legacy_messages(group_id, page_size),
+         lambda: main.get_messages(group_id=group_id, recipient_id=None, limit=page_size,
+                                   before=None, after=None, current_user=user)),
+        ("GET /messages/search",
+         lambda: legacy_search(user["id"], "отчёт", page_size),
+         lambda: main.search_messages(q="отчёт", limit=page_size, before=None, current_user=user)),
+        ("GET /sync",
+         lambda: legacy_sync(user["id"], page_size),
+         lambda: main.sync_messages(since=0, limit=page_size, current_user=user)),
+        ("POST /messages/batch",
+         lambda: legacy_batch(user["id"], conversations, 50),
+         lambda: main.get_messages_batch(main.ConversationBatchRequest(conversations=conversations, limit=50),
+                                         current_user=user)),
+        ("GET /conversations",
+         lambda: legacy_conversations(user["id"]),
+         lambda: main.get_conversations(current_user=user)),
+        ("GET /groups",
+         lambda: legacy_groups(user["id"]),
+         lambda: main.get_groups(current_user=user)),
+    ]
+
+
+async def check_identical(data: dict, page_size: int) -> List[str]:
+    encoders = ["json"] + (["orjson"] if frames.orjson is not None else [])
+    orjson = frames.orjson
+    try:
+        for encoder in encoders:
+            frames.orjson = orjson if encoder == "orjson" else None
+            for name, legacy, current in cases(data, page_size):
+                expected = await legacy()
+                actual = (await current()).body
+                if actual != expected:
+                    at = next((i for i, (a, b) in enumerate(zip(actual, expected)) if a != b),
+                              min(len(actual), len(expected)))
+                    raise SystemExit(
+                        f"{name} ({encoder}): тела различаются с байта {at}\n"
+                        f"  было:  {expected[max(0, at - 80):at + 80]!r}\n"
+                        f"  стало: {actual[max(0, at - 80):at + 80]!r}"
+                    )
+    finally:
+        frames.orjson = orjson
+    return encoders
+
+
+async def measure(factory, rounds: int) -> float:
+    start = time.process_time()
+    for _ in range(rounds):
+        await factory()
+    return (time.process_time() - start) / rounds
+
+
+async def run(page_size: int, groups: int, rounds: int) -> dict:
+    await storage.startup()
+    data = await seed(page_size, groups)
+    encoders = await check_identical(data, page_size)
+
+    results = []
+    for name, legacy, current in cases(data, page_size):
+        models = await measure(legacy, rounds)
+        bulk = await measure(current, rounds)
+        results.append({
+            "endpoint": name,
+            "models_ms": round(models * 1000, 3),
+            "bulk_ms": round(bulk * 1000, 3),
+            "speedup": round(models / bulk, 2) if bulk else None
+        })
+    await storage.shutdown()
+    return {"page_size": page_size, "groups": groups, "rounds": rounds,
+            "identical_with": encoders, "results": results}
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args.page_size, args.groups, args.rounds))
+
+    print(f"Страница {result['page_size']} сообщений, {result['groups']} групп; "
+          f"JSON совпадает побайтно ({', '.join(result['identical_with'])})")
+    for row in result["results"]:
+        print(f"  {row['endpoint']:<22} models {row['models_ms']:>8} ms CPU   "
+              f"bulk {row['bulk_ms']:>8} ms CPU   x{row['speedup']}")
+
+
+if __name__ == "__main__":
+    main_cli()
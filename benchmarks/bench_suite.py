@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк API и WebSocket-рассылки
+
+Сценарии:
+
+- send      - POST /messages с --concurrency параллельными запросами;
+- history   - GET /messages по группе с 10k/1M сообщений (--history-sizes),
+              случайные страницы через курсор before;
+- broadcast - сообщение в группу из 10/1k/5k участников (--members),
+              время до получения всеми N WebSocket-клиентами;
+- login     - шторм одновременных POST /token;
+- upload    - POST /upload файлов размера --upload-size.
+
+По каждому сценарию - пропускная способность, p50/p99/max задержки и
+RSS процесса (текущий и пиковый). Результаты пишутся в JSON (--output,
+по умолчанию benchmarks/results/bench-<время>.json); --compare <json>
+печатает изменения относительно прошлого прогона.
+
+По умолчанию приложение вызывается в процессе (asgi_client), WebSocket-
+клиенты - поддельные сокеты, подключённые к ConnectionManager. С --url
+запросы идут по сети в запущенный uvicorn (нужен httpx, WebSocket - через
+websockets); RSS сервера снимается по --server-pid.
+
+Запуск:
+    python benchmarks/bench_suite.py [--scenarios send,history] [--history-sizes 10000]
+    uvicorn main:app & python benchmarks/bench_suite.py --url http://127.0.0.1:8000 --server-pid $!
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PUBSUB_BACKEND", "local")
+# Загрузки в процессе пишутся во временный каталог, а не в uploads/ репозитория
+BENCH_UPLOAD_DIR = tempfile.mkdtemp(prefix="bench-uploads-")
+os.environ["UPLOAD_DIR"] = BENCH_UPLOAD_DIR
+
+from asgi_client import lifespan, request
+
+try:
+    import httpx
+except ImportError:  # httpx нужен только для --url
+    httpx = None
+
+SCENARIOS = ["send", "history", "broadcast", "login", "upload"]
+PASSWORD = "password123"
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def read_rss(pid: Optional[int] = None) -> Dict[str, float]:
+    """Текущий и пиковый RSS в МБ (процесса pid или своего)"""
+    fields = {}
+    with contextlib.suppress(OSError):
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in ("VmRSS", "VmHWM"):
+                    fields[name] = int(value.split()[0]) / 1024
+    if not fields and pid is None:
+        # Без /proc (macOS) - только пик; ru_maxrss там в байтах, на Linux - в КБ
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        fields["VmHWM"] = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    return {"rss_mb": round(fields.get("VmRSS", 0), 1), "peak_rss_mb": round(fields.get("VmHWM", 0), 1)}
+
+
+def summarize(latencies: List[float], operations: int, seconds: float, pid: Optional[int], **extra) -> dict:
+    return {
+        **extra,
+        "operations": operations,
+        "seconds": round(seconds, 3),
+        "throughput_per_s": round(operations / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(max(latencies, default=0) * 1000, 2),
+        **read_rss(pid)
+    }
+
+
+async def timed_calls(call: Callable, count: int, concurrency: int):
+    """Выполнить call(i) count раз не больше concurrency одновременно; (задержки, секунды)"""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies, time.perf_counter() - start
+
+
+# === Транспорты ===
+
+class FakeWebSocket:
+    """Сокет в процессе: считает кадры с групповыми сообщениями"""
+
+    def __init__(self):
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.received += text.count('"type":"group"')
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+class InProcessClient:
+    def __init__(self):
+        import main
+        self.main = main
+        self.app = main.app
+        self.server_pid = None
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        async with lifespan(self.app):
+            yield
+
+    async def request(self, method: str, path: str, **kwargs):
+        return await request(self.app, method, path, **kwargs)
+
+    async def connect_clients(self, user_ids: List[str]) -> List[FakeWebSocket]:
+        sockets = []
+        for user_id in user_ids:
+            ws = FakeWebSocket()
+            await self.main.manager.connect(ws, user_id)
+            sockets.append(ws)
+        return sockets
+
+    async def disconnect_clients(self, user_ids: List[str], sockets):
+        for user_id in user_ids:
+            await self.main.manager.disconnect(user_id)
+
+    async def seed_group_messages(self, creator: dict, group_id: str, count: int) -> List[str]:
+        """Сообщения пишутся прямо в хранилище - миллион POST /messages шёл бы часами"""
+        storage = self.main.storage
+        base = datetime.utcnow() - timedelta(seconds=count)
+        ids = []
+        for i in range(count):
+            message_id = str(uuid.uuid4())
+            await storage.add_message({
+                "id": message_id,
+                "sender_id": creator["id"],
+                "sender_name": creator["full_name"],
+                "content": f"Сообщение {i} для проверки истории",
+                "recipient_id": None,
+                "group_id": group_id,
+                "timestamp": (base + timedelta(microseconds=i * 1000)).isoformat(),
+                "type": "group",
+                "file_url": None,
+                "file_name": None,
+                "file_size": None
+            })
+            ids.append(message_id)
+            if i and i % 100000 == 0:
+                print(f"  seeded {i}/{count}", file=sys.stderr)
+        return ids
+
+
+class RemoteResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class RemoteWebSocket:
+    """WebSocket-клиент uvicorn'а: задача-читатель считает групповые сообщения"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.received = 0
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        with contextlib.suppress(Exception):
+            async for text in self.connection:
+                self.received += text.count('"type":"group"')
+
+
+class RemoteClient:
+    def __init__(self, url: str, server_pid: Optional[int]):
+        if httpx is None:
+            raise SystemExit("--url requires httpx (pip install httpx)")
+        self.url = url.rstrip("/")
+        self.ws_url = "ws" + self.url[len("http"):]
+        self.server_pid = server_pid
+        self.client = None
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=256)
+        async with httpx.AsyncClient(base_url=self.url, limits=limits, timeout=60) as client:
+            self.client = client
+            yield
+
+    async def request(self, method: str, path: str, json_body=None, form=None, params=None,
+                      headers=None, body: bytes = b""):
+        response = await self.client.request(
+            method, path, json=json_body, data=form, params=params, headers=headers,
+            content=body if json_body is None and form is None else None
+        )
+        return RemoteResponse(response)
+
+    async def connect_clients(self, user_ids: List[str]) -> List[RemoteWebSocket]:
+        import websockets
+        sockets = []
+        for user_id in user_ids:
+            connection = await websockets.connect(f"{self.ws_url}/ws/{user_id}", max_queue=None)
+            sockets.append(RemoteWebSocket(connection))
+        return sockets
+
+    async def disconnect_clients(self, user_ids: List[str], sockets):
+        for ws in sockets:
+            await ws.connection.close()
+            ws.reader.cancel()
+
+    async def seed_group_messages(self, creator: dict, group_id: str, count: int) -> List[str]:
+        ids = []
+
+        async def send(i: int):
+            response = await self.request("POST", "/messages", json_body={
+                "content": f"Сообщение {i} для проверки истории", "group_id": group_id
+            }, headers=creator["headers"])
+            ids.append(response.json()["id"])
+
+        await timed_calls(send, count, 64)
+        return ids
+
+
+# === Сценарии ===
+
+async def register(client, prefix: str) -> dict:
+    username = f"{prefix}_{uuid.uuid4().hex[:10]}"
+    response = await client.request("POST", "/register", json_body={
+        "username": username,
+        "email": f"{username}@company.com",
+        "password": PASSWORD,
+        "full_name": f"Bench {username}"
+    })
+    assert response.status_code == 200, response.content
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    me = (await client.request("GET", "/users/me", headers=headers)).json()
+    return {"id": me["id"], "username": username, "full_name": me["full_name"], "headers": headers}
+
+
+async def create_group(client, creator: dict, member_ids: List[str]) -> str:
+    response = await client.request("POST", "/groups", json_body={
+        "name": "bench", "description": None, "member_ids": member_ids
+    }, headers=creator["headers"])
+    assert response.status_code == 200, response.content
+    return response.json()["id"]
+
+
+async def bench_send(client, args) -> Dict[str, dict]:
+    sender, recipient = await register(client, "sender"), await register(client, "recipient")
+
+    async def send(i: int):
+        response = await client.request("POST", "/messages", json_body={
+            "content": f"Сообщение {i}", "recipient_id": recipient["id"]
+        }, headers=sender["headers"])
+        assert response.status_code == 200, response.content
+
+    latencies, seconds = await timed_calls(send, args.requests, args.concurrency)
+    return {"send": summarize(latencies, args.requests, seconds, client.server_pid, concurrency=args.concurrency)}
+
+
+async def bench_history(client, args) -> Dict[str, dict]:
+    results = {}
+    for size in args.history_sizes:
+        creator = await register(client, "history")
+        group_id = await create_group(client, creator, [])
+        started = time.perf_counter()
+        ids = await client.seed_group_messages(creator, group_id, size)
+        seed_seconds = time.perf_counter() - started
+
+        async def fetch(i: int):
+            params = {"group_id": group_id, "limit": str(args.page_size)}
+            # Каждый десятый запрос - последняя страница, остальные - вглубь истории
+            if i % 10:
+                params["before"] = random.choice(ids)
+            response = await client.request("GET", "/messages", params=params, headers=creator["headers"])
+            assert response.status_code == 200, response.content
+
+        latencies, seconds = await timed_calls(fetch, args.history_requests, args.concurrency)
+        results[f"history_{size}"] = summarize(
+            latencies, args.history_requests, seconds, client.server_pid,
+            messages=size, page_size=args.page_size, seed_seconds=round(seed_seconds, 1)
+        )
+    return results
+
+
+async def bench_broadcast(client, args) -> Dict[str, dict]:
+    results = {}
+    for members in args.members:
+        sender = await register(client, "broadcaster")
+        member_ids = [str(uuid.uuid4()) for _ in range(members)]
+        group_id = await create_group(client, sender, member_ids)
+        sockets = await client.connect_clients(member_ids)
+
+        latencies = []
+        start = time.perf_counter()
+        for round_number in range(1, args.rounds + 1):
+            sent = time.perf_counter()
+            response = await client.request("POST", "/messages", json_body={
+                "content": f"Рассылка {round_number}", "group_id": group_id
+            }, headers=sender["headers"])
+            assert response.status_code == 200, response.content
+            # Задержка рассылки - до получения сообщения последним клиентом
+            while any(ws.received < round_number for ws in sockets):
+                await asyncio.sleep(0 if isinstance(client, InProcessClient) else 0.001)
+            latencies.append(time.perf_counter() - sent)
+        seconds = time.perf_counter() - start
+
+        await client.disconnect_clients(member_ids, sockets)
+        result = summarize(latencies, args.rounds, seconds, client.server_pid, members=members)
+        result["deliveries_per_s"] = round(members * args.rounds / seconds, 1)
+        results[f"broadcast_{members}"] = result
+    return results
+
+
+async def bench_login(client, args) -> Dict[str, dict]:
+    users = [await register(client, "storm") for _ in range(args.login_users)]
+
+    async def login(i: int):
+        response = await client.request("POST", "/token", form={
+            "username": users[i % len(users)]["username"], "password": PASSWORD
+        })
+        assert response.status_code == 200, response.content
+
+    # Все логины сразу - как утром, когда офис открывает чат одновременно
+    latencies, seconds = await timed_calls(login, args.logins, args.logins)
+    return {"login": summarize(latencies, args.logins, seconds, client.server_pid, users=args.login_users)}
+
+
+async def bench_upload(client, args) -> Dict[str, dict]:
+    uploader = await register(client, "uploader")
+    boundary = uuid.uuid4().hex
+
+    def multipart(i: int) -> bytes:
+        # Разное содержимое, чтобы не срабатывала дедупликация по SHA-256
+        content = os.urandom(16) + bytes(args.upload_size - 16)
+        return (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="bench{i}.bin"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+
+    headers = {**uploader["headers"], "Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    async def upload(i: int):
+        response = await client.request("POST", "/upload", body=multipart(i), headers=headers)
+        assert response.status_code == 200, response.content
+
+    latencies, seconds = await timed_calls(upload, args.uploads, args.concurrency)
+    result = summarize(latencies, args.uploads, seconds, client.server_pid, size=args.upload_size)
+    result["mb_per_s"] = round(args.uploads * args.upload_size / seconds / 1024 / 1024, 1)
+    return {"upload": result}
+
+
+BENCHMARKS = {
+    "send": bench_send,
+    "history": bench_history,
+    "broadcast": bench_broadcast,
+    "login": bench_login,
+    "upload": bench_upload,
+}
+
+
+async def run(client, args) -> Dict[str, dict]:
+    results = {}
+    async with client.session():
+        for scenario in args.scenarios:
+            print(f"[{scenario}]", file=sys.stderr)
+            results.update(await BENCHMARKS[scenario](client, args))
+    return results
+
+
+# === Отчёт ===
+
+def git_commit() -> Optional[str]:
+    with contextlib.suppress(Exception):
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    return None
+
+
+def print_results(results: Dict[str, dict], previous: Optional[Dict[str, dict]] = None):
+    for name, result in results.items():
+        line = (f"  {name:18s} {result['throughput_per_s']:>10} ops/s  "
+                f"p50={result['p50_ms']} ms  p99={result['p99_ms']} ms  "
+                f"rss={result['rss_mb']} MB (peak {result['peak_rss_mb']})")
+        old = (previous or {}).get(name)
+        if old:
+            changes = []
+            for field, label in (("throughput_per_s", "ops/s"), ("p99_ms", "p99")):
+                if old.get(field):
+                    changes.append(f"{label} {(result[field] - old[field]) / old[field] * 100:+.1f}%")
+            line += "  [" + ", ".join(changes) + "]"
+        print(line)
+
+
+def parse_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        type=lambda value: [item for item in value.split(",") if item])
+    parser.add_argument("--url", help="адрес запущенного сервера вместо вызова в процессе")
+    parser.add_argument("--server-pid", type=int, help="pid сервера для замера RSS (с --url)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--history-sizes", type=parse_list, default=[10000, 1000000])
+    parser.add_argument("--history-requests", type=int, default=1000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--members", type=parse_list, default=[10, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--login-users", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--upload-size", type=int, default=256 * 1024)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл результатов (по умолчанию benchmarks/results/bench-<время>.json)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    client = RemoteClient(args.url, args.server_pid) if args.url else InProcessClient()
+    # Логирование отправок из main не относится к замерам - глушим его
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = asyncio.run(run(client, args))
+    finally:
+        shutil.rmtree(BENCH_UPLOAD_DIR, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": args.url or "in-process",
+            "storage_backend": os.getenv("STORAGE_BACKEND"),
+            "pubsub_backend": os.getenv("PUBSUB_BACKEND"),
+            "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "results": results
+    }
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)["results"]
+    print(f"Бенчмарк ({report['meta']['transport']}, commit {report['meta']['commit']}):")
+    print_results(results, previous)
+    print(f"Результаты: {output}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,129 @@
+"""
+Контентно-адресуемое хранилище файлов
+
+Содержимое загруженного файла хранится один раз под своим SHA-256. Сами
+загрузки (id, имя, тип, автор) - метаданные в Storage, там же счётчик
+ссылок на блоб. Повторная загрузка уже известного файла ничего нового не
+записывает: временный файл удаляется, в Storage добавляется только запись.
+
+Порядок сохранения - store_upload: сначала ссылка (короткая транзакция),
+потом блоб, без блокировок на время записи. Удаление последней ссылки
+удаляет и блоб под блокировкой sha256 в Storage, а новая ссылка на то же
+содержимое ждёт его конца и затем записывает блоб заново. Если записать
+блоб не удалось, ссылка снимается тем же удалением - повторный вызов
+безопасен. Падение процесса между ссылкой и записью оставляет запись
+без блоба (скачивание - 404), а не блоб без записи; следующая загрузка
+того же содержимого блоб восстановит.
+
+Бэкенд выбирается переменной FILE_STORAGE_BACKEND:
+
+- filesystem - UPLOAD_DIR/blobs/<первые 2 символа>/<sha256>, файлы
+  отдаёт само приложение (см. file_responses.py)
+- s3         - S3-совместимое хранилище (AWS S3, MinIO), файлы
+  скачиваются по presigned-ссылке мимо процесса (см. blobstore_s3.py)
+"""
+import os
+
+import aiofiles
+import aiofiles.os
+from starlette.requests import Request
+from starlette.responses import Response
+
+from file_responses import IMMUTABLE_CACHE_CONTROL, file_response
+from uploads import UPLOAD_DIR, discard_upload
+
+
+class BlobStore:
+    """Интерфейс хранилища блобов; file - метаданные загрузки из Storage"""
+
+    async def startup(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def put(self, upload: dict) -> bool:
+        """Сохранить принятый файл (см. uploads.receive_upload); False, если блоб уже был"""
+        raise NotImplementedError
+
+    async def delete(self, sha256: str):
+        raise NotImplementedError
+
+    async def read(self, sha256: str) -> bytes:
+        """Содержимое блоба целиком (для обработки на сервере, например превью)"""
+        raise NotImplementedError
+
+    async def download_response(self, request: Request, file: dict) -> Response:
+        """Ответ на скачивание; FileNotFoundError, если блоба нет"""
+        raise NotImplementedError
+
+
+class FilesystemBlobStore(BlobStore):
+    def __init__(self, root: str = os.path.join(UPLOAD_DIR, "blobs")):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    async def put(self, upload: dict) -> bool:
+        path = self.path(upload["sha256"])
+        if await aiofiles.os.path.exists(path):
+            await discard_upload(upload)
+            return False
+
+        await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+        await aiofiles.os.replace(upload["temp_path"], path)
+        return True
+
+    async def delete(self, sha256: str):
+        try:
+            await aiofiles.os.remove(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    async def read(self, sha256: str) -> bytes:
+        async with aiofiles.open(self.path(sha256), "rb") as f:
+            return await f.read()
+
+    async def download_response(self, request: Request, file: dict) -> Response:
+        return await file_response(
+            request, self.path(file["sha256"]),
+            etag=f'"{file["sha256"]}"',
+            media_type=file["content_type"],
+            cache_control=IMMUTABLE_CACHE_CONTROL
+        )
+
+
+async def store_upload(storage, blob_store: BlobStore, file: dict, upload: dict) -> bool:
+    """
+    Записать загрузку file (метаданные для Storage.add_file) с содержимым
+    upload; вернуть результат BlobStore.put. Временный файл при ошибке
+    удаляет вызывающий (uploads.discard_upload)
+    """
+    await storage.add_file(file)
+    try:
+        return await blob_store.put(upload)
+    except BaseException:
+        await storage.delete_file(file["id"], blob_store.delete)
+        raise
+
+
+def create_blob_store() -> BlobStore:
+    """Создать хранилище блобов по переменным окружения"""
+    backend = os.getenv("FILE_STORAGE_BACKEND", "filesystem")
+
+    if backend == "filesystem":
+        return FilesystemBlobStore()
+    if backend == "s3":
+        from blobstore_s3 import S3BlobStore
+        return S3BlobStore(
+            bucket=os.getenv("S3_BUCKET_NAME"),
+            region=os.getenv("S3_REGION"),
+            endpoint_url=os.getenv("S3_ENDPOINT_URL"),
+            public_endpoint_url=os.getenv("S3_PUBLIC_ENDPOINT_URL"),
+            access_key=os.getenv("S3_ACCESS_KEY"),
+            secret_key=os.getenv("S3_SECRET_KEY"),
+            presign_expires=int(os.getenv("S3_PRESIGN_EXPIRES", "3600")),
+            multipart_chunk_size=int(os.getenv("S3_MULTIPART_CHUNK_SIZE", str(8 * 1024 * 1024)))
+        )
+    raise ValueError(f"Unknown FILE_STORAGE_BACKEND: {backend}")
@@ -0,0 +1,147 @@
+"""
+S3-бэкенд хранилища блобов (AWS S3, MinIO и другие S3-совместимые)
+
+Блоб - объект blobs/<первые 2 символа>/<sha256> в S3_BUCKET_NAME.
+Принятый файл отправляется через managed transfer boto3: файлы больше
+S3_MULTIPART_CHUNK_SIZE уходят multipart upload'ом частями этого размера.
+boto3 синхронный, поэтому сетевые вызовы идут в потоках (asyncio.to_thread).
+
+Скачивание - редирект 307 на presigned GET-ссылку, байты файла идут из
+хранилища напрямую в клиент. Ссылка подписывается адресом
+S3_PUBLIC_ENDPOINT_URL, если хранилище доступно клиентам по другому
+адресу, чем приложению (например, MinIO в docker-compose).
+"""
+from typing import Optional
+import asyncio
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from starlette.requests import Request
+from starlette.responses import RedirectResponse, Response
+
+from blobstore import BlobStore
+from file_responses import IMMUTABLE_CACHE_CONTROL, etag_matches
+from uploads import discard_upload
+
+KEY_PREFIX = "blobs/"
+
+
+def _is_not_found(exc: ClientError) -> bool:
+    return exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NoSuchBucket", "NotFound")
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, region: Optional[str] = None,
+                 endpoint_url: Optional[str] = None, public_endpoint_url: Optional[str] = None,
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None,
+                 presign_expires: int = 3600, multipart_chunk_size: int = 8 * 1024 * 1024):
+        if not bucket:
+            raise ValueError("S3_BUCKET_NAME is required for FILE_STORAGE_BACKEND=s3")
+        self.bucket = bucket
+        self.region = region
+        self.endpoint_url = endpoint_url
+        self.public_endpoint_url = public_endpoint_url or endpoint_url
+        # Без ключей boto3 берёт учётные данные по стандартной цепочке (IAM-роль и т.п.)
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.presign_expires = presign_expires
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunk_size,
+            multipart_chunksize=multipart_chunk_size
+        )
+        self.client = None
+        self.presign_client = None
+
+    def _make_client(self, endpoint_url: Optional[str]):
+        return boto3.client(
+            "s3",
+            region_name=self.region,
+            endpoint_url=endpoint_url,
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key
+        )
+
+    async def startup(self):
+        self.client = self._make_client(self.endpoint_url)
+        self.presign_client = self._make_client(self.public_endpoint_url)
+        await asyncio.to_thread(self._ensure_bucket)
+
+    async def shutdown(self):
+        if self.client is not None:
+            self.client.close()
+            self.presign_client.close()
+            self.client = self.presign_client = None
+
+    def _ensure_bucket(self):
+        """Создать бакет, если его нет (локальный MinIO); нехватка прав - ошибка старта"""
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except ClientError as exc:
+            if not _is_not_found(exc):
+                raise
+            params = {"Bucket": self.bucket}
+            if self.region and self.region != "us-east-1":
+                params["CreateBucketConfiguration"] = {"LocationConstraint": self.region}
+            self.client.create_bucket(**params)
+
+    def key(self, sha256: str) -> str:
+        return f"{KEY_PREFIX}{sha256[:2]}/{sha256}"
+
+    def _exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError as exc:
+            if _is_not_found(exc):
+                return False
+            raise
+
+    async def put(self, upload: dict) -> bool:
+        key = self.key(upload["sha256"])
+        try:
+            if await asyncio.to_thread(self._exists, key):
+                return False
+            # Один блоб может принадлежать загрузкам с разными типами, поэтому
+            # Content-Type задаётся при подписи ссылки, а не у объекта
+            await asyncio.to_thread(
+                self.client.upload_file, upload["temp_path"], self.bucket, key,
+                ExtraArgs={"CacheControl": IMMUTABLE_CACHE_CONTROL},
+                Config=self.transfer_config
+            )
+            return True
+        finally:
+            await discard_upload(upload)
+
+    async def delete(self, sha256: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.key(sha256))
+
+    async def read(self, sha256: str) -> bytes:
+        def get_object() -> bytes:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(sha256))
+            with response["Body"] as body:
+                return body.read()
+        return await asyncio.to_thread(get_object)
+
+    async def download_response(self, request: Request, file: dict) -> Response:
+        etag = f'"{file["sha256"]}"'
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"etag": etag, "cache-control": IMMUTABLE_CACHE_CONTROL})
+
+        # Подпись считается локально, без запроса к хранилищу
+        url = self.presign_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(file["sha256"]),
+                "ResponseContentType": file["content_type"]
+            },
+            ExpiresIn=self.presign_expires
+        )
+        # Подпись меняется при каждом запросе; кешируемый редирект даёт
+        # браузеру один и тот же URL и, значит, попадание в его кеш
+        return RedirectResponse(
+            url, status_code=307,
+            headers={"cache-control": f"private, max-age={self.presign_expires // 2}"}
+        )
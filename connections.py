@@ -0,0 +1,201 @@
+"""
+Очередь отправки для WebSocket-подключения
+
+У каждого подключения своя ограниченная очередь исходящих событий и
+собственная задача-писатель, которая отправляет их в сокет. Рассылка в
+группу только кладёт событие в очереди участников и сразу возвращается,
+поэтому медленный мобильный клиент задерживает лишь собственную доставку.
+В очереди лежат готовые кадры (frames.Frame), писатель отправляет их текст
+без повторной сериализации.
+
+Переполнение очереди (WS_SEND_QUEUE_SIZE):
+
+- события "печатает" отбрасываются первыми: новые - как только очередь
+  заполнена наполовину, уже стоящие в очереди - чтобы освободить место
+  для сообщения;
+- если места всё равно нет, срабатывает WS_OVERFLOW_POLICY: disconnect
+  (закрыть подключение, клиент переподключится и догрузит историю) или
+  drop_oldest (выбросить самое старое событие);
+- если очередь держится выше половины дольше WS_BACKLOG_TIMEOUT секунд,
+  клиент считается зависшим и отключается.
+
+Склейка кадров (WS_COALESCE_WINDOW_MS, по умолчанию выключена): писатель,
+получив событие, ждёт окно в несколько миллисекунд и отправляет всё
+накопившееся одним кадром - JSON-массивом событий. Массив собирается из
+готовых текстов кадров, без повторной сериализации. "Печатает" от одного
+пользователя в одном чате попадает в кадр один раз. Одиночное событие
+уходит как обычно - объектом, поэтому клиент должен понимать оба вида.
+"""
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional
+import asyncio
+import logging
+import os
+import time
+
+from fastapi import WebSocket
+
+from frames import Frame
+from logs import get_logger, log_event
+from metrics import WS_FRAMES_DROPPED, WS_QUEUE_DEPTH, WS_SEND_DURATION
+
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "disconnect")  # disconnect | drop_oldest
+WS_BACKLOG_TIMEOUT = float(os.getenv("WS_BACKLOG_TIMEOUT", "10"))
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "0"))  # 0 - без склейки
+
+# Код закрытия "Try Again Later" для отключённых медленных клиентов
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+DROPPABLE_TYPES = ("typing",)
+
+logger = get_logger("ws")
+
+
+def is_droppable(frame: Frame) -> bool:
+    return frame.type in DROPPABLE_TYPES
+
+
+def coalesce(frames: List[Frame]) -> str:
+    """
+    Текст одного кадра для нескольких событий: JSON-массив их текстов.
+    Из повторных "печатает" (пользователь, чат) остаётся последнее.
+    """
+    typing_seen = set()
+    kept = []
+    for frame in reversed(frames):
+        if frame.type == "typing":
+            message = frame.message
+            key = (message.get("user_id"), message.get("group_id") or message.get("recipient_id"))
+            if key in typing_seen:
+                continue
+            typing_seen.add(key)
+        kept.append(frame.text)
+    if len(kept) == 1:
+        return kept[0]
+    kept.reverse()
+    return "[" + ",".join(kept) + "]"
+
+
+class ClientConnection:
+    """WebSocket пользователя с собственной очередью и задачей-писателем"""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user_id: str,
+        on_close: Callable[["ClientConnection"], Awaitable[None]],
+        max_queue: int = WS_SEND_QUEUE_SIZE,
+        overflow_policy: str = WS_OVERFLOW_POLICY,
+        backlog_timeout: float = WS_BACKLOG_TIMEOUT,
+        coalesce_window: float = WS_COALESCE_WINDOW_MS / 1000
+    ):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.max_queue = max_queue
+        self.high_watermark = max(1, max_queue // 2)
+        self.overflow_policy = overflow_policy
+        self.backlog_timeout = backlog_timeout
+        self.coalesce_window = coalesce_window
+        self.queue: Deque[Frame] = deque()
+        self.dropped = 0
+        self.closed = False
+        self._on_close = on_close
+        self._wakeup = asyncio.Event()
+        self._backlog_since: Optional[float] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def stop(self):
+        """Остановить писателя, не закрывая сокет"""
+        self.closed = True
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+
+    def send(self, frame: Frame) -> bool:
+        """Поставить кадр в очередь; False, если он отброшен"""
+        if self.closed:
+            return False
+
+        size = len(self.queue)
+        if size >= self.high_watermark:
+            if is_droppable(frame):
+                self.dropped += 1
+                WS_FRAMES_DROPPED.inc()
+                return False
+            now = time.monotonic()
+            if self._backlog_since is None:
+                self._backlog_since = now
+            elif now - self._backlog_since > self.backlog_timeout:
+                self._close_slow_consumer("sustained backlog")
+                return False
+
+        if size >= self.max_queue and not self._make_room():
+            return False
+
+        self.queue.append(frame)
+        WS_QUEUE_DEPTH.observe(len(self.queue))
+        self._wakeup.set()
+        return True
+
+    def _make_room(self) -> bool:
+        for queued in self.queue:
+            if is_droppable(queued):
+                self.queue.remove(queued)
+                self.dropped += 1
+                WS_FRAMES_DROPPED.inc()
+                return True
+
+        if self.overflow_policy == "drop_oldest":
+            self.queue.popleft()
+            self.dropped += 1
+            WS_FRAMES_DROPPED.inc()
+            return True
+
+        self._close_slow_consumer("send queue overflow")
+        return False
+
+    def _close_slow_consumer(self, reason: str):
+        log_event(logger, logging.WARNING, "ws.slow_consumer", user_id=self.user_id,
+                  reason=reason, queued=len(self.queue))
+        self.stop()
+        self.queue.clear()
+        asyncio.create_task(self._close(reason))
+
+    async def _close(self, reason: str):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason=reason)
+        except Exception:
+            pass  # Сокет уже закрыт
+        await self._on_close(self)
+
+    async def _write_loop(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+
+                if self.coalesce_window > 0:
+                    # Собрать события, пришедшие за окно, в один кадр
+                    await asyncio.sleep(self.coalesce_window)
+                    frames = list(self.queue)
+                    self.queue.clear()
+                    if not frames:
+                        continue
+                    text = coalesce(frames)
+                else:
+                    text = self.queue.popleft().text
+                with WS_SEND_DURATION.time():
+                    await self.websocket.send_text(text)
+
+                if self._backlog_since is not None and len(self.queue) < self.high_watermark:
+                    self._backlog_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log_event(logger, logging.WARNING, "ws.send_error", user_id=self.user_id, error=repr(e))
+            self.closed = True
+            await self._on_close(self)
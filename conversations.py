@@ -0,0 +1,87 @@
+"""
+Сводка чатов и курсоры прочтения
+
+Для каждого чата инкрементально (при добавлении сообщения) хранится
+число сообщений и последнее сообщение, а каждому сообщению присваивается
+порядковый номер в его чате. Курсор прочтения пользователя в чате - id
+последнего прочитанного сообщения и его номер, поэтому
+
+    непрочитанные = число сообщений чата - номер прочитанного
+
+считается за O(1), а список чатов с непрочитанными - за O(число чатов)
+без обхода истории.
+
+Ключ чата в хранилище - "group:<group_id>" или "dm:<dm_key>"
+(см. message_store.timeline_key). Отправитель своё сообщение считает
+прочитанным; получатель личного сообщения получает курсор с нулём, по
+нему же находится список личных переписок пользователя.
+"""
+from typing import Dict, List, Optional, Tuple
+
+Cursor = Tuple[Optional[str], int]  # (message_id, номер сообщения в чате)
+
+
+class ConversationIndex:
+    def __init__(self):
+        self.summaries: Dict[str, dict] = {}  # key -> {"message_count", "last_message"}
+        self.ordinals: Dict[str, Tuple[str, int]] = {}  # message_id -> (key, номер)
+        self.cursors: Dict[str, Dict[str, Cursor]] = {}  # user_id -> {key: курсор}
+
+    def record(self, key: str, message: dict):
+        """Учесть новое сообщение чата key"""
+        summary = self.summaries.setdefault(key, {"message_count": 0, "last_message": None})
+        summary["message_count"] += 1
+        summary["last_message"] = message
+        ordinal = summary["message_count"]
+        self.ordinals[message["id"]] = (key, ordinal)
+
+        self.cursors.setdefault(message["sender_id"], {})[key] = (message["id"], ordinal)
+        recipient_id = message.get("recipient_id")
+        if key.startswith("dm:") and recipient_id and recipient_id != message["sender_id"]:
+            self.cursors.setdefault(recipient_id, {}).setdefault(key, (None, 0))
+
+    def mark_read(self, user_id: str, key: str, message_id: Optional[str] = None) -> Optional[Cursor]:
+        """
+        Сдвинуть курсор пользователя до message_id (по умолчанию - до
+        последнего сообщения). Курсор назад не двигается. None, если
+        сообщение не из этого чата.
+        """
+        if message_id is None:
+            summary = self.summaries.get(key)
+            if summary is None:
+                return None
+            message_id = summary["last_message"]["id"]
+
+        position = self.ordinals.get(message_id)
+        if position is None or position[0] != key:
+            return None
+
+        cursors = self.cursors.setdefault(user_id, {})
+        current = cursors.get(key, (None, 0))
+        if position[1] > current[1]:
+            cursors[key] = (message_id, position[1])
+        return cursors[key]
+
+    def dm_keys(self, user_id: str) -> List[str]:
+        """Ключи личных переписок пользователя"""
+        return [key for key in self.cursors.get(user_id, {}) if key.startswith("dm:")]
+
+    def summaries_for(self, user_id: str, group_keys: List[str]) -> List[dict]:
+        """Сводки групп group_keys и всех личных переписок пользователя"""
+        cursors = self.cursors.get(user_id, {})
+        keys = list(group_keys) + self.dm_keys(user_id)
+
+        result = []
+        for key in keys:
+            summary = self.summaries.get(key)
+            if summary is None:
+                continue
+            read_message_id, read_ordinal = cursors.get(key, (None, 0))
+            result.append({
+                "key": key,
+                "message_count": summary["message_count"],
+                "unread_count": summary["message_count"] - read_ordinal,
+                "last_read_message_id": read_message_id,
+                "last_message": summary["last_message"],
+            })
+        return result
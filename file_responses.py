@@ -0,0 +1,134 @@
+"""
+Отдача файлов с валидаторами кеша и докачкой
+
+- ETag: для контентно-адресуемых файлов - SHA-256 содержимого, для
+  старых файлов - по mtime и размеру (как у Starlette FileResponse)
+- If-None-Match -> 304 без тела
+- Range: bytes=... -> 206 с одним диапазоном (If-Range учитывается),
+  невыполнимый диапазон -> 416
+- Cache-Control передаёт вызывающий: содержимое по id загрузки не
+  меняется, такие ответы кешируются как immutable
+"""
+from email.utils import formatdate
+from hashlib import md5
+from typing import AsyncIterator, Optional, Tuple
+import mimetypes
+import re
+
+import aiofiles
+import aiofiles.os
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Разобрать заголовок Range в (start, end) включительно.
+
+    None - заголовок не понят или диапазонов несколько: отдаём файл целиком,
+    как разрешает RFC 9110. RangeNotSatisfiable - диапазон вне файла.
+    """
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # bytes=-N - последние N байт
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), size - 1
+
+    start = int(start)
+    if end and int(end) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(int(end), size - 1) if end else size - 1
+
+
+def _opaque_tag(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Слабое сравнение для If-None-Match"""
+    if header.strip() == "*":
+        return True
+    return _opaque_tag(etag) in {_opaque_tag(tag) for tag in header.split(",")}
+
+
+def _if_range_matches(header: str, etag: str, last_modified: str) -> bool:
+    """If-Range: сильное сравнение ETag или точное совпадение даты"""
+    header = header.strip()
+    if header.startswith('"') or header.startswith("W/"):
+        return not etag.startswith("W/") and header == etag
+    return header == last_modified
+
+
+async def _read_range(path: str, start: int, end: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def file_response(request: Request, path: str, etag: Optional[str] = None,
+                        media_type: Optional[str] = None,
+                        cache_control: str = REVALIDATE_CACHE_CONTROL) -> Response:
+    """Ответ с файлом path; FileNotFoundError, если файла нет"""
+    stat_result = await aiofiles.os.stat(path)
+    size = stat_result.st_size
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    if etag is None:
+        etag_base = f"{stat_result.st_mtime}-{size}"
+        etag = f'"{md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    headers = {
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or _if_range_matches(if_range, etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+
+        if byte_range is not None:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+            return StreamingResponse(
+                _read_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+            )
+
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat_result)
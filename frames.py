@@ -0,0 +1,56 @@
+"""
+Заранее сериализованные WebSocket-кадры
+
+Событие кодируется в JSON один раз - при публикации - и дальше уходит
+всем получателям готовым текстом через send_text. Раньше send_json
+заново вызывал json.dumps для каждого участника группы.
+
+Если установлен orjson, кодирование идёт через него; формат совпадает с
+send_json (компактные разделители, не-ASCII символы как есть).
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен
+    orjson = None
+
+
+def dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+def dumps_bytes(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return dumps(data).encode("utf-8")
+
+
+def loads(text: str):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class Frame:
+    """Событие вместе с его JSON-текстом"""
+
+    __slots__ = ("message", "text")
+
+    def __init__(self, message: dict, text: str):
+        self.message = message
+        self.text = text
+
+    @classmethod
+    def encode(cls, message: dict) -> "Frame":
+        return cls(message, dumps(message))
+
+    @classmethod
+    def decode(cls, text: str) -> "Frame":
+        return cls(loads(text), text)
+
+    @property
+    def type(self):
+        return self.message.get("type")
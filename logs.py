@@ -0,0 +1,133 @@
+"""
+Структурированное логирование без блокировки event loop
+
+Записи логов кладутся в очередь (QueueHandler), а форматирование и
+запись в stdout делает отдельный поток (QueueListener) - обработчик
+в event loop не ждёт вывода. Каждая запись - событие с именем и полями:
+
+    log_event(logger, logging.INFO, "ws.connect", user_id=..., connections=...)
+
+и выводится одной JSON-строкой (LOG_FORMAT=json) или текстом
+(LOG_FORMAT=text):
+
+    {"ts": "...", "level": "INFO", "logger": "chat.ws", "event": "ws.connect", "user_id": "...", "connections": 12}
+
+Частые события сэмплируются: LOG_SAMPLE_RATES="ws.send=0.001,ws.connect=0.1"
+оставляет соответствующую долю записей (по умолчанию - все). Уровень и
+сэмплирование проверяются до создания записи, поэтому отброшенное
+событие почти ничего не стоит.
+
+Настройки: LOG_LEVEL (INFO), LOG_FORMAT (json), LOG_SAMPLE_RATES.
+"""
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+import json
+import logging
+import os
+import queue
+import random
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """ "ws.send=0.01,ws.connect=1" -> {"ws.send": 0.01, "ws.connect": 1.0}"""
+    rates = {}
+    for item in value.split(","):
+        event, _, rate = item.strip().partition("=")
+        if event and rate:
+            rates[event] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        # Поля из extra= обычного logger.info(..., extra={...})
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key not in ("event", "fields"):
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """Запись уходит в очередь как есть: форматирование - в потоке-писателе"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT):
+    """Направить логгер "chat" через очередь в поток-писатель (идемпотентно)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    logger = logging.getLogger("chat")
+    logger.setLevel(level)
+    logger.handlers = [_DeferredQueueHandler(log_queue)]
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Дописать очередь и остановить поток-писатель"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"chat.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """Записать событие event с полями, если уровень включён и событие прошло сэмплирование"""
+    if not logger.isEnabledFor(level):
+        return
+    rate = SAMPLE_RATES.get(event)
+    if rate is not None:
+        if rate <= 0 or random.random() >= rate:
+            return
+        fields["sample_rate"] = rate
+    logger.log(level, event, extra={"event": event, "fields": fields})
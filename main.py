@@ -1,19 +1,59 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, UploadFile, File
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Query, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel, EmailStr, Field
+from typing import Callable, List, Optional, Dict, Set
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
 import jwt
-import bcrypt
 import asyncio
 import json
 import uuid
 import os
-
-app = FastAPI(title="Corporate Chat API", version="1.0.0")
+import aiofiles.os
+import logging
+
+from storage import create_storage
+from message_store import dm_key
+from passwords import hash_password, verify_password
+import passwords
+from auth_cache import PrincipalCache
+from connections import ClientConnection
+from frames import Frame
+from pubsub import BROADCAST_CHANNEL, CONTROL_CHANNEL, DeliveryBus, create_bus, group_channel, parse_channel, user_channel
+from uploads import MAX_FILE_SIZE, UPLOAD_DIR, InvalidUpload, UploadTooLarge, receive_upload, safe_extension, discard_upload
+from blobstore import create_blob_store, store_upload
+from file_responses import file_response
+from thumbnails import ThumbnailPipeline
+from logs import get_logger, log_event, setup_logging, shutdown_logging
+from metrics import (
+    BROADCAST_DURATION, BROADCAST_FANOUT, CONTENT_TYPE as METRICS_CONTENT_TYPE, MESSAGES, REGISTRY,
+    WS_CONNECTIONS, LoopLagMonitor, MetricsMiddleware
+)
+from profiling import CPROFILE_SORT_KEYS, ProfilingMiddleware, profiler
+from serialization import JSONBody, model_fields, project
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    await storage.startup()
+    await blob_store.startup()
+    await thumbnails.startup()
+    await manager.startup()
+    await loop_lag_monitor.startup()
+    yield
+    await profiler.shutdown()
+    await loop_lag_monitor.shutdown()
+    await manager.shutdown()
+    await thumbnails.shutdown()
+    await blob_store.shutdown()
+    await storage.shutdown()
+    passwords.shutdown()
+    shutdown_logging()
+
+app = FastAPI(title="Corporate Chat API", version="1.0.0", lifespan=lifespan)
 
 # Подключение статических файлов
 if os.path.exists("web"):
@@ -28,64 +68,204 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Задержки и статусы запросов по маршрутам для /metrics (см. metrics.py)
+app.add_middleware(MetricsMiddleware)
+loop_lag_monitor = LoopLagMonitor()
+
+# Выборочное профилирование, включается через /admin/profiling (см. profiling.py)
+app.add_middleware(ProfilingMiddleware)
+
 # Конфигурация (позже вынести в .env)
 SECRET_KEY = "your-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
+MAX_PAGE_SIZE = 500  # Максимум сообщений в одной странице истории
+MAX_BATCH_CONVERSATIONS = 500  # Максимум чатов в одном пакетном запросе истории
+MAX_BATCH_MESSAGES = 50  # Максимум последних сообщений на чат в пакетном запросе
+MAX_SEARCH_QUERY_LENGTH = 200  # Максимальная длина поискового запроса
+MAX_RESUME_MESSAGES = 200  # Максимум сообщений в кадре sync (дальше клиент повторяет resume)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Временное хранилище (позже заменить на PostgreSQL)
-users_db: Dict[str, dict] = {}
-messages_db: List[dict] = []
-groups_db: Dict[str, dict] = {}
+# Кеш пользователей по токену для get_current_user (см. auth_cache.py)
+principal_cache = PrincipalCache()
+
+# Хранилище: PostgreSQL или память процесса (STORAGE_BACKEND, см. storage.py)
+storage = create_storage()
+
+# Содержимое файлов: диск или S3 (FILE_STORAGE_BACKEND, см. blobstore.py)
+blob_store = create_blob_store()
+
+# Фоновое построение превью изображений (см. thumbnails.py)
+thumbnails = ThumbnailPipeline(storage, blob_store)
 
 # WebSocket менеджер для real-time сообщений
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-        self.user_groups: Dict[str, List[str]] = {}  # user_id -> [group_ids]
+    """
+    Локальные WebSocket-подключения узла.
+
+    Отправка публикует событие в шину (см. pubsub.py), а доставка в сокеты
+    идёт из обработчика шины - так события доходят до пользователей,
+    подключённых к любому воркеру. Узел подписан только на каналы своих
+    пользователей и групп, в которых они состоят. Доставка лишь ставит
+    событие в очередь подключения (см. connections.py), рассылка не ждёт
+    медленных клиентов.
+    """
+
+    def __init__(self, bus: DeliveryBus):
+        self.bus = bus
+        self.active_connections: Dict[str, ClientConnection] = {}
+        self.user_groups: Dict[str, Set[str]] = {}  # user_id -> {group_ids} для подключённых пользователей
+        self.local_group_members: Dict[str, Set[str]] = {}  # group_id -> {подключённые user_ids}
+        self.control_handlers: Dict[str, Callable[[dict], None]] = {}  # type -> обработчик
+
+    async def startup(self):
+        await self.bus.startup(self._deliver)
+        await self.bus.subscribe(BROADCAST_CHANNEL)
+        await self.bus.subscribe(CONTROL_CHANNEL)
+
+    async def shutdown(self):
+        await self.bus.shutdown()
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-        print(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
-
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            print(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
+        connection = ClientConnection(websocket, user_id, on_close=self._on_connection_closed)
+        previous = self.active_connections.get(user_id)
+        self.active_connections[user_id] = connection
+        connection.start()
+        WS_CONNECTIONS.set(len(self.active_connections))
+
+        # При переподключении подписки уже есть - меняется только сокет
+        if previous is not None:
+            previous.stop()
+        else:
+            self.user_groups[user_id] = set()
+            await self.bus.subscribe(user_channel(user_id))
+            for group_id in await storage.list_user_group_ids(user_id):
+                await self._join_group(user_id, group_id)
+
+        log_event(ws_logger, logging.INFO, "ws.connect", user_id=user_id,
+                  connections=len(self.active_connections), reconnect=previous is not None)
+
+    async def disconnect(self, user_id: str, websocket: Optional[WebSocket] = None):
+        if user_id not in self.active_connections:
+            return
+        # Старый сокет закрылся уже после переподключения пользователя
+        if websocket is not None and self.active_connections[user_id].websocket is not websocket:
+            return
+
+        # Локальное состояние снимается целиком до первого await: если
+        # пользователь переподключится во время отписки в шине, connect
+        # начнёт с чистого листа, а не потеряет группы нового подключения
+        self.active_connections.pop(user_id).stop()
+        WS_CONNECTIONS.set(len(self.active_connections))
+        released_groups = []
+        for group_id in self.user_groups.pop(user_id, []):
+            members = self.local_group_members.get(group_id)
+            if members is None:
+                continue
+            members.discard(user_id)
+            if not members:
+                del self.local_group_members[group_id]
+                released_groups.append(group_id)
+
+        await self._release_channel(user_channel(user_id), lambda: user_id in self.active_connections)
+        for group_id in released_groups:
+            await self._release_channel(group_channel(group_id), lambda: group_id in self.local_group_members)
+
+        log_event(ws_logger, logging.INFO, "ws.disconnect", user_id=user_id,
+                  connections=len(self.active_connections))
+
+    async def _release_channel(self, channel: str, in_use: Callable[[], bool]):
+        """Отписаться от канала, если он не занят снова (переподключением или новым участником)"""
+        if in_use():
+            return
+        await self.bus.unsubscribe(channel)
+        # Подписка, сделанная во время отписки, могла ей уступить - вернуть её
+        if in_use():
+            await self.bus.subscribe(channel)
 
     async def send_personal_message(self, message: dict, user_id: str):
-        if user_id in self.active_connections:
-            try:
-                print(f"[WebSocket] Sending to {user_id}: file_url={message.get('file_url')}, file_name={message.get('file_name')}, file_size={message.get('file_size')}")
-                await self.active_connections[user_id].send_json(message)
-            except Exception as e:
-                print(f"Error sending to {user_id}: {e}")
-                self.disconnect(user_id)
+        await self.bus.publish(user_channel(user_id), Frame.encode(message))
 
     async def broadcast_to_group(self, message: dict, group_id: str):
-        """Отправить сообщение всем участникам группы"""
-        if group_id in groups_db:
-            members = groups_db[group_id].get("members", [])
-            for member_id in members:
-                await self.send_personal_message(message, member_id)
+        """Отправить сообщение всем участникам группы (JSON кодируется один раз)"""
+        await self.bus.publish(group_channel(group_id), Frame.encode(message))
 
     async def broadcast_to_all(self, message: dict):
         """Отправить всем подключенным пользователям"""
-        disconnected = []
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                print(f"Error broadcasting to {user_id}: {e}")
-                disconnected.append(user_id)
-
-        for user_id in disconnected:
-            self.disconnect(user_id)
-
-manager = ConnectionManager()
+        await self.bus.publish(BROADCAST_CHANNEL, Frame.encode(message))
+
+    async def publish_control(self, message: dict):
+        """Служебное событие для всех узлов (обрабатывается в control_handlers)"""
+        await self.bus.publish(CONTROL_CHANNEL, Frame.encode(message))
+
+    async def notify_group_members_added(self, group_id: str, member_ids: List[str]):
+        """Сообщить новым участникам о группе; их узлы подпишутся на её канал"""
+        for member_id in member_ids:
+            await self.send_personal_message({"type": "group_added", "group_id": group_id}, member_id)
+
+    async def _join_group(self, user_id: str, group_id: str):
+        groups = self.user_groups.get(user_id)
+        if groups is None or group_id in groups:
+            return
+
+        groups.add(group_id)
+        members = self.local_group_members.get(group_id)
+        if members is None:
+            members = self.local_group_members[group_id] = set()
+            await self.bus.subscribe(group_channel(group_id))
+        members.add(user_id)
+
+    async def _deliver(self, channel: str, frame: Frame):
+        """Доставить кадр из шины в локальные сокеты"""
+        kind, target = parse_channel(channel)
+        if kind == "control":
+            handler = self.control_handlers.get(frame.type)
+            if handler is not None:
+                handler(frame.message)
+            return
+
+        with profiler.sample(f"broadcast:{kind}"):
+            if kind == "user":
+                if frame.type == "group_added":
+                    await self._join_group(target, frame.message["group_id"])
+                recipients = [target]
+            elif kind == "group":
+                recipients = list(self.local_group_members.get(target, ()))
+            else:
+                recipients = list(self.active_connections)
+
+            with BROADCAST_DURATION.time((kind,)):
+                for user_id in recipients:
+                    self.send_local(frame, user_id)
+            BROADCAST_FANOUT.observe(len(recipients), (kind,))
+
+    def send_local(self, frame: Frame, user_id: str):
+        """Поставить кадр в очередь локального подключения пользователя"""
+        connection = self.active_connections.get(user_id)
+        if connection is None:
+            return
+        # На каждого получателя - только DEBUG и с сэмплированием (LOG_SAMPLE_RATES)
+        log_event(ws_logger, logging.DEBUG, "ws.send", user_id=user_id, type=frame.type,
+                  message_id=frame.message.get("id"), file_url=frame.message.get("file_url"))
+        connection.send(frame)
+
+    async def _on_connection_closed(self, connection: ClientConnection):
+        await self.disconnect(connection.user_id, connection.websocket)
+
+ws_logger = get_logger("ws")
+manager = ConnectionManager(create_bus())
+
+PONG_FRAME = Frame.encode({"type": "pong"})
+WS_COMMANDS = ("ping", "resume", "typing")  # метки профилирования, остальное - "ws:other"
+
+# Изменение или удаление пользователя на любом узле сбрасывает его кеш везде
+manager.control_handlers["principal_revoked"] = lambda message: principal_cache.invalidate_user(message["user_id"])
+
+async def revoke_principal(user_id: str):
+    principal_cache.invalidate_user(user_id)
+    await manager.publish_control({"type": "principal_revoked", "user_id": user_id})
 
 # Pydantic модели
 class UserCreate(BaseModel):
@@ -121,6 +301,11 @@ class GroupCreate(BaseModel):
     description: Optional[str] = None
     member_ids: List[str] = []
 
+class FilePreview(BaseModel):
+    url: str
+    width: int
+    height: int
+
 class MessageResponse(BaseModel):
     id: str
     sender_id: str
@@ -133,6 +318,34 @@ class MessageResponse(BaseModel):
     file_url: Optional[str] = None
     file_name: Optional[str] = None
     file_size: Optional[int] = None
+    file_width: Optional[int] = None
+    file_height: Optional[int] = None
+    file_previews: Optional[Dict[str, FilePreview]] = None  # "small", "medium"
+    seq: Optional[int] = None  # Глобальный номер сообщения (для /sync)
+
+class ConversationBatchRequest(BaseModel):
+    conversations: List[str] = Field(max_length=MAX_BATCH_CONVERSATIONS)  # "user:<id>" или "group:<id>"
+    limit: int = Field(1, ge=0, le=MAX_BATCH_MESSAGES)  # 0 - только число сообщений
+
+class ConversationHistory(BaseModel):
+    conversation: str
+    total: int  # Всего сообщений в чате
+    messages: List[MessageResponse]  # Последние limit сообщений, от старых к новым
+
+class SyncResponse(BaseModel):
+    messages: List[MessageResponse]  # По возрастанию seq
+    last_seq: int  # Передать как since в следующий запрос
+    has_more: bool
+
+class ConversationSummary(BaseModel):
+    conversation: str  # "user:<id>" или "group:<id>"
+    message_count: int
+    unread_count: int
+    last_read_message_id: Optional[str] = None
+    last_message: Optional[MessageResponse] = None
+
+class ReadMarker(BaseModel):
+    message_id: Optional[str] = None  # По умолчанию - последнее сообщение чата
 
 class GroupResponse(BaseModel):
     id: str
@@ -142,6 +355,11 @@ class GroupResponse(BaseModel):
     created_at: datetime
     created_by: str
 
+# Списочные ответы собираются из dict без моделей (см. serialization.py)
+MESSAGE_RESPONSE_FIELDS = model_fields(MessageResponse)
+PREVIEW_FIELDS = model_fields(FilePreview)
+GROUP_RESPONSE_FIELDS = model_fields(GroupResponse)
+
 # Утилиты для JWT
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
@@ -150,27 +368,35 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str):
+def decode_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+        if payload.get("sub") is None:
             return None
-        return username
+        return payload
     except jwt.ExpiredSignatureError:
         return None
-    except jwt.JWTError:
+    except jwt.PyJWTError:
         return None
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    username = verify_token(token)
-    if username is None or username not in users_db:
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
+    # Сброс кеша во время чтения пользователя не должен потеряться (см. auth_cache.py)
+    generation = principal_cache.generation
+    payload = decode_token(token)
+    user = await storage.get_user_by_username(payload["sub"]) if payload else None
+    if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return users_db[username]
+
+    principal_cache.put(token, user, payload["exp"], generation)
+    return user
 
 async def get_admin_user(current_user: dict = Depends(get_current_user)):
     if current_user.get("role") != "admin":
@@ -180,12 +406,6 @@ async def get_admin_user(current_user: dict = Depends(get_current_user)):
         )
     return current_user
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
-
 # API Endpoints
 
 @app.get("/")
@@ -207,6 +427,11 @@ async def root():
         }
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus (см. metrics.py)"""
+    return Response(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/api")
 async def api_info():
     return {
@@ -223,31 +448,33 @@ async def api_info():
 
 @app.post("/register", response_model=Token)
 async def register(user: UserCreate):
-    if user.username in users_db:
+    if await storage.get_user_by_username(user.username) is not None:
         raise HTTPException(status_code=400, detail="Username already exists")
+    if await storage.get_user_by_email(user.email) is not None:
+        raise HTTPException(status_code=400, detail="Email already registered")
 
     user_id = str(uuid.uuid4())
 
     # Первый зарегистрированный пользователь становится админом
-    role = "admin" if len(users_db) == 0 else (user.role if user.role in ["user", "admin"] else "user")
+    role = "admin" if await storage.count_users() == 0 else (user.role if user.role in ["user", "admin"] else "user")
 
-    users_db[user.username] = {
+    await storage.create_user({
         "id": user_id,
         "username": user.username,
         "email": user.email,
         "full_name": user.full_name,
         "role": role,
-        "password_hash": hash_password(user.password),
+        "password_hash": await hash_password(user.password),
         "created_at": datetime.utcnow().isoformat()
-    }
+    })
 
     access_token = create_access_token(data={"sub": user.username, "user_id": user_id})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = users_db.get(form_data.username)
-    if not user or not verify_password(form_data.password, user["password_hash"]):
+    user = await storage.get_user_by_username(form_data.username)
+    if not user or not await verify_password(form_data.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -276,9 +503,38 @@ async def get_users(current_user: dict = Depends(get_current_user)):
             "username": user["username"],
             "full_name": user["full_name"]
         }
-        for user in users_db.values()
+        for user in await storage.list_users()
     ]
 
+def message_file_id(message: dict) -> Optional[str]:
+    """id загрузки из file_url вида /files/<file_id>.<ext>"""
+    file_url = message.get("file_url")
+    if not file_url or not file_url.startswith("/files/"):
+        return None
+    return file_url[len("/files/"):].split(".", 1)[0]
+
+async def message_files(messages: List[dict]) -> Dict[str, dict]:
+    """Метаданные файлов страницы сообщений одним запросом к хранилищу"""
+    file_ids = {message_file_id(msg) for msg in messages} - {None}
+    return await storage.get_files(list(file_ids)) if file_ids else {}
+
+def file_preview_fields(message: dict, files: Dict[str, dict]) -> dict:
+    file = files.get(message_file_id(message))
+    if not file or not file.get("previews"):
+        return {}
+    return {"file_width": file["width"], "file_height": file["height"], "file_previews": file["previews"]}
+
+def message_json(message: dict, files: Dict[str, dict]) -> dict:
+    """Сообщение с превью файла в виде MessageResponse, готовое для JSONBody"""
+    data = project(message, MESSAGE_RESPONSE_FIELDS)
+    preview_fields = file_preview_fields(message, files)
+    if preview_fields:
+        data.update(preview_fields)
+        data["file_previews"] = {
+            size: project(preview, PREVIEW_FIELDS) for size, preview in preview_fields["file_previews"].items()
+        }
+    return data
+
 @app.post("/messages", response_model=MessageResponse)
 async def send_message(message: MessageCreate, current_user: dict = Depends(get_current_user)):
     if not message.recipient_id and not message.group_id:
@@ -301,7 +557,12 @@ async def send_message(message: MessageCreate, current_user: dict = Depends(get_
         "file_size": message.file_size
     }
 
-    messages_db.append(message_data)
+    message_data["seq"] = await storage.add_message(message_data)
+    MESSAGES.inc(1, (msg_type,))
+
+    # Превью не хранятся в сообщении, а берутся из метаданных файла
+    files = await message_files([message_data])
+    message_data = {**message_data, **file_preview_fields(message_data, files)}
 
     # Отправить через WebSocket
     if message.group_id:
@@ -319,37 +580,172 @@ async def send_message(message: MessageCreate, current_user: dict = Depends(get_
 async def get_messages(
     recipient_id: Optional[str] = None,
     group_id: Optional[str] = None,
-    limit: int = 50,
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    """Получить историю сообщений"""
-    filtered_messages = []
+    """
+    Получить историю сообщений
 
-    for msg in messages_db:
-        if group_id and msg.get("group_id") == group_id:
-            filtered_messages.append(msg)
+    Курсоры before/after (id сообщения или ISO timestamp) листают историю:
+    before - страница более старых сообщений, after - более новых.
+    """
+    try:
+        if group_id:
+            filtered_messages = await storage.group_history(group_id, limit, before, after)
         elif recipient_id:
             # Личные сообщения между current_user и recipient_id
-            if (msg.get("sender_id") == current_user["id"] and msg.get("recipient_id") == recipient_id) or \
-               (msg.get("sender_id") == recipient_id and msg.get("recipient_id") == current_user["id"]):
-                filtered_messages.append(msg)
-        elif not group_id and not recipient_id:
+            filtered_messages = await storage.dm_history(current_user["id"], recipient_id, limit, before, after)
+        else:
             # Все сообщения пользователя
-            if msg.get("sender_id") == current_user["id"] or msg.get("recipient_id") == current_user["id"]:
-                filtered_messages.append(msg)
+            filtered_messages = await storage.user_history(current_user["id"], limit, before, after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    files = await message_files(filtered_messages)
+    return JSONBody([message_json(msg, files) for msg in filtered_messages])
+
+async def sync_page(user_id: str, since: int, limit: int) -> dict:
+    """Сообщения пользователя после глобального номера since (с превью файлов)"""
+    messages = await storage.sync_messages(user_id, since, limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    files = await message_files(messages)
+    return {
+        "messages": [message_json(msg, files) for msg in messages],
+        "last_seq": messages[-1]["seq"] if messages else since,
+        "has_more": has_more
+    }
 
-    # Сортировать по времени от старых к новым
-    filtered_messages.sort(key=lambda x: x.get("timestamp", ""))
+@app.get("/sync", response_model=SyncResponse)
+async def sync_messages(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Сообщения всех чатов пользователя после глобального номера since
+
+    Клиент запоминает наибольший seq полученных сообщений и после
+    переподключения забирает только пропущенное (то же делает WebSocket-
+    команда {"type": "resume", "since": <seq>}). При has_more - повторить
+    запрос с since=last_seq.
+    """
+    return JSONBody(await sync_page(current_user["id"], since, limit))
+
+@app.get("/messages/search", response_model=List[MessageResponse])
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_QUERY_LENGTH),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Поиск по тексту сообщений и именам файлов
 
-    # Взять последние limit сообщений
-    filtered_messages = filtered_messages[-limit:]
+    Ищутся сообщения, содержащие все слова запроса (в любой форме), в
+    группах пользователя и его личных переписках; от новых к старым.
+    Следующая страница - before=<id последнего сообщения>.
+    """
+    try:
+        found = await storage.search_messages(current_user["id"], q, limit, before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    files = await message_files(found)
+    return JSONBody([message_json(msg, files) for msg in found])
+
+@app.post("/messages/batch", response_model=List[ConversationHistory])
+async def get_messages_batch(batch: ConversationBatchRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Последние сообщения и число сообщений сразу для многих чатов
+
+    Заменяет запрос истории на каждый чат при загрузке списка контактов.
+    Группы, в которых пользователь не состоит, в ответ не попадают.
+    """
+    group_ids, peer_ids = [], []
+    conversations = list(dict.fromkeys(batch.conversations))
+    for key in conversations:
+        kind, _, target = key.partition(":")
+        if kind == "group" and target:
+            group_ids.append(target)
+        elif kind == "user" and target:
+            peer_ids.append(target)
+        else:
+            raise HTTPException(status_code=400, detail=f"Invalid conversation key: {key}")
+
+    if group_ids:
+        member_of = set(await storage.list_user_group_ids(current_user["id"]))
+        group_ids = [group_id for group_id in group_ids if group_id in member_of]
+
+    latest = await storage.latest_messages(current_user["id"], group_ids, peer_ids, batch.limit)
+    files = await message_files([msg for _, messages in latest.values() for msg in messages])
+
+    return JSONBody([
+        {
+            "conversation": key,
+            "total": latest[key][0],
+            "messages": [message_json(msg, files) for msg in latest[key][1]]
+        }
+        for key in conversations if key in latest
+    ])
+
+def api_conversation_key(key: str, user_id: str) -> str:
+    """Ключ чата в хранилище (group:<id>, dm:<a>:<b>) -> ключ API"""
+    if key.startswith("dm:"):
+        user_a, _, user_b = key[len("dm:"):].partition(":")
+        return f"user:{user_b if user_a == user_id else user_a}"
+    return key
+
+@app.get("/conversations", response_model=List[ConversationSummary])
+async def get_conversations(current_user: dict = Depends(get_current_user)):
+    """
+    Список чатов пользователя с числом непрочитанных и последним сообщением
+
+    Сводки поддерживаются при добавлении сообщений, поэтому запрос не
+    обходит историю. Сначала чаты с самыми свежими сообщениями.
+    """
+    summaries = await storage.conversation_summaries(current_user["id"])
+    summaries.sort(
+        key=lambda summary: summary["last_message"]["timestamp"] if summary["last_message"] else "",
+        reverse=True
+    )
+    files = await message_files([summary["last_message"] for summary in summaries if summary["last_message"]])
+
+    return JSONBody([
+        {
+            "conversation": api_conversation_key(summary["key"], current_user["id"]),
+            "message_count": summary["message_count"],
+            "unread_count": summary["unread_count"],
+            "last_read_message_id": summary["last_read_message_id"],
+            "last_message": message_json(summary["last_message"], files) if summary["last_message"] else None
+        }
+        for summary in summaries
+    ])
 
-    result = []
-    for msg in filtered_messages:
-        msg_copy = msg.copy()
-        msg_copy["timestamp"] = datetime.fromisoformat(msg["timestamp"])
-        result.append(MessageResponse(**msg_copy))
-    return result
+@app.post("/conversations/{conversation}/read")
+async def mark_conversation_read(
+    conversation: str,
+    marker: Optional[ReadMarker] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Отметить чат прочитанным до сообщения message_id (или целиком)"""
+    kind, _, target = conversation.partition(":")
+    if kind == "group" and target:
+        if not await storage.is_group_member(target, current_user["id"]):
+            raise HTTPException(status_code=403, detail="Not a member of this group")
+        key = conversation
+    elif kind == "user" and target:
+        key = f"dm:{dm_key(current_user['id'], target)}"
+    else:
+        raise HTTPException(status_code=400, detail=f"Invalid conversation key: {conversation}")
+
+    message_id = marker.message_id if marker else None
+    cursor = await storage.mark_read(current_user["id"], key, message_id)
+    if cursor is None:
+        raise HTTPException(status_code=404, detail="Message not found in this conversation")
+    return {"conversation": conversation, **cursor}
 
 @app.post("/groups", response_model=GroupResponse)
 async def create_group(group: GroupCreate, current_user: dict = Depends(get_current_user)):
@@ -367,7 +763,8 @@ async def create_group(group: GroupCreate, current_user: dict = Depends(get_curr
         "created_by": current_user["id"]
     }
 
-    groups_db[group_id] = group_data
+    await storage.create_group(group_data)
+    await manager.notify_group_members_added(group_id, members)
 
     group_data_copy = group_data.copy()
     group_data_copy["created_at"] = datetime.fromisoformat(group_data["created_at"])
@@ -376,28 +773,17 @@ async def create_group(group: GroupCreate, current_user: dict = Depends(get_curr
 @app.get("/groups", response_model=List[GroupResponse])
 async def get_groups(current_user: dict = Depends(get_current_user)):
     """Получить список групп пользователя"""
-    user_groups = [
-        group for group in groups_db.values()
-        if current_user["id"] in group["members"]
-    ]
-
-    result = []
-    for group in user_groups:
-        group_copy = group.copy()
-        group_copy["created_at"] = datetime.fromisoformat(group["created_at"])
-        result.append(GroupResponse(**group_copy))
-    return result
+    user_groups = await storage.list_user_groups(current_user["id"])
+    return JSONBody([project(group, GROUP_RESPONSE_FIELDS) for group in user_groups])
 
 @app.get("/groups/{group_id}", response_model=GroupResponse)
 async def get_group(group_id: str, current_user: dict = Depends(get_current_user)):
-    if group_id not in groups_db:
-        raise HTTPException(status_code=404, detail="Group not found")
-
-    group = groups_db[group_id]
-
-    if current_user["id"] not in group["members"]:
+    if not await storage.is_group_member(group_id, current_user["id"]):
+        if await storage.get_group(group_id) is None:
+            raise HTTPException(status_code=404, detail="Group not found")
         raise HTTPException(status_code=403, detail="Not a member of this group")
 
+    group = await storage.get_group(group_id)
     group_copy = group.copy()
     group_copy["created_at"] = datetime.fromisoformat(group["created_at"])
     return GroupResponse(**group_copy)
@@ -408,60 +794,127 @@ async def add_group_members(
     member_ids: List[str],
     current_user: dict = Depends(get_current_user)
 ):
-    if group_id not in groups_db:
+    group = await storage.get_group(group_id)
+    if group is None:
         raise HTTPException(status_code=404, detail="Group not found")
 
-    group = groups_db[group_id]
-
-    if current_user["id"] not in group["members"]:
+    if not await storage.is_group_member(group_id, current_user["id"]):
         raise HTTPException(status_code=403, detail="Not a member of this group")
 
     # Добавить новых участников
-    group["members"] = list(set(group["members"] + member_ids))
-
-    return {"message": "Members added successfully", "members": group["members"]}
+    existing = set(group["members"])
+    new_member_ids = [m for m in dict.fromkeys(member_ids) if m not in existing]
+    members = await storage.add_group_members(group_id, member_ids)
+    await manager.notify_group_members_added(group_id, new_member_ids)
+
+    return {"message": "Members added successfully", "members": members}
+
+# Тело запроса разбирается вручную (uploads.receive_upload), схема формы
+# описана здесь только для документации OpenAPI
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
 
-@app.post("/upload")
+@app.post("/upload", openapi_extra=UPLOAD_OPENAPI)
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    """Загрузка файла"""
-    # Создать директорию для загрузок
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
+    """Загрузка файла (потоковая, не больше MAX_FILE_SIZE)"""
+    try:
+        upload = await receive_upload(request)
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File too large (max {MAX_FILE_SIZE} bytes)"
+        )
+    except InvalidUpload as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     file_id = str(uuid.uuid4())
-    file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
-    saved_filename = f"{file_id}.{file_extension}"
-    file_path = os.path.join(upload_dir, saved_filename)
-
-    # Сохранить файл
-    contents = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    uploaded_at = datetime.utcnow().isoformat()
+    file = {
+        "id": file_id,
+        "sha256": upload["sha256"],
+        "filename": upload["filename"],
+        "content_type": upload["content_type"],
+        "size": upload["size"],
+        "uploaded_by": current_user["id"],
+        "uploaded_at": uploaded_at,
+        "width": None,
+        "height": None,
+        "previews": None
+    }
+    try:
+        stored = await store_upload(storage, blob_store, file, upload)
+    except BaseException:
+        await discard_upload(upload)
+        raise
+    thumbnails.submit(file)
 
-    file_size = len(contents)
+    file_extension = safe_extension(upload["filename"])
+    saved_filename = f"{file_id}.{file_extension}" if file_extension else file_id
 
     return {
         "file_id": file_id,
-        "filename": file.filename,
+        "filename": upload["filename"],
         "saved_filename": saved_filename,
-        "content_type": file.content_type,
-        "size": file_size,
+        "content_type": upload["content_type"],
+        "size": upload["size"],
+        "sha256": upload["sha256"],
+        "deduplicated": not stored,
         "url": f"/files/{saved_filename}",
         "uploaded_by": current_user["id"],
-        "uploaded_at": datetime.utcnow().isoformat()
+        "uploaded_at": uploaded_at
     }
 
 @app.get("/files/{filename}")
-async def download_file(filename: str):
-    """Скачать файл"""
-    file_path = os.path.join("uploads", filename)
-    if not os.path.exists(file_path):
+async def download_file(filename: str, request: Request):
+    """Скачать файл (поддерживаются If-None-Match и Range)"""
+    # filename - "<file_id>.<ext>"; расширение нужно только для ссылки
+    file = await storage.get_file(filename.split(".", 1)[0])
+    try:
+        if file is not None:
+            return await blob_store.download_response(request, file)
+
+        # Файлы, загруженные до появления BlobStore, лежат в UPLOAD_DIR как есть
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        if not await aiofiles.os.path.isfile(file_path):
+            raise FileNotFoundError(file_path)
+        return await file_response(request, file_path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+@app.delete("/files/{filename}")
+async def delete_file(filename: str, current_user: dict = Depends(get_current_user)):
+    """Удалить загрузку (автор или админ); блоб удаляется вместе с последней ссылкой"""
+    file_id = filename.split(".", 1)[0]
+    file = await storage.get_file(file_id)
+    if file is None:
         raise HTTPException(status_code=404, detail="File not found")
+    if file["uploaded_by"] != current_user["id"] and current_user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Not allowed to delete this file")
 
-    return FileResponse(file_path)
+    # Вместе с файлом удаляются его превью
+    for name in file.get("previews") or {}:
+        preview = await storage.get_file(f"{file_id}-{name}")
+        if preview is not None:
+            await storage.delete_file(preview["id"], blob_store.delete)
+
+    await storage.delete_file(file_id, blob_store.delete)
+
+    return {"message": "File deleted successfully"}
 
 # WebSocket endpoint
 @app.websocket("/ws/{user_id}")
@@ -475,29 +928,39 @@ async def websocket_endpoint(websocket: WebSocket, user_id: str):
             # Обработка входящих команд через WebSocket
             try:
                 message_data = json.loads(data)
-
-                if message_data.get("type") == "ping":
-                    await websocket.send_json({"type": "pong"})
-                elif message_data.get("type") == "typing":
-                    # Уведомить о том, что пользователь печатает
-                    typing_notification = {
-                        "type": "typing",
-                        "user_id": user_id,
-                        "recipient_id": message_data.get("recipient_id"),
-                        "group_id": message_data.get("group_id")
-                    }
-
-                    if message_data.get("group_id"):
-                        await manager.broadcast_to_group(typing_notification, message_data["group_id"])
-                    elif message_data.get("recipient_id"):
-                        await manager.send_personal_message(typing_notification, message_data["recipient_id"])
+                command = message_data.get("type")
+
+                with profiler.sample(f"ws:{command}" if command in WS_COMMANDS else "ws:other"):
+                    if command == "ping":
+                        manager.send_local(PONG_FRAME, user_id)
+                    elif command == "resume":
+                        # Пропущенные за время переподключения сообщения одним кадром
+                        since = message_data.get("since")
+                        # bool - подкласс int: JSON true/false номером не считается
+                        if isinstance(since, int) and not isinstance(since, bool) and since >= 0:
+                            page = await sync_page(user_id, since, MAX_RESUME_MESSAGES)
+                            manager.send_local(Frame.encode({"type": "sync", **page}), user_id)
+                    elif command == "typing":
+                        # Уведомить о том, что пользователь печатает
+                        typing_notification = {
+                            "type": "typing",
+                            "user_id": user_id,
+                            "recipient_id": message_data.get("recipient_id"),
+                            "group_id": message_data.get("group_id")
+                        }
+
+                        if message_data.get("group_id"):
+                            await manager.broadcast_to_group(typing_notification, message_data["group_id"])
+                        elif message_data.get("recipient_id"):
+                            await manager.send_personal_message(typing_notification, message_data["recipient_id"])
 
             except json.JSONDecodeError:
-                pass  # Игнорировать невалидный JSON
+                # Невалидный JSON игнорируется
+                log_event(ws_logger, logging.DEBUG, "ws.invalid_command", user_id=user_id, size=len(data))
 
-    except WebSocketDisconnect:
-        manager.disconnect(user_id)
-        print(f"User {user_id} disconnected")
+    except WebSocketDisconnect as exc:
+        await manager.disconnect(user_id, websocket)
+        log_event(ws_logger, logging.DEBUG, "ws.closed", user_id=user_id, code=exc.code)
 
 # === АДМИНСКИЕ ЭНДПОИНТЫ ===
 
@@ -513,7 +976,7 @@ async def admin_get_all_users(admin: dict = Depends(get_admin_user)):
             "role": user.get("role", "user"),
             "created_at": user.get("created_at")
         }
-        for user in users_db.values()
+        for user in await storage.list_users()
     ]
 
 @app.put("/admin/users/{user_id}")
@@ -523,23 +986,22 @@ async def admin_update_user(
     admin: dict = Depends(get_admin_user)
 ):
     """Обновить данные пользователя (только для админов)"""
-    # Найти пользователя
-    target_user = None
-    for user in users_db.values():
-        if user["id"] == user_id:
-            target_user = user
-            break
-
-    if not target_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Обновить данные
+    fields = {}
     if user_update.full_name:
-        target_user["full_name"] = user_update.full_name
+        fields["full_name"] = user_update.full_name
     if user_update.email:
-        target_user["email"] = user_update.email
+        owner = await storage.get_user_by_email(user_update.email)
+        if owner is not None and owner["id"] != user_id:
+            raise HTTPException(status_code=400, detail="Email already registered")
+        fields["email"] = user_update.email
     if user_update.role and user_update.role in ["user", "admin"]:
-        target_user["role"] = user_update.role
+        fields["role"] = user_update.role
+
+    target_user = await storage.update_user(user_id, fields)
+    if not target_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await revoke_principal(user_id)
 
     return {
         "message": "User updated successfully",
@@ -563,33 +1025,73 @@ async def admin_delete_user(
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
 
     # Найти и удалить пользователя
-    username_to_delete = None
-    for username, user in users_db.items():
-        if user["id"] == user_id:
-            username_to_delete = username
-            break
-
-    if not username_to_delete:
+    if not await storage.delete_user(user_id):
         raise HTTPException(status_code=404, detail="User not found")
-
-    del users_db[username_to_delete]
+    await revoke_principal(user_id)
 
     return {"message": "User deleted successfully"}
 
 @app.get("/admin/stats")
 async def admin_get_stats(admin: dict = Depends(get_admin_user)):
     """Получить статистику системы (только для админов)"""
-    total_messages = len(messages_db)
+    total_messages = await storage.count_messages()
+    roles = await storage.count_users_by_role()
 
     return {
-        "total_users": len(users_db),
-        "total_groups": len(groups_db),
+        "total_users": await storage.count_users(),
+        "total_groups": await storage.count_groups(),
         "total_messages": total_messages,
         "active_connections": len(manager.active_connections),
-        "admins_count": len([u for u in users_db.values() if u.get("role") == "admin"]),
-        "users_count": len([u for u in users_db.values() if u.get("role") == "user"])
+        "admins_count": roles.get("admin", 0),
+        "users_count": roles.get("user", 0)
     }
 
+class ProfilingSettings(BaseModel):
+    enabled: bool
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)  # доля профилируемых обработчиков
+    interval_ms: Optional[float] = Field(None, ge=1, le=1000)  # период снятия стеков
+    block_threshold_ms: Optional[float] = Field(None, ge=0)  # 0 - не искать блокировки loop
+    cprofile: Optional[bool] = None
+
+@app.get("/admin/profiling")
+async def admin_get_profiling(admin: dict = Depends(get_admin_user)):
+    """Настройки профилирования и сводка собранных данных (только для админов)"""
+    return profiler.status()
+
+@app.put("/admin/profiling")
+async def admin_update_profiling(settings: ProfilingSettings, admin: dict = Depends(get_admin_user)):
+    """Включить, выключить или перенастроить профилирование без перезапуска (только для админов)"""
+    await profiler.configure(**settings.model_dump())
+    return profiler.status()
+
+@app.delete("/admin/profiling")
+async def admin_reset_profiling(admin: dict = Depends(get_admin_user)):
+    """Сбросить собранные данные профилирования (только для админов)"""
+    profiler.reset()
+    return {"message": "Profiling data cleared"}
+
+@app.get("/admin/profiling/flamegraph")
+async def admin_profiling_flamegraph(
+    source: str = Query("stacks", pattern="^(stacks|blocks)$"),
+    admin: dict = Depends(get_admin_user)
+):
+    """Свёрнутые стеки для flamegraph.pl / speedscope: выборка или блокировки loop (только для админов)"""
+    return Response(profiler.collapsed(source), media_type="text/plain; charset=utf-8")
+
+@app.get("/admin/profiling/cprofile")
+async def admin_profiling_cprofile(
+    sort: str = "cumulative",
+    limit: int = Query(50, ge=1, le=1000),
+    admin: dict = Depends(get_admin_user)
+):
+    """Отчёт cProfile по профилированным обработчикам (только для админов)"""
+    if sort not in CPROFILE_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort key, use one of: {', '.join(sorted(CPROFILE_SORT_KEYS))}")
+    report = profiler.cprofile_report(sort, limit)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No cProfile data, enable profiling with cprofile=true")
+    return Response(report, media_type="text/plain; charset=utf-8")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,38 @@
+"""
+Индекс членства в группах
+
+Двусторонний индекс: группа -> множество участников и пользователь ->
+множество его групп. Список групп пользователя и проверка членства
+стоят O(число членств пользователя) и O(1), а не обход всех групп с
+поиском по списку участников.
+"""
+from typing import Dict, Iterable, List, Set
+
+_EMPTY: Set[str] = frozenset()
+
+
+class MembershipIndex:
+    def __init__(self):
+        self.group_members: Dict[str, Set[str]] = {}  # group_id -> {user_ids}
+        self.user_groups: Dict[str, Set[str]] = {}  # user_id -> {group_ids}
+
+    def add(self, group_id: str, user_ids: Iterable[str]) -> List[str]:
+        """Добавить участников; вернуть тех, кого в группе ещё не было"""
+        members = self.group_members.setdefault(group_id, set())
+        added = []
+        for user_id in user_ids:
+            if user_id in members:
+                continue
+            members.add(user_id)
+            self.user_groups.setdefault(user_id, set()).add(group_id)
+            added.append(user_id)
+        return added
+
+    def members(self, group_id: str) -> Set[str]:
+        return self.group_members.get(group_id, _EMPTY)
+
+    def groups_of(self, user_id: str) -> Set[str]:
+        return self.user_groups.get(user_id, _EMPTY)
+
+    def is_member(self, group_id: str, user_id: str) -> bool:
+        return user_id in self.group_members.get(group_id, _EMPTY)
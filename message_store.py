@@ -0,0 +1,211 @@
+"""
+Индексированное хранилище сообщений
+
+Каждое сообщение дописывается в конец своей ленты: лента группы
+(group_id), лента личной переписки (неупорядоченная пара собеседников)
+и ленты отправителя/получателя. Сообщения поступают в порядке времени,
+поэтому ленты уже отсортированы и последние N сообщений чата достаются
+срезом за O(N) - без прохода по всей истории и без сортировки.
+
+Рядом с сообщениями лента хранит ключи (timestamp, seq), по которым
+курсоры before/after находятся бинарным поиском: страница глубоко в
+истории стоит O(log n + limit).
+
+seq - глобальный номер сообщения, растёт с каждым добавлением и
+возвращается клиентам. Номера в любой ленте тоже возрастают, поэтому
+сообщения после номера клиента (догрузка после переподключения)
+находятся бинарным поиском по лентам пользователя.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from heapq import merge
+from typing import Dict, Iterator, List, Optional, Tuple
+import math
+
+MessageKey = Tuple[str, float]
+
+
+def dm_key(user_a: str, user_b: str) -> str:
+    """Ключ личной переписки, не зависящий от порядка собеседников"""
+    if user_a <= user_b:
+        return f"{user_a}:{user_b}"
+    return f"{user_b}:{user_a}"
+
+
+def timeline_key(message: dict) -> Optional[str]:
+    """Ключ чата сообщения в хранилище: group:<group_id> или dm:<dm_key>"""
+    if message.get("group_id"):
+        return f"group:{message['group_id']}"
+    if message.get("recipient_id"):
+        return f"dm:{dm_key(message['sender_id'], message['recipient_id'])}"
+    return None
+
+
+def conversation_key(kind: str, target: str) -> str:
+    """Ключ чата в пакетных запросах: group:<group_id> или user:<user_id>"""
+    return f"{kind}:{target}"
+
+
+def parse_cursor_timestamp(cursor: str) -> datetime:
+    """ISO timestamp курсора в naive UTC, как хранятся сообщения (ValueError, если это не дата)"""
+    moment = datetime.fromisoformat(cursor)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+class Timeline:
+    """Лента сообщений одного чата, упорядоченная по (timestamp, seq)"""
+
+    __slots__ = ("messages", "keys")
+
+    def __init__(self):
+        self.messages: List[dict] = []
+        self.keys: List[MessageKey] = []
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def since(self, seq: int) -> Iterator[dict]:
+        """Сообщения с глобальным номером больше seq"""
+        start = bisect_right(self.keys, seq, key=lambda key: key[1])
+        return (self.messages[i] for i in range(start, len(self.messages)))
+
+    def append(self, message: dict, key: MessageKey):
+        self.messages.append(message)
+        self.keys.append(key)
+
+    def page(
+        self,
+        limit: int,
+        before: Optional[MessageKey] = None,
+        after: Optional[MessageKey] = None
+    ) -> List[dict]:
+        """
+        Страница сообщений от старых к новым.
+
+        Без after возвращаются последние limit сообщений до before (листание
+        назад), с after - первые limit сообщений после него (листание вперёд).
+        """
+        if limit <= 0:
+            return []
+
+        lo = bisect_right(self.keys, after) if after is not None else 0
+        hi = bisect_left(self.keys, before) if before is not None else len(self.keys)
+        if lo >= hi:
+            return []
+
+        if after is not None:
+            return self.messages[lo:min(hi, lo + limit)]
+        return self.messages[max(lo, hi - limit):hi]
+
+
+_EMPTY = Timeline()
+
+
+class MessageStore:
+    def __init__(self):
+        self.messages: List[dict] = []
+        self.by_group: Dict[str, Timeline] = {}  # group_id -> лента
+        self.by_dm: Dict[str, Timeline] = {}  # dm_key -> лента
+        self.by_user: Dict[str, Timeline] = {}  # user_id -> лента
+        self._keys: Dict[str, MessageKey] = {}  # message_id -> (timestamp, seq)
+        self._seq = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def append(self, message: dict) -> int:
+        """Добавить сообщение во все индексы; вернуть его глобальный номер"""
+        self._seq += 1
+        message["seq"] = self._seq
+        key = (message["timestamp"], self._seq)
+        self._keys[message["id"]] = key
+        self.messages.append(message)
+
+        sender_id = message["sender_id"]
+        recipient_id = message.get("recipient_id")
+        group_id = message.get("group_id")
+
+        if group_id:
+            self._timeline(self.by_group, group_id).append(message, key)
+        elif recipient_id:
+            self._timeline(self.by_dm, dm_key(sender_id, recipient_id)).append(message, key)
+
+        # Лента пользователя: всё, что он отправил или получил лично
+        self._timeline(self.by_user, sender_id).append(message, key)
+        if recipient_id and recipient_id != sender_id:
+            self._timeline(self.by_user, recipient_id).append(message, key)
+        return self._seq
+
+    def cursor_key(self, cursor: str, after: bool = False) -> MessageKey:
+        """
+        Превратить курсор в ключ ленты.
+
+        Курсор - id сообщения (точная позиция) или ISO timestamp (граница
+        между сообщениями). Для неизвестного курсора - ValueError.
+        """
+        key = self._keys.get(cursor)
+        if key is not None:
+            return key
+
+        # seq начинается с 1, поэтому 0 и inf стоят до и после всех
+        # сообщений с тем же timestamp
+        return (parse_cursor_timestamp(cursor).isoformat(), math.inf if after else 0)
+
+    def group_history(self, group_id: str, limit: int,
+                      before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        """Страница сообщений группы (от старых к новым)"""
+        return self._page(self.by_group.get(group_id), limit, before, after)
+
+    def dm_history(self, user_a: str, user_b: str, limit: int,
+                   before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        """Страница личной переписки (от старых к новым)"""
+        return self._page(self.by_dm.get(dm_key(user_a, user_b)), limit, before, after)
+
+    def user_history(self, user_id: str, limit: int,
+                     before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        """Страница сообщений, отправленных или полученных пользователем"""
+        return self._page(self.by_user.get(user_id), limit, before, after)
+
+    def latest(self, user_id: str, group_ids: List[str], peer_ids: List[str],
+               limit: int) -> Dict[str, Tuple[int, List[dict]]]:
+        """Число сообщений и последние limit сообщений для нескольких чатов за один проход"""
+        result = {}
+        for group_id in group_ids:
+            timeline = self.by_group.get(group_id, _EMPTY)
+            result[conversation_key("group", group_id)] = (len(timeline), timeline.page(limit))
+        for peer_id in peer_ids:
+            timeline = self.by_dm.get(dm_key(user_id, peer_id), _EMPTY)
+            result[conversation_key("user", peer_id)] = (len(timeline), timeline.page(limit))
+        return result
+
+    def since(self, user_id: str, group_ids: List[str], seq: int, limit: int) -> List[dict]:
+        """Первые limit сообщений групп и личных переписок пользователя после номера seq"""
+        timelines = [self.by_user.get(user_id)] + [self.by_group.get(group_id) for group_id in group_ids]
+        streams = [timeline.since(seq) for timeline in timelines if timeline is not None]
+
+        result = []
+        last = seq
+        # Своё сообщение в группу есть и в ленте пользователя, и в ленте группы
+        for message in merge(*streams, key=lambda message: message["seq"]):
+            if message["seq"] == last:
+                continue
+            last = message["seq"]
+            result.append(message)
+            if len(result) >= limit:
+                break
+        return result
+
+    def _page(self, timeline: Optional[Timeline], limit: int,
+              before: Optional[str], after: Optional[str]) -> List[dict]:
+        before_key = self.cursor_key(before) if before else None
+        after_key = self.cursor_key(after, after=True) if after else None
+        return (timeline or _EMPTY).page(limit, before_key, after_key)
+
+    @staticmethod
+    def _timeline(index: Dict[str, Timeline], key: str) -> Timeline:
+        timeline = index.get(key)
+        if timeline is None:
+            timeline = index[key] = Timeline()
+        return timeline
@@ -0,0 +1,262 @@
+"""
+Метрики в формате Prometheus
+
+Небольшой реестр без сторонних зависимостей: счётчики, gauge и
+гистограммы с фиксированными корзинами. Метрики обновляются только из
+потока event loop (код в пулах потоков возвращает свои замеры вместе с
+результатом), поэтому блокировки не нужны: наблюдение - это бинарный поиск
+корзины и пара сложений. Серии с метками создаются при первом
+наблюдении и дальше берутся из словаря по кортежу значений.
+
+GET /metrics отдаёт текст в формате exposition 0.0.4. Каждый воркер
+uvicorn считает свои метрики - при нескольких воркерах Prometheus
+должен опрашивать каждый (или метрики суммируются по instance).
+
+Здесь же - монитор задержки event loop: задача раз в
+LOOP_LAG_INTERVAL секунд засыпает и замеряет, насколько позже
+положенного она проснулась.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Sequence, Tuple
+import asyncio
+import os
+import time
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Корзины по умолчанию: от 0.5 мс до 10 с
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, labels: LabelValues = ()):
+        self.values[labels] = value
+
+    def dec(self, amount: float = 1, labels: LabelValues = ()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [счётчики корзин (последняя - +Inf)..., сумма]
+        self.series: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        # Наблюдение попадает в первую корзину с le >= value; накопительные
+        # суммы считаются при выводе, а не на горячем пути
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, labels: LabelValues = ()) -> "_Timer":
+        """with histogram.time(): ... - замерить длительность блока"""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# HTTP
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "chat_http_request_duration_seconds", "HTTP request latency by route", ["method", "route"]
+))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "chat_http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+))
+
+# WebSocket
+WS_CONNECTIONS = REGISTRY.register(Gauge("chat_ws_connections", "Open WebSocket connections"))
+WS_SEND_DURATION = REGISTRY.register(Histogram(
+    "chat_ws_send_duration_seconds", "Time to write one frame to a WebSocket"
+))
+WS_QUEUE_DEPTH = REGISTRY.register(Histogram(
+    "chat_ws_queue_depth", "Per-connection send queue depth when an event is enqueued",
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+))
+WS_FRAMES_DROPPED = REGISTRY.register(Counter(
+    "chat_ws_frames_dropped_total", "Events dropped from WebSocket send queues"
+))
+
+# Рассылка
+BROADCAST_FANOUT = REGISTRY.register(Histogram(
+    "chat_broadcast_fanout_recipients", "Local recipients per delivered event", ["channel"],
+    buckets=SIZE_BUCKETS
+))
+BROADCAST_DURATION = REGISTRY.register(Histogram(
+    "chat_broadcast_duration_seconds", "Time to enqueue an event for all local recipients", ["channel"]
+))
+
+# Сообщения и пароли
+MESSAGES = REGISTRY.register(Counter("chat_messages_total", "Messages sent", ["type"]))
+BCRYPT_DURATION = REGISTRY.register(Histogram(
+    "chat_bcrypt_duration_seconds", "bcrypt hash/verify time in the worker thread", ["operation"]
+))
+BCRYPT_QUEUE_WAIT = REGISTRY.register(Histogram(
+    "chat_bcrypt_queue_wait_seconds", "Time a bcrypt call waits for a free pool thread", ["operation"]
+))
+
+# Event loop
+LOOP_LAG = REGISTRY.register(Histogram(
+    "chat_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task"
+))
+LOOP_LAG_LAST = REGISTRY.register(Gauge("chat_event_loop_lag_last_seconds", "Last measured event loop lag"))
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def startup(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка и статус HTTP-запросов по шаблону маршрута"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Шаблон маршрута (/files/{filename}), а не путь - иначе число
+            # серий растёт с каждым файлом и id
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "other"
+            method = scope["method"]
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, (method, route))
+            HTTP_REQUESTS.inc(1, (method, route, str(status)))
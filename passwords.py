@@ -0,0 +1,77 @@
+"""
+Хеширование и проверка паролей вне event loop
+
+Один вызов bcrypt занимает сотни миллисекунд CPU. Вызванный прямо в
+обработчике, он останавливает все WebSocket и запросы воркера, поэтому
+bcrypt выполняется в отдельном пуле потоков (bcrypt отпускает GIL на
+время вычисления). Размер пула - это и есть предел одновременных
+вычислений: остальные логины ждут своей очереди, не занимая event loop.
+
+Настройки:
+
+- BCRYPT_ROUNDS - cost factor для новых хешей (старые хеши проверяются
+  со своим cost factor, он записан в самом хеше);
+- BCRYPT_MAX_CONCURRENCY - сколько хешей считается одновременно.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import asyncio
+import os
+import time
+
+import bcrypt
+
+from metrics import BCRYPT_DURATION, BCRYPT_QUEUE_WAIT
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_MAX_CONCURRENCY = int(os.getenv("BCRYPT_MAX_CONCURRENCY", str(min(4, os.cpu_count() or 1))))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_CONCURRENCY, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def _timed(func: Callable, *args):
+    """Выполняется в потоке пула: результат, момент начала и длительность"""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, started, time.perf_counter() - started
+
+
+async def _run(operation: str, func: Callable, *args):
+    # Метрики пишутся из event loop; ожидание в очереди пула и сам bcrypt -
+    # отдельные гистограммы, иначе при шторме логинов очередь выглядит как bcrypt
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    result, started, elapsed = await loop.run_in_executor(_get_executor(), _timed, func, *args)
+    BCRYPT_QUEUE_WAIT.observe(started - submitted, (operation,))
+    BCRYPT_DURATION.observe(elapsed, (operation,))
+    return result
+
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", _hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run("verify", _verify, plain_password, hashed_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
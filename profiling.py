@@ -0,0 +1,321 @@
+"""
+Профилирование по запросу администратора
+
+Включается без перезапуска через PUT /admin/profiling и собирает данные
+только для доли обработчиков (sample_rate): HTTP-запросов, команд
+WebSocket и доставки событий из шины. Пока выполняется хотя бы один
+выбранный обработчик:
+
+- поток-сэмплер каждые interval_ms снимает стек потока event loop
+  (sys._current_frames) и копит его в свёрнутом виде
+  "main.py:get_messages;storage.py:get_history N" - формат flamegraph.pl,
+  speedscope и inferno; стеки простаивающего loop (ожидание select)
+  только считаются;
+- при cprofile=true дополнительно работает cProfile - точнее по числу
+  вызовов, но в разы дороже. cProfile включён на весь поток loop, поэтому
+  захватывает и невыбранные обработчики, выполнявшиеся в это время.
+
+Независимо от выборки задача-пульс раз в HEARTBEAT_INTERVAL отмечается в
+loop; если пульса нет дольше block_threshold_ms, сэмплер снимает стек
+заблокировавшего loop кода, а после пробуждения запись получает
+длительность блокировки.
+
+Для каждой метки ("GET /messages", "ws:typing", "broadcast:group")
+считаются число выбранных вызовов, суммарное и максимальное время.
+Код в пулах потоков (bcrypt) в стеки loop не попадает - он виден по
+времени метки.
+
+Данные копятся в памяти процесса: при нескольких воркерах каждый
+профилируется отдельно. Значения по умолчанию - PROFILING_* в .env.
+"""
+from collections import deque
+from contextlib import nullcontext
+from typing import Deque, Dict, List, Optional
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_BLOCK_THRESHOLD_MS = float(os.getenv("PROFILING_BLOCK_THRESHOLD_MS", "100"))
+
+HEARTBEAT_INTERVAL = 0.01
+MAX_STACK_DEPTH = 128
+MAX_STACKS = 10000  # разных стеков; остальные копятся в TRUNCATED_STACK
+TRUNCATED_STACK = "[truncated]"
+RECENT_BLOCKS = 50
+
+# Верхний кадр простаивающего loop: select у asyncio, Runner.run у uvloop
+IDLE_FRAMES = {("selectors.py", "select"), ("runners.py", "run")}
+
+CPROFILE_SORT_KEYS = {"cumulative", "tottime", "ncalls", "calls", "time"}
+
+
+def _frame_name(code) -> str:
+    return f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+
+
+def collapse_stack(frame) -> Optional[str]:
+    """Стек от корня к frame через ";" или None, если loop простаивает"""
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class _Sample:
+    __slots__ = ("profiler", "label", "started")
+
+    def __init__(self, profiler: "Profiler", label: str):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.profiler._enter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._exit(self.label, time.perf_counter() - self.started)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = PROFILING_SAMPLE_RATE
+        self.interval_ms = PROFILING_INTERVAL_MS
+        self.block_threshold_ms = PROFILING_BLOCK_THRESHOLD_MS
+        self.cprofile = False
+        self.started_at: Optional[float] = None
+
+        self._lock = threading.Lock()  # данные пишет поток-сэмплер, читает loop
+        self._active = 0  # выполняющиеся выбранные обработчики
+        self._profile: Optional[cProfile.Profile] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._pending_block: Optional[str] = None
+        self.reset()
+
+    def reset(self):
+        """Сбросить накопленные данные (настройки не меняются)"""
+        with self._lock:
+            self.stacks: Dict[str, int] = {}
+            self.block_stacks: Dict[str, float] = {}  # стек -> суммарные мс блокировок
+            self.recent_blocks: Deque[dict] = deque(maxlen=RECENT_BLOCKS)
+            self.labels: Dict[str, List[float]] = {}  # метка -> [вызовы, сумма с, максимум с]
+            self.samples = 0
+            self.idle_samples = 0
+            self.blocks = 0
+        if self._profile is not None:
+            if self._active:
+                self._profile.disable()
+            self._profile = cProfile.Profile()
+            if self._active:
+                self._profile.enable()
+
+    def should_sample(self) -> bool:
+        return self.enabled and random.random() < self.sample_rate
+
+    def sample(self, label: str):
+        """
+        with profiler.sample("GET /messages"): ... - профилировать блок,
+        если профилирование включено и вызов попал в выборку
+        """
+        return _Sample(self, label) if self.should_sample() else nullcontext()
+
+    async def configure(self, enabled: bool, sample_rate: Optional[float] = None,
+                        interval_ms: Optional[float] = None, block_threshold_ms: Optional[float] = None,
+                        cprofile: Optional[bool] = None):
+        """Поменять настройки; включение и выключение - без перезапуска"""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if interval_ms is not None:
+            self.interval_ms = interval_ms
+        if block_threshold_ms is not None:
+            self.block_threshold_ms = block_threshold_ms
+        if cprofile is not None:
+            self._set_cprofile(cprofile)
+
+        if enabled and not self.enabled:
+            await self._start()
+        elif not enabled and self.enabled:
+            await self.shutdown()
+
+    async def shutdown(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._stop.set()
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+
+    async def _start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.perf_counter()
+        self._pending_block = None
+        self._stop.clear()
+        self.enabled = True
+        self.started_at = time.time()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._run_sampler, name="profiler", daemon=True)
+        self._thread.start()
+
+    def _set_cprofile(self, value: bool):
+        if value == self.cprofile:
+            return
+        self.cprofile = value
+        if value:
+            self._profile = cProfile.Profile()
+            if self._active:
+                self._profile.enable()
+        else:
+            if self._active:
+                self._profile.disable()
+            self._profile = None
+
+    def _enter(self):
+        self._active += 1
+        if self._active == 1 and self._profile is not None:
+            self._profile.enable()
+
+    def _exit(self, label: str, elapsed: float):
+        self._active -= 1
+        if self._active == 0 and self._profile is not None:
+            self._profile.disable()
+        stats = self.labels.get(label)
+        if stats is None:
+            stats = self.labels[label] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.perf_counter()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            # Проснулись после блокировки: записать её длительность
+            stack = self._pending_block
+            if stack is not None:
+                self._pending_block = None
+                blocked_ms = (time.perf_counter() - self._last_beat - HEARTBEAT_INTERVAL) * 1000
+                with self._lock:
+                    self.block_stacks[stack] = self.block_stacks.get(stack, 0.0) + blocked_ms
+                    self.recent_blocks.append({
+                        "at": time.time(), "duration_ms": round(blocked_ms, 1), "stack": stack
+                    })
+
+    def _run_sampler(self):
+        interval = self.interval_ms / 1000
+        while not self._stop.wait(interval):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+
+            since_beat = time.perf_counter() - self._last_beat - HEARTBEAT_INTERVAL
+            if self.block_threshold_ms > 0 and since_beat * 1000 > self.block_threshold_ms \
+                    and self._pending_block is None:
+                stack = collapse_stack(frame)
+                if stack is not None:
+                    self._pending_block = stack
+                    with self._lock:
+                        self.blocks += 1
+
+            if self._active:
+                stack = collapse_stack(frame)
+                with self._lock:
+                    if stack is None:
+                        self.idle_samples += 1
+                        continue
+                    self.samples += 1
+                    if stack not in self.stacks and len(self.stacks) >= MAX_STACKS:
+                        stack = TRUNCATED_STACK
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            del frame
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval_ms,
+                "block_threshold_ms": self.block_threshold_ms,
+                "cprofile": self.cprofile,
+                "started_at": self.started_at,
+                "samples": self.samples,
+                "idle_samples": self.idle_samples,
+                "distinct_stacks": len(self.stacks),
+                "blocks": self.blocks,
+                "recent_blocks": list(self.recent_blocks),
+                "labels": {
+                    label: {"calls": calls, "total_seconds": round(total, 6), "max_seconds": round(peak, 6)}
+                    for label, (calls, total, peak) in sorted(self.labels.items(), key=lambda item: -item[1][1])
+                },
+            }
+
+    def collapsed(self, source: str = "stacks") -> str:
+        """Свёрнутые стеки для flamegraph: "stacks" - выборка, "blocks" - блокировки loop (вес в мс)"""
+        with self._lock:
+            data = self.stacks if source == "stacks" else self.block_stacks
+            lines = [f"{stack} {round(weight)}" for stack, weight in data.items() if round(weight) > 0]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def cprofile_report(self, sort: str = "cumulative", limit: int = 50) -> Optional[str]:
+        """Текстовый отчёт pstats или None, если cProfile не включён или ещё пуст"""
+        if self._profile is None:
+            return None
+        if self._active:
+            # pstats читает данные только у выключенного профайлера
+            self._profile.disable()
+        try:
+            output = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=output)
+        except TypeError:
+            return None
+        finally:
+            if self._active:
+                self._profile.enable()
+        stats.sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """ASGI-middleware: выборочное профилирование HTTP-запросов"""
+
+    def __init__(self, app, profiler: Profiler = profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_sample():
+            await self.app(scope, receive, send)
+            return
+
+        with _Sample(self.profiler, "") as sample:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                # Метка - шаблон маршрута, известный только после маршрутизации
+                route = getattr(scope.get("route"), "path", None) or "other"
+                sample.label = f"{scope['method']} {route}"
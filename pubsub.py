@@ -0,0 +1,158 @@
+"""
+Шина доставки real-time событий между узлами
+
+Обработчики не пишут в WebSocket напрямую, а публикуют событие в канал
+пользователя, группы или общий канал. Каждый узел подписан только на
+каналы своих локально подключённых пользователей (и их групп) и сам
+доставляет полученные события в свои сокеты. Так сообщение, отправленное
+через POST /messages на одном воркере, доходит до пользователя,
+подключённого к другому. По шине ходят уже сериализованные кадры
+(frames.Frame), в Redis передаётся их готовый JSON-текст.
+
+Бэкенд выбирается переменной PUBSUB_BACKEND:
+
+- local - доставка внутри процесса (один воркер, тесты)
+- redis - Redis pub/sub по REDIS_URL
+
+По умолчанию используется redis, если задан REDIS_URL.
+"""
+from typing import Awaitable, Callable, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+
+from frames import Frame
+from logs import get_logger, log_event
+
+CHANNEL_PREFIX = "chat:"
+BROADCAST_CHANNEL = CHANNEL_PREFIX + "all"
+# Служебные события между узлами (не уходят в сокеты)
+CONTROL_CHANNEL = CHANNEL_PREFIX + "control"
+
+Handler = Callable[[str, Frame], Awaitable[None]]
+
+logger = get_logger("pubsub")
+
+
+def user_channel(user_id: str) -> str:
+    return f"{CHANNEL_PREFIX}user:{user_id}"
+
+
+def group_channel(group_id: str) -> str:
+    return f"{CHANNEL_PREFIX}group:{group_id}"
+
+
+def parse_channel(channel: str) -> Tuple[str, str]:
+    """'chat:user:<id>' -> ('user', '<id>'), общие каналы -> ('all', ''), ('control', '')"""
+    kind, _, target = channel[len(CHANNEL_PREFIX):].partition(":")
+    return kind, target
+
+
+class DeliveryBus:
+    """Интерфейс шины. Обработчик вызывается для событий подписанных каналов"""
+
+    def __init__(self):
+        self.handler: Optional[Handler] = None
+
+    async def startup(self, handler: Handler):
+        self.handler = handler
+
+    async def shutdown(self):
+        pass
+
+    async def publish(self, channel: str, frame: Frame):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str):
+        raise NotImplementedError
+
+    async def unsubscribe(self, channel: str):
+        raise NotImplementedError
+
+
+class LocalBus(DeliveryBus):
+    """Шина внутри процесса: публикация сразу вызывает обработчик"""
+
+    def __init__(self):
+        super().__init__()
+        self.channels: Set[str] = set()
+
+    async def publish(self, channel: str, frame: Frame):
+        if channel in self.channels and self.handler is not None:
+            await self.handler(channel, frame)
+
+    async def subscribe(self, channel: str):
+        self.channels.add(channel)
+
+    async def unsubscribe(self, channel: str):
+        self.channels.discard(channel)
+
+
+class RedisBus(DeliveryBus):
+    """Шина поверх Redis pub/sub"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis.asyncio as redis
+
+        self.redis = redis.from_url(url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._reader: Optional[asyncio.Task] = None
+
+    async def startup(self, handler: Handler):
+        await super().startup(handler)
+        # Общий канал слушают все узлы, поэтому соединение pub/sub
+        # подписано всегда и цикл чтения не простаивает
+        await self.pubsub.subscribe(BROADCAST_CHANNEL)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def shutdown(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        await self.pubsub.aclose()
+        await self.redis.aclose()
+
+    async def publish(self, channel: str, frame: Frame):
+        await self.redis.publish(channel, frame.text)
+
+    async def subscribe(self, channel: str):
+        await self.pubsub.subscribe(channel)
+
+    async def unsubscribe(self, channel: str):
+        await self.pubsub.unsubscribe(channel)
+
+    async def _read_loop(self):
+        while True:
+            try:
+                event = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event(logger, logging.ERROR, "pubsub.read_error", error=repr(e))
+                await asyncio.sleep(1)
+                continue
+
+            if event is None:
+                continue
+
+            try:
+                await self.handler(event["channel"].decode(), Frame.decode(event["data"].decode("utf-8")))
+            except Exception as e:
+                log_event(logger, logging.ERROR, "pubsub.handler_error",
+                          channel=event["channel"].decode(), error=repr(e))
+
+
+def create_bus() -> DeliveryBus:
+    """Создать шину по переменным окружения"""
+    redis_url = os.getenv("REDIS_URL")
+    backend = os.getenv("PUBSUB_BACKEND", "redis" if redis_url else "local")
+
+    if backend == "local":
+        return LocalBus()
+    if backend == "redis":
+        return RedisBus(redis_url)
+    raise ValueError(f"Unknown PUBSUB_BACKEND: {backend}")
@@ -0,0 +1,178 @@
+"""
+Полнотекстовый поиск по сообщениям
+
+Текст и имя файла сообщения разбиваются на слова, слова приводятся к
+основе (лёгкий стеммер для русского и английского: отбрасываются
+окончания, "сообщения" и "сообщений", "messages" и "message" дают одну
+основу). Инвертированный индекс пополняется при добавлении сообщения:
+
+    основа -> ключ чата -> номера сообщений по возрастанию
+
+Номер сообщения - его порядковый номер в индексе, то есть порядок
+добавления. Поиск идёт только по чатам, видимым пользователю: по
+каждому чату берётся самый короткий список основ запроса, остальные
+основы проверяются бинарным поиском, а списки чатов сливаются от новых
+к старым до первых limit совпадений. Стоимость запроса зависит от числа
+совпадений в видимых чатах, а не от объёма истории.
+
+В PostgreSQL то же делает tsvector с конфигурацией russian (она
+стеммирует и кириллицу, и латиницу) и GIN-индексом.
+"""
+from bisect import bisect_left
+from heapq import merge
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+import re
+
+WORD_RE = re.compile(r"\w+")
+CYRILLIC_RE = re.compile(r"[а-я]")
+
+# Глагольные окончания, которые снимаются только после а/я (гласная
+# остаётся): "работает", "работала", "работать" -> "работа", а "отчёт",
+# "пакет", "файла" - не глаголы и своих "ет", "ла" не теряют
+RUSSIAN_VERB_ENDINGS = set("ешь ете ет ют ть ла ло ли л".split())
+
+# Окончания, от длинных к коротким; снимается самое длинное подходящее
+RUSSIAN_ENDINGS = sorted(set("""
+    ивши ывши вши
+    ейшего ейшими ейшая ейшее ейший ейшую ейшей ейших ейшем
+    иями ями ами ием ией иях ях ах ов ев ом ам ям ою ию ия ье ья ьи ью
+    его ого ему ому ими ыми ее ие ые ое ей ий ый ой ем им ым их ых ую юю ая яя ею
+    ишь ите ит ят еть ить уть ыть ил ыл
+    а я о е и ы у ю ь й
+""".split()) | RUSSIAN_VERB_ENDINGS, key=len, reverse=True)
+
+ENGLISH_ENDINGS = sorted("""
+    ational tional ization fulness ousness iveness ation ements ement ments ment
+    ness ings ing edly ly ied ies ed
+""".split(), key=len, reverse=True)
+
+MIN_STEM = 3
+
+
+def _strip_ending(word: str, endings: List[str]) -> str:
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def _strip_russian_ending(word: str) -> str:
+    for ending in RUSSIAN_ENDINGS:
+        if not word.endswith(ending):
+            continue
+        rest = len(word) - len(ending)
+        if ending in RUSSIAN_VERB_ENDINGS and word[rest - 1:rest] not in ("а", "я"):
+            continue
+        if rest >= MIN_STEM:
+            return word[:rest]
+    return word
+
+
+def stem(word: str) -> str:
+    """Основа слова в нижнем регистре"""
+    word = word.lower().replace("ё", "е")
+    if CYRILLIC_RE.search(word):
+        # Возвратная частица снимается отдельно: "учился" -> "учил"
+        for particle in ("ся", "сь"):
+            if word.endswith(particle) and len(word) - 2 >= MIN_STEM:
+                word = word[:-2]
+                break
+        return _strip_russian_ending(word)
+    return _english_stem(word)
+
+
+def _english_stem(word: str) -> str:
+    # Множественное число: "boxes" -> "box", но "files" -> "file"
+    if word.endswith("es") and word[-3:-2] in ("s", "x", "z", "h") and len(word) - 2 >= MIN_STEM:
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith("ss") and len(word) - 1 >= MIN_STEM:
+        word = word[:-1]
+    stripped = _strip_ending(word, ENGLISH_ENDINGS)
+    # "running" -> "runn" -> "run"
+    if stripped != word and len(stripped) > MIN_STEM and stripped[-1] == stripped[-2] \
+            and stripped[-1] not in "lsz":
+        stripped = stripped[:-1]
+    # Немое e: "message" и "messag(es)" дают одну основу
+    if stripped.endswith("e") and len(stripped) > MIN_STEM:
+        stripped = stripped[:-1]
+    return stripped
+
+
+def terms(text: Optional[str]) -> List[str]:
+    """Уникальные основы слов текста в порядке появления"""
+    if not text:
+        return []
+    return list(dict.fromkeys(stem(word) for word in WORD_RE.findall(text)))
+
+
+def message_terms(message: dict) -> List[str]:
+    return terms(f"{message.get('content') or ''} {message.get('file_name') or ''}")
+
+
+class SearchIndex:
+    def __init__(self):
+        self.messages: List[dict] = []  # номер -> сообщение
+        self.numbers: Dict[str, int] = {}  # message_id -> номер
+        self.postings: Dict[str, Dict[str, List[int]]] = {}  # основа -> {ключ чата: [номера]}
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def add(self, key: str, message: dict):
+        """Проиндексировать сообщение чата key"""
+        number = len(self.messages)
+        self.messages.append(message)
+        self.numbers[message["id"]] = number
+        for term in message_terms(message):
+            self.postings.setdefault(term, {}).setdefault(key, []).append(number)
+
+    def search(self, query: str, keys: Iterable[str], limit: int,
+               before: Optional[str] = None) -> List[dict]:
+        """
+        Сообщения чатов keys, содержащие все слова запроса, от новых к
+        старым. before - id сообщения, после которого продолжить выдачу;
+        для неизвестного id - ValueError.
+        """
+        query_terms = terms(query)
+        if not query_terms or limit <= 0:
+            return []
+
+        upper = len(self.messages)
+        if before is not None:
+            if before not in self.numbers:
+                raise ValueError(f"Unknown cursor: {before}")
+            upper = self.numbers[before]
+
+        postings = [self.postings.get(term) for term in query_terms]
+        if not all(postings):
+            return []
+        # Кандидаты - видимые чаты, где есть основа, встречающаяся в
+        # меньшем числе чатов; обходится меньшее из двух множеств
+        narrowest = min(postings, key=len)
+        keys = set(keys)
+        candidates = [key for key in narrowest if key in keys] if len(narrowest) < len(keys) \
+            else [key for key in keys if key in narrowest]
+
+        streams = []
+        for key in candidates:
+            lists = [term_postings.get(key) for term_postings in postings]
+            if all(lists):
+                lists.sort(key=len)
+                streams.append(self._matches(lists[0], lists[1:], upper))
+
+        found = islice(merge(*streams, reverse=True), limit)
+        return [self.messages[number] for number in found]
+
+    @staticmethod
+    def _matches(numbers: List[int], others: List[List[int]], upper: int) -> Iterator[int]:
+        """Номера из numbers меньше upper, входящие во все others, по убыванию"""
+        for i in range(bisect_left(numbers, upper) - 1, -1, -1):
+            number = numbers[i]
+            if all(_contains(other, number) for other in others):
+                yield number
+
+
+def _contains(numbers: List[int], number: int) -> bool:
+    i = bisect_left(numbers, number)
+    return i < len(numbers) and numbers[i] == number
@@ -0,0 +1,45 @@
+"""
+Быстрая сериализация списочных ответов
+
+С response_model FastAPI строит модель Pydantic для каждого элемента,
+валидирует её и сериализует заново, а обработчики перед этим ещё
+копировали каждый dict и разбирали timestamp через
+datetime.fromisoformat. На страницах в сотни сообщений это занимало
+большую часть CPU запроса.
+
+Хранилища отдают даты строками datetime.isoformat() - ровно тем текстом,
+в который Pydantic сериализует naive datetime, - так что строка уже
+готовый JSON-фрагмент и разбирать её не нужно. Списочные обработчики
+берут из dict только поля модели в её порядке (project) и возвращают
+JSONBody: тело кодируется одним вызовом (orjson, если установлен), а
+Response FastAPI не валидирует повторно. response_model остаётся в
+декораторе ради схемы OpenAPI.
+
+Побайтное совпадение с прежним путём через response_model проверяет
+benchmarks/bench_response_serialization.py.
+"""
+from typing import Tuple, Type
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from frames import dumps_bytes
+
+
+def model_fields(model: Type[BaseModel]) -> Tuple[str, ...]:
+    """Имена полей модели в порядке объявления (так их выводит Pydantic)"""
+    return tuple(model.model_fields)
+
+
+def project(data: dict, fields: Tuple[str, ...]) -> dict:
+    """Поля fields из data в этом порядке; отсутствующие - None (значение по умолчанию у моделей ответов)"""
+    return {field: data.get(field) for field in fields}
+
+
+class JSONBody(Response):
+    """JSON-ответ из готовых dict/list, без валидации по response_model"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps_bytes(content)
@@ -0,0 +1,369 @@
+"""
+Слой хранения данных
+
+Обработчики API работают с пользователями, группами и сообщениями только
+через интерфейс Storage. Бэкенд выбирается переменной STORAGE_BACKEND:
+
+- memory   - словари в памяти процесса (локальная разработка и тесты)
+- postgres - PostgreSQL через пул asyncpg (см. storage_postgres.py)
+
+По умолчанию используется postgres, если задан DATABASE_URL.
+"""
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import os
+
+from conversations import ConversationIndex
+from membership import MembershipIndex
+from message_store import MessageStore, timeline_key
+from search_index import SearchIndex
+from user_directory import UserDirectory
+
+
+class Storage:
+    """Интерфейс хранилища. Пользователи, группы и сообщения - обычные dict"""
+
+    async def startup(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    # Пользователи
+    async def create_user(self, user: dict):
+        raise NotImplementedError
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_user_by_id(self, user_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def list_users(self) -> List[dict]:
+        raise NotImplementedError
+
+    async def update_user(self, user_id: str, fields: dict) -> Optional[dict]:
+        """Обновить поля пользователя; None, если пользователь не найден"""
+        raise NotImplementedError
+
+    async def delete_user(self, user_id: str) -> bool:
+        raise NotImplementedError
+
+    async def count_users(self) -> int:
+        raise NotImplementedError
+
+    async def count_users_by_role(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    # Группы
+    async def create_group(self, group: dict):
+        raise NotImplementedError
+
+    async def get_group(self, group_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def list_user_groups(self, user_id: str) -> List[dict]:
+        raise NotImplementedError
+
+    async def list_user_group_ids(self, user_id: str) -> List[str]:
+        raise NotImplementedError
+
+    async def get_group_members(self, group_id: str) -> List[str]:
+        raise NotImplementedError
+
+    async def is_group_member(self, group_id: str, user_id: str) -> bool:
+        raise NotImplementedError
+
+    async def add_group_members(self, group_id: str, member_ids: List[str]) -> List[str]:
+        """Добавить участников и вернуть полный список участников группы"""
+        raise NotImplementedError
+
+    async def count_groups(self) -> int:
+        raise NotImplementedError
+
+    # Сообщения. Страницы истории - от старых к новым, курсоры before/after
+    # (id сообщения или ISO timestamp); для неверного курсора - ValueError
+    async def add_message(self, message: dict) -> int:
+        """Сохранить сообщение; вернуть его глобальный номер seq"""
+        raise NotImplementedError
+
+    async def group_history(self, group_id: str, limit: int,
+                            before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def dm_history(self, user_a: str, user_b: str, limit: int,
+                         before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def user_history(self, user_id: str, limit: int,
+                           before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def latest_messages(self, user_id: str, group_ids: List[str], peer_ids: List[str],
+                              limit: int) -> Dict[str, Tuple[int, List[dict]]]:
+        """
+        Сводка по нескольким чатам пользователя: ключ чата (см.
+        message_store.conversation_key) -> (число сообщений, последние limit
+        сообщений от старых к новым)
+        """
+        raise NotImplementedError
+
+    async def count_messages(self) -> int:
+        raise NotImplementedError
+
+    async def sync_messages(self, user_id: str, since: int, limit: int) -> List[dict]:
+        """
+        Сообщения групп и личных переписок пользователя с глобальным
+        номером seq больше since, по возрастанию seq
+        """
+        raise NotImplementedError
+
+    async def search_messages(self, user_id: str, query: str, limit: int,
+                              before: Optional[str] = None) -> List[dict]:
+        """
+        Полнотекстовый поиск по сообщениям видимых пользователю чатов (см.
+        search_index.py), от новых к старым. before - id последнего
+        сообщения предыдущей страницы; для неизвестного id - ValueError.
+        """
+        raise NotImplementedError
+
+    # Сводка чатов и курсоры прочтения (см. conversations.py). key - ключ
+    # чата в хранилище (message_store.timeline_key)
+    async def mark_read(self, user_id: str, key: str, message_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Отметить чат прочитанным до message_id (по умолчанию - до последнего
+        сообщения); вернуть last_read_message_id и unread_count или None,
+        если сообщения нет в этом чате
+        """
+        raise NotImplementedError
+
+    async def conversation_summaries(self, user_id: str) -> List[dict]:
+        """Сводки групп и личных переписок пользователя (key, message_count,
+        unread_count, last_read_message_id, last_message)"""
+        raise NotImplementedError
+
+    # Загруженные файлы. Содержимое лежит в BlobStore под sha256, здесь -
+    # метаданные загрузок и число загрузок, ссылающихся на каждый блоб.
+    # Ссылка берётся до записи блоба (см. blobstore.store_upload), а блоб
+    # удаляется вместе с последней ссылкой под блокировкой его sha256:
+    # add_file того же содержимого ждёт, пока удаление не закончится
+    async def add_file(self, file: dict) -> int:
+        """Сохранить загрузку и вернуть новое число ссылок на её блоб"""
+        raise NotImplementedError
+
+    async def get_file(self, file_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def get_files(self, file_ids: List[str]) -> Dict[str, dict]:
+        """Метаданные нескольких загрузок одним запросом: file_id -> file"""
+        raise NotImplementedError
+
+    async def update_file(self, file_id: str, fields: dict):
+        """Дописать поля загрузки (размеры изображения, превью)"""
+        raise NotImplementedError
+
+    async def delete_file(self, file_id: str, delete_blob: Callable[[str], Awaitable[None]]) -> Optional[int]:
+        """
+        Удалить загрузку и вернуть оставшееся число ссылок на блоб; None,
+        если её нет. Вместе с последней ссылкой удаляется и блоб - вызовом
+        delete_blob(sha256) (BlobStore.delete)
+        """
+        raise NotImplementedError
+
+
+class MemoryStorage(Storage):
+    """Хранилище в памяти процесса; данные теряются при перезапуске"""
+
+    def __init__(self):
+        self.users = UserDirectory()
+        self.groups_db: Dict[str, dict] = {}  # group_id -> group (без участников)
+        self.membership = MembershipIndex()
+        self.message_store = MessageStore()
+        self.conversations = ConversationIndex()
+        self.search_index = SearchIndex()
+        self.files: Dict[str, dict] = {}  # file_id -> метаданные загрузки
+        self.blob_refs: Counter = Counter()  # sha256 -> число загрузок
+        self.blob_locks: Dict[str, list] = {}  # sha256 -> [asyncio.Lock, число ждущих и владелец]
+
+    async def create_user(self, user: dict):
+        self.users.add(user)
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        return self.users.by_username.get(username)
+
+    async def get_user_by_id(self, user_id: str) -> Optional[dict]:
+        return self.users.by_id.get(user_id)
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return self.users.by_email.get(email)
+
+    async def list_users(self) -> List[dict]:
+        return list(self.users)
+
+    async def update_user(self, user_id: str, fields: dict) -> Optional[dict]:
+        return self.users.update(user_id, fields)
+
+    async def delete_user(self, user_id: str) -> bool:
+        return self.users.remove(user_id) is not None
+
+    async def count_users(self) -> int:
+        return len(self.users)
+
+    async def count_users_by_role(self) -> Dict[str, int]:
+        return dict(self.users.role_counts)
+
+    async def create_group(self, group: dict):
+        group = dict(group)
+        members = group.pop("members")
+        self.groups_db[group["id"]] = group
+        self.membership.add(group["id"], members)
+
+    async def get_group(self, group_id: str) -> Optional[dict]:
+        group = self.groups_db.get(group_id)
+        if group is None:
+            return None
+        return {**group, "members": list(self.membership.members(group_id))}
+
+    async def list_user_groups(self, user_id: str) -> List[dict]:
+        groups = [
+            {**self.groups_db[group_id], "members": list(self.membership.members(group_id))}
+            for group_id in self.membership.groups_of(user_id)
+        ]
+        groups.sort(key=lambda group: group["created_at"])
+        return groups
+
+    async def list_user_group_ids(self, user_id: str) -> List[str]:
+        return list(self.membership.groups_of(user_id))
+
+    async def get_group_members(self, group_id: str) -> List[str]:
+        return list(self.membership.members(group_id))
+
+    async def is_group_member(self, group_id: str, user_id: str) -> bool:
+        return self.membership.is_member(group_id, user_id)
+
+    async def add_group_members(self, group_id: str, member_ids: List[str]) -> List[str]:
+        self.membership.add(group_id, member_ids)
+        return list(self.membership.members(group_id))
+
+    async def count_groups(self) -> int:
+        return len(self.groups_db)
+
+    async def add_message(self, message: dict) -> int:
+        seq = self.message_store.append(message)
+        key = timeline_key(message)
+        if key is not None:
+            self.conversations.record(key, message)
+            self.search_index.add(key, message)
+        return seq
+
+    async def group_history(self, group_id: str, limit: int,
+                            before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return self.message_store.group_history(group_id, limit, before, after)
+
+    async def dm_history(self, user_a: str, user_b: str, limit: int,
+                         before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return self.message_store.dm_history(user_a, user_b, limit, before, after)
+
+    async def user_history(self, user_id: str, limit: int,
+                           before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return self.message_store.user_history(user_id, limit, before, after)
+
+    async def latest_messages(self, user_id: str, group_ids: List[str], peer_ids: List[str],
+                              limit: int) -> Dict[str, Tuple[int, List[dict]]]:
+        return self.message_store.latest(user_id, group_ids, peer_ids, limit)
+
+    async def count_messages(self) -> int:
+        return len(self.message_store)
+
+    async def sync_messages(self, user_id: str, since: int, limit: int) -> List[dict]:
+        return self.message_store.since(user_id, list(self.membership.groups_of(user_id)), since, limit)
+
+    async def search_messages(self, user_id: str, query: str, limit: int,
+                              before: Optional[str] = None) -> List[dict]:
+        keys = [f"group:{group_id}" for group_id in self.membership.groups_of(user_id)]
+        keys.extend(self.conversations.dm_keys(user_id))
+        return self.search_index.search(query, keys, limit, before)
+
+    async def mark_read(self, user_id: str, key: str, message_id: Optional[str] = None) -> Optional[dict]:
+        cursor = self.conversations.mark_read(user_id, key, message_id)
+        if cursor is None:
+            return None
+        return {
+            "last_read_message_id": cursor[0],
+            "unread_count": self.conversations.summaries[key]["message_count"] - cursor[1]
+        }
+
+    async def conversation_summaries(self, user_id: str) -> List[dict]:
+        group_keys = [f"group:{group_id}" for group_id in self.membership.groups_of(user_id)]
+        return self.conversations.summaries_for(user_id, group_keys)
+
+    @asynccontextmanager
+    async def _blob_lock(self, sha256: str):
+        entry = self.blob_locks.setdefault(sha256, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.blob_locks[sha256]
+
+    async def add_file(self, file: dict) -> int:
+        async with self._blob_lock(file["sha256"]):
+            self.files[file["id"]] = file
+            self.blob_refs[file["sha256"]] += 1
+            return self.blob_refs[file["sha256"]]
+
+    async def get_file(self, file_id: str) -> Optional[dict]:
+        return self.files.get(file_id)
+
+    async def get_files(self, file_ids: List[str]) -> Dict[str, dict]:
+        return {file_id: self.files[file_id] for file_id in file_ids if file_id in self.files}
+
+    async def update_file(self, file_id: str, fields: dict):
+        file = self.files.get(file_id)
+        if file is not None:
+            file.update(fields)
+
+    async def delete_file(self, file_id: str, delete_blob: Callable[[str], Awaitable[None]]) -> Optional[int]:
+        file = self.files.get(file_id)
+        if file is None:
+            return None
+        async with self._blob_lock(file["sha256"]):
+            refs = self._release_file(file_id)
+            if refs == 0:
+                await delete_blob(file["sha256"])
+        return refs
+
+    def _release_file(self, file_id: str) -> Optional[int]:
+        file = self.files.pop(file_id, None)
+        if file is None:
+            return None
+        self.blob_refs[file["sha256"]] -= 1
+        refs = self.blob_refs[file["sha256"]]
+        if refs <= 0:
+            del self.blob_refs[file["sha256"]]
+        return refs
+
+
+def create_storage() -> Storage:
+    """Создать хранилище по переменным окружения"""
+    database_url = os.getenv("DATABASE_URL")
+    backend = os.getenv("STORAGE_BACKEND", "postgres" if database_url else "memory")
+
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "postgres":
+        from storage_postgres import PostgresStorage
+        return PostgresStorage(
+            database_url,
+            pool_size=int(os.getenv("DATABASE_POOL_SIZE", "20")),
+            max_overflow=int(os.getenv("DATABASE_MAX_OVERFLOW", "0"))
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
@@ -0,0 +1,741 @@
+"""
+PostgreSQL-бэкенд хранилища через пул соединений asyncpg
+
+Схема создаётся при старте (CREATE ... IF NOT EXISTS). История чатов
+читается keyset-запросами по индексам (group_id, timestamp, seq) и
+(dm_pair, timestamp, seq). asyncpg готовит каждый запрос один раз на
+соединение и дальше берёт prepared statement из своего кеша, поэтому
+горячие запросы (вставка сообщения, страница истории, участники группы)
+вынесены в неизменяемые SQL-константы.
+"""
+from datetime import datetime
+import json
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from message_store import conversation_key, dm_key, parse_cursor_timestamp, timeline_key
+from storage import Storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    full_name TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'user',
+    password_hash TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email);
+
+-- Число пользователей по ролям поддерживается триггером, чтобы статистика
+-- не считала count(*) по всей таблице
+CREATE TABLE IF NOT EXISTS user_role_counts (
+    role TEXT PRIMARY KEY,
+    total BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO user_role_counts (role, total)
+    SELECT role, count(*) FROM users GROUP BY role
+    ON CONFLICT (role) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION users_count_roles() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_role_counts SET total = total - 1 WHERE role = OLD.role;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_role_counts (role, total) VALUES (NEW.role, 1)
+        ON CONFLICT (role) DO UPDATE SET total = user_role_counts.total + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER users_count_roles
+    AFTER INSERT OR DELETE OR UPDATE OF role ON users
+    FOR EACH ROW EXECUTE FUNCTION users_count_roles();
+
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP NOT NULL,
+    created_by TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id TEXT NOT NULL REFERENCES groups (id) ON DELETE CASCADE,
+    user_id TEXT NOT NULL,
+    PRIMARY KEY (group_id, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id);
+
+CREATE TABLE IF NOT EXISTS messages (
+    seq BIGSERIAL PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    sender_id TEXT NOT NULL,
+    sender_name TEXT NOT NULL,
+    content TEXT,
+    recipient_id TEXT,
+    group_id TEXT,
+    dm_pair TEXT,
+    "timestamp" TIMESTAMP NOT NULL,
+    type TEXT NOT NULL,
+    file_url TEXT,
+    file_name TEXT,
+    file_size BIGINT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_group_ts
+    ON messages (group_id, "timestamp", seq) WHERE group_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_dm_ts
+    ON messages (dm_pair, "timestamp", seq) WHERE dm_pair IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_sender_ts ON messages (sender_id, "timestamp", seq);
+CREATE INDEX IF NOT EXISTS idx_messages_recipient_ts
+    ON messages (recipient_id, "timestamp", seq) WHERE recipient_id IS NOT NULL;
+
+-- Блоб (содержимое файла) хранится один раз, refcount - число загрузок
+-- с этим содержимым
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size BIGINT NOT NULL,
+    refcount BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    size BIGINT NOT NULL,
+    uploaded_by TEXT NOT NULL,
+    uploaded_at TIMESTAMP NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    previews JSONB
+);
+ALTER TABLE files ADD COLUMN IF NOT EXISTS width INTEGER;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS height INTEGER;
+ALTER TABLE files ADD COLUMN IF NOT EXISTS previews JSONB;
+
+-- Сводка чатов (см. conversations.py): key - group:<group_id> или
+-- dm:<dm_pair>, conversation_seq - номер сообщения в его чате
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS conversation_seq BIGINT;
+
+CREATE TABLE IF NOT EXISTS conversations (
+    key TEXT PRIMARY KEY,
+    message_count BIGINT NOT NULL,
+    last_message_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS read_cursors (
+    user_id TEXT NOT NULL,
+    conversation TEXT NOT NULL,
+    message_id TEXT,
+    ordinal BIGINT NOT NULL,
+    PRIMARY KEY (user_id, conversation)
+);
+
+-- История, накопленная до появления сводки, нумеруется один раз (пока
+-- сводка пуста) и считается прочитанной
+UPDATE messages m SET conversation_seq = n.ordinal
+FROM (
+    SELECT seq, row_number() OVER (
+        PARTITION BY COALESCE('group:' || group_id, 'dm:' || dm_pair) ORDER BY "timestamp", seq
+    ) AS ordinal
+    FROM messages
+) n
+WHERE m.seq = n.seq AND NOT EXISTS (SELECT 1 FROM conversations);
+INSERT INTO conversations (key, message_count, last_message_id)
+    SELECT DISTINCT ON (key) key, conversation_seq, id
+    FROM (SELECT COALESCE('group:' || group_id, 'dm:' || dm_pair) AS key, conversation_seq, id FROM messages) s
+    WHERE key IS NOT NULL AND NOT EXISTS (SELECT 1 FROM conversations)
+    ORDER BY key, conversation_seq DESC;
+INSERT INTO read_cursors (user_id, conversation, message_id, ordinal)
+    SELECT user_id, key, last_message_id, message_count FROM (
+        SELECT split_part(substr(c.key, 4), ':', p.part) AS user_id, c.*
+        FROM conversations c CROSS JOIN (VALUES (1), (2)) AS p (part)
+        WHERE c.key LIKE 'dm:%'
+        UNION ALL
+        SELECT gm.user_id, c.*
+        FROM conversations c JOIN group_members gm ON c.key = 'group:' || gm.group_id
+    ) s
+    WHERE NOT EXISTS (SELECT 1 FROM read_cursors)
+    ON CONFLICT DO NOTHING;
+
+-- Полнотекстовый поиск (см. search_index.py): конфигурация russian
+-- стеммирует русские слова, а латиницу - английским стеммером
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS (
+    to_tsvector('russian', COALESCE(content, '') || ' ' || COALESCE(file_name, ''))
+) STORED;
+CREATE INDEX IF NOT EXISTS idx_messages_search ON messages USING GIN (search);
+"""
+# Advisory-блокировки приложения - в пространстве ключей (класс, ключ);
+# одиночные bigint-ключи заняты номерами вставляемых сообщений (ниже)
+ADVISORY_LOCK_CLASS = 0x63686174  # "chat"
+SCHEMA_LOCK_KEY = 1
+MESSAGE_SEQ_GATE_KEY = 2
+
+# Воркеры стартуют одновременно, а CREATE ... IF NOT EXISTS и ALTER TABLE
+# не защищены от параллельного выполнения (дубликат в pg_type, ожидание
+# блокировок). Схема создаётся в одной транзакции под этой блокировкой:
+# остальные воркеры ждут и видят уже готовую схему
+LOCK_SCHEMA = f"SELECT pg_advisory_xact_lock({ADVISORY_LOCK_CLASS}, {SCHEMA_LOCK_KEY})"
+
+# Глобальный seq берётся из последовательности при вставке, а транзакции
+# коммитятся в любом порядке: seq 11 может стать видимым раньше seq 10, и
+# клиент, продолжающий с since=11, потерял бы 10. Поэтому вставка держит
+# до конца транзакции advisory-блокировку со своим seq в ключе, а /sync
+# отдаёт только seq ниже горизонта - наименьшего seq, чья транзакция ещё
+# идёт (по pg_locks), или следующего seq, если таких нет. Выдача номера и
+# взятие его блокировки идут под разделяемым "шлюзом", а горизонт
+# считается под исключительным: номер без блокировки горизонт не увидит.
+# Вставки друг друга не ждут; шлюз занят лишь на время nextval.
+MESSAGE_SEQ_FUNCTIONS = f"""
+CREATE OR REPLACE FUNCTION reserve_message_seq() RETURNS bigint AS $$
+DECLARE
+    reserved bigint;
+BEGIN
+    PERFORM pg_advisory_lock_shared({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+    BEGIN
+        reserved := nextval(pg_get_serial_sequence('messages', 'seq'));
+        PERFORM pg_advisory_xact_lock(reserved);
+    EXCEPTION WHEN query_canceled OR others THEN
+        PERFORM pg_advisory_unlock_shared({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+        RAISE;
+    END;
+    PERFORM pg_advisory_unlock_shared({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+    RETURN reserved;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION message_seq_horizon() RETURNS bigint AS $$
+DECLARE
+    horizon bigint;
+BEGIN
+    PERFORM pg_advisory_lock({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+    BEGIN
+        SELECT least(
+            COALESCE(pg_sequence_last_value(pg_get_serial_sequence('messages', 'seq')::regclass), 0) + 1,
+            (SELECT min((classid::bigint << 32) | objid::bigint) FROM pg_locks
+             WHERE locktype = 'advisory' AND objsubid = 1
+               AND database = (SELECT oid FROM pg_database WHERE datname = current_database()))
+        ) INTO horizon;
+    EXCEPTION WHEN query_canceled OR others THEN
+        PERFORM pg_advisory_unlock({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+        RAISE;
+    END;
+    PERFORM pg_advisory_unlock({ADVISORY_LOCK_CLASS}, {MESSAGE_SEQ_GATE_KEY});
+    RETURN horizon;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+USER_COLUMNS = "id, username, email, full_name, role, password_hash, created_at"
+GROUP_COLUMNS = "id, name, description, created_at, created_by"
+MESSAGE_COLUMNS = (
+    'id, sender_id, sender_name, content, recipient_id, group_id, "timestamp", type, '
+    "file_url, file_name, file_size"
+)
+# Поля сообщения в ответах: колонки и глобальный номер seq
+MESSAGE_FIELDS = [column.strip().strip('"') for column in MESSAGE_COLUMNS.split(",")] + ["seq"]
+
+INSERT_USER = f"INSERT INTO users ({USER_COLUMNS}) VALUES ($1, $2, $3, $4, $5, $6, $7)"
+SELECT_USER_BY_USERNAME = f"SELECT {USER_COLUMNS} FROM users WHERE username = $1"
+SELECT_USER_BY_ID = f"SELECT {USER_COLUMNS} FROM users WHERE id = $1"
+SELECT_USER_BY_EMAIL = f"SELECT {USER_COLUMNS} FROM users WHERE email = $1"
+UPDATE_USER = f"""
+    UPDATE users SET
+        full_name = COALESCE($2, full_name),
+        email = COALESCE($3, email),
+        role = COALESCE($4, role)
+    WHERE id = $1
+    RETURNING {USER_COLUMNS}
+"""
+
+INSERT_GROUP = f"INSERT INTO groups ({GROUP_COLUMNS}) VALUES ($1, $2, $3, $4, $5)"
+INSERT_GROUP_MEMBERS = """
+    INSERT INTO group_members (group_id, user_id)
+    SELECT $1, unnest($2::text[])
+    ON CONFLICT DO NOTHING
+"""
+SELECT_GROUP = f"""
+    SELECT {GROUP_COLUMNS},
+           ARRAY(SELECT user_id FROM group_members m WHERE m.group_id = g.id) AS members
+    FROM groups g WHERE id = $1
+"""
+SELECT_USER_GROUPS = f"""
+    SELECT {GROUP_COLUMNS},
+           ARRAY(SELECT user_id FROM group_members m WHERE m.group_id = g.id) AS members
+    FROM groups g
+    WHERE id IN (SELECT group_id FROM group_members WHERE user_id = $1)
+    ORDER BY created_at
+"""
+SELECT_GROUP_MEMBERS = "SELECT user_id FROM group_members WHERE group_id = $1"
+SELECT_USER_GROUP_IDS = "SELECT group_id FROM group_members WHERE user_id = $1"
+SELECT_IS_MEMBER = "SELECT EXISTS (SELECT 1 FROM group_members WHERE group_id = $1 AND user_id = $2)"
+
+INSERT_MESSAGE = f"""
+    INSERT INTO messages ({MESSAGE_COLUMNS}, dm_pair, seq)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+    RETURNING seq
+"""
+# Сообщение вместе со сводкой чата и курсорами одним запросом: номер
+# сообщения в чате, курсор отправителя на нём, курсор получателя личного
+# сообщения (если его ещё нет). Строка чата в conversations блокируется до
+# конца вставки, поэтому номера в чате идут без пропусков и повторов
+ADD_MESSAGE = f"""
+    WITH summary AS (
+        INSERT INTO conversations (key, message_count, last_message_id) VALUES ($13, 1, $1)
+        ON CONFLICT (key) DO UPDATE SET
+            message_count = conversations.message_count + 1,
+            last_message_id = EXCLUDED.last_message_id
+        RETURNING message_count
+    ), message AS (
+        INSERT INTO messages ({MESSAGE_COLUMNS}, dm_pair, seq, conversation_seq)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $14, (SELECT message_count FROM summary))
+        RETURNING seq
+    ), sender_cursor AS (
+        INSERT INTO read_cursors (user_id, conversation, message_id, ordinal)
+        SELECT $2, $13, $1, message_count FROM summary
+        ON CONFLICT (user_id, conversation) DO UPDATE SET
+            message_id = EXCLUDED.message_id,
+            ordinal = EXCLUDED.ordinal
+    ), recipient_cursor AS (
+        INSERT INTO read_cursors (user_id, conversation, message_id, ordinal)
+        SELECT $5, $13, NULL, 0 WHERE $12::text IS NOT NULL AND $5::text <> $2::text
+        ON CONFLICT DO NOTHING
+    )
+    SELECT seq FROM message
+"""
+SELECT_MESSAGE_KEY = 'SELECT "timestamp", seq FROM messages WHERE id = $1'
+
+# Сообщения групп пользователя и его личные после глобального номера $2
+# и до горизонта $4 (чтение по первичному ключу seq с позиции клиента)
+SYNC_MESSAGES = f"""
+    SELECT {MESSAGE_COLUMNS}, seq FROM messages
+    WHERE seq > $2 AND seq < $4
+      AND (group_id IN (SELECT group_id FROM group_members WHERE user_id = $1)
+           OR sender_id = $1 OR recipient_id = $1)
+    ORDER BY seq
+    LIMIT $3
+"""
+
+# Совпадения в группах пользователя и его личных переписках, от новых к старым
+SEARCH_MESSAGES = f"""
+    SELECT {MESSAGE_COLUMNS}, seq FROM messages
+    WHERE search @@ plainto_tsquery('russian', $2)
+      AND (group_id IN (SELECT group_id FROM group_members WHERE user_id = $1)
+           OR (dm_pair IS NOT NULL AND (sender_id = $1 OR recipient_id = $1)))
+      AND seq < $3
+    ORDER BY seq DESC
+    LIMIT $4
+"""
+
+# Сообщение, до которого отмечается прочтение ($2 или последнее в чате $1)
+SELECT_READ_TARGET = """
+    SELECT m.id, m.conversation_seq, c.message_count
+    FROM conversations c
+    JOIN messages m ON m.id = COALESCE($2, c.last_message_id)
+    WHERE c.key = $1
+      AND COALESCE('group:' || m.group_id, 'dm:' || m.dm_pair) = c.key
+      AND m.conversation_seq IS NOT NULL
+"""
+# Курсор прочтения только двигается вперёд
+UPSERT_READ_CURSOR = """
+    INSERT INTO read_cursors (user_id, conversation, message_id, ordinal) VALUES ($1, $2, $3, $4)
+    ON CONFLICT (user_id, conversation) DO UPDATE SET
+        message_id = CASE WHEN read_cursors.ordinal < EXCLUDED.ordinal
+                          THEN EXCLUDED.message_id ELSE read_cursors.message_id END,
+        ordinal = GREATEST(read_cursors.ordinal, EXCLUDED.ordinal)
+    RETURNING message_id, ordinal
+"""
+SELECT_CONVERSATION_SUMMARIES = f"""
+    SELECT c.key, c.message_count, COALESCE(r.ordinal, 0) AS read_ordinal,
+           r.message_id AS last_read_message_id,
+           {", ".join(f'm."{field}"' for field in MESSAGE_FIELDS)}
+    FROM (
+        SELECT 'group:' || group_id AS key FROM group_members WHERE user_id = $1
+        UNION
+        SELECT conversation FROM read_cursors WHERE user_id = $1 AND conversation LIKE 'dm:%'
+    ) k
+    JOIN conversations c ON c.key = k.key
+    LEFT JOIN read_cursors r ON r.user_id = $1 AND r.conversation = c.key
+    LEFT JOIN messages m ON m.id = c.last_message_id
+"""
+
+FILE_COLUMNS = "id, sha256, filename, content_type, size, uploaded_by, uploaded_at, width, height, previews"
+ACQUIRE_BLOB = """
+    INSERT INTO blobs (sha256, size, refcount) VALUES ($1, $2, 1)
+    ON CONFLICT (sha256) DO UPDATE SET refcount = blobs.refcount + 1
+    RETURNING refcount
+"""
+RELEASE_BLOB = "UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = $1 RETURNING refcount"
+INSERT_FILE = """
+    INSERT INTO files (id, sha256, filename, content_type, size, uploaded_by, uploaded_at, width, height)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+"""
+SELECT_FILE = f"SELECT {FILE_COLUMNS} FROM files WHERE id = $1"
+SELECT_FILES = f"SELECT {FILE_COLUMNS} FROM files WHERE id = ANY($1::text[])"
+UPDATE_FILE = """
+    UPDATE files SET
+        width = COALESCE($2, width),
+        height = COALESCE($3, height),
+        previews = COALESCE($4::jsonb, previews)
+    WHERE id = $1
+"""
+
+# Границы keyset-диапазона, когда курсор не задан. asyncpg кодирует
+# datetime.min/max как -infinity/infinity
+_MIN_KEY = (datetime.min, 0)
+_MAX_KEY = (datetime.max, 2 ** 63 - 1)
+
+
+def _history_sql(conditions: List[str], forward: bool) -> str:
+    """
+    Страница истории по keyset-диапазону ($2, $3) < (timestamp, seq) < ($4, $5).
+
+    Каждое условие читается отдельным упорядоченным index scan, результаты
+    объединяются через UNION (сообщение самому себе попадает в обе ветки).
+    """
+    order = '"timestamp", seq' if forward else '"timestamp" DESC, seq DESC'
+    parts = [
+        f"""(SELECT {MESSAGE_COLUMNS}, seq FROM messages
+            WHERE {condition}
+              AND ("timestamp", seq) > ($2, $3) AND ("timestamp", seq) < ($4, $5)
+            ORDER BY {order} LIMIT $6)"""
+        for condition in conditions
+    ]
+    return f"SELECT {MESSAGE_COLUMNS}, seq FROM ({' UNION '.join(parts)}) page ORDER BY {order} LIMIT $6"
+
+
+HISTORY_SQL: Dict[Tuple[str, bool], str] = {}
+for _timeline, _conditions in (
+    ("group", ["group_id = $1"]),
+    ("dm", ["dm_pair = $1"]),
+    ("user", ["sender_id = $1", "recipient_id = $1"]),
+):
+    for _forward in (False, True):
+        HISTORY_SQL[(_timeline, _forward)] = _history_sql(_conditions, _forward)
+
+
+def _latest_sql(timeline: str, column: str) -> str:
+    """
+    Число сообщений и последние $2 сообщений для каждого ключа из $1.
+
+    Число берётся из сводки чата (conversations.message_count), а для
+    сообщений у каждого чата свой LATERAL-подзапрос по индексу (column,
+    timestamp, seq): LIMIT читает только последние записи этого чата.
+    """
+    return f"""
+        SELECT c.key, COALESCE(s.message_count, 0) AS total, m.*
+        FROM unnest($1::text[]) AS c (key)
+        LEFT JOIN conversations s ON s.key = '{timeline}:' || c.key
+        LEFT JOIN LATERAL (
+            SELECT {MESSAGE_COLUMNS}, seq FROM messages WHERE {column} = c.key
+            ORDER BY "timestamp" DESC, seq DESC LIMIT $2
+        ) m ON true
+        ORDER BY c.key, m."timestamp", m.seq
+    """
+
+
+LATEST_SQL = {"group": _latest_sql("group", "group_id"), "dm": _latest_sql("dm", "dm_pair")}
+
+
+def _isoformat_fields(row, *fields) -> dict:
+    """Строка БД -> dict в том же виде, что и в MemoryStorage (даты ISO-строками)"""
+    data = dict(row)
+    for field in fields:
+        if data.get(field) is not None:
+            data[field] = data[field].isoformat()
+    return data
+
+
+def _user(row) -> Optional[dict]:
+    return _isoformat_fields(row, "created_at") if row else None
+
+
+def _group(row) -> Optional[dict]:
+    if not row:
+        return None
+    group = _isoformat_fields(row, "created_at")
+    group["members"] = list(group["members"])
+    return group
+
+
+def _file(row) -> Optional[dict]:
+    if not row:
+        return None
+    file = _isoformat_fields(row, "uploaded_at")
+    if file["previews"] is not None:
+        file["previews"] = json.loads(file["previews"])
+    return file
+
+
+class PostgresStorage(Storage):
+    def __init__(self, dsn: str, pool_size: int = 20, max_overflow: int = 0):
+        # SQLAlchemy-style URL (postgresql+asyncpg://) тоже подходит
+        self.dsn = dsn.replace("+asyncpg", "")
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool: Optional[asyncpg.Pool] = None
+
+    async def startup(self):
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=self.pool_size,
+            max_size=self.pool_size + self.max_overflow
+        )
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(LOCK_SCHEMA)
+                await conn.execute(SCHEMA)
+                await conn.execute(MESSAGE_SEQ_FUNCTIONS)
+
+    async def shutdown(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # Пользователи
+    async def create_user(self, user: dict):
+        await self.pool.execute(
+            INSERT_USER,
+            user["id"], user["username"], user["email"], user["full_name"],
+            user["role"], user["password_hash"], datetime.fromisoformat(user["created_at"])
+        )
+
+    async def get_user_by_username(self, username: str) -> Optional[dict]:
+        return _user(await self.pool.fetchrow(SELECT_USER_BY_USERNAME, username))
+
+    async def get_user_by_id(self, user_id: str) -> Optional[dict]:
+        return _user(await self.pool.fetchrow(SELECT_USER_BY_ID, user_id))
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return _user(await self.pool.fetchrow(SELECT_USER_BY_EMAIL, email))
+
+    async def list_users(self) -> List[dict]:
+        rows = await self.pool.fetch(f"SELECT {USER_COLUMNS} FROM users ORDER BY created_at")
+        return [_user(row) for row in rows]
+
+    async def update_user(self, user_id: str, fields: dict) -> Optional[dict]:
+        row = await self.pool.fetchrow(
+            UPDATE_USER, user_id, fields.get("full_name"), fields.get("email"), fields.get("role")
+        )
+        return _user(row)
+
+    async def delete_user(self, user_id: str) -> bool:
+        result = await self.pool.execute("DELETE FROM users WHERE id = $1", user_id)
+        return result != "DELETE 0"
+
+    async def count_users(self) -> int:
+        return await self.pool.fetchval("SELECT COALESCE(sum(total), 0) FROM user_role_counts")
+
+    async def count_users_by_role(self) -> Dict[str, int]:
+        rows = await self.pool.fetch("SELECT role, total FROM user_role_counts")
+        return {row["role"]: row["total"] for row in rows}
+
+    # Группы
+    async def create_group(self, group: dict):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    INSERT_GROUP,
+                    group["id"], group["name"], group["description"],
+                    datetime.fromisoformat(group["created_at"]), group["created_by"]
+                )
+                await conn.execute(INSERT_GROUP_MEMBERS, group["id"], group["members"])
+
+    async def get_group(self, group_id: str) -> Optional[dict]:
+        return _group(await self.pool.fetchrow(SELECT_GROUP, group_id))
+
+    async def list_user_groups(self, user_id: str) -> List[dict]:
+        return [_group(row) for row in await self.pool.fetch(SELECT_USER_GROUPS, user_id)]
+
+    async def list_user_group_ids(self, user_id: str) -> List[str]:
+        return [row["group_id"] for row in await self.pool.fetch(SELECT_USER_GROUP_IDS, user_id)]
+
+    async def get_group_members(self, group_id: str) -> List[str]:
+        return [row["user_id"] for row in await self.pool.fetch(SELECT_GROUP_MEMBERS, group_id)]
+
+    async def is_group_member(self, group_id: str, user_id: str) -> bool:
+        return await self.pool.fetchval(SELECT_IS_MEMBER, group_id, user_id)
+
+    async def add_group_members(self, group_id: str, member_ids: List[str]) -> List[str]:
+        async with self.pool.acquire() as conn:
+            await conn.execute(INSERT_GROUP_MEMBERS, group_id, member_ids)
+            return [row["user_id"] for row in await conn.fetch(SELECT_GROUP_MEMBERS, group_id)]
+
+    async def count_groups(self) -> int:
+        return await self.pool.fetchval("SELECT count(*) FROM groups")
+
+    # Сообщения
+    async def add_message(self, message: dict) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                return await self._insert_message(conn, message)
+
+    @staticmethod
+    async def _insert_message(conn: asyncpg.Connection, message: dict) -> int:
+        """Вставка в уже открытой транзакции conn; seq выдаёт reserve_message_seq()"""
+        pair = None
+        if not message.get("group_id") and message.get("recipient_id"):
+            pair = dm_key(message["sender_id"], message["recipient_id"])
+        values = (
+            message["id"], message["sender_id"], message["sender_name"], message["content"],
+            message["recipient_id"], message["group_id"], datetime.fromisoformat(message["timestamp"]),
+            message["type"], message["file_url"], message["file_name"], message["file_size"], pair
+        )
+        seq = await conn.fetchval("SELECT reserve_message_seq()")
+        key = timeline_key(message)
+        if key is None:
+            return await conn.fetchval(INSERT_MESSAGE, *values, seq)
+        return await conn.fetchval(ADD_MESSAGE, *values, key, seq)
+
+    async def group_history(self, group_id: str, limit: int,
+                            before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return await self._history("group", group_id, limit, before, after)
+
+    async def dm_history(self, user_a: str, user_b: str, limit: int,
+                         before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return await self._history("dm", dm_key(user_a, user_b), limit, before, after)
+
+    async def user_history(self, user_id: str, limit: int,
+                           before: Optional[str] = None, after: Optional[str] = None) -> List[dict]:
+        return await self._history("user", user_id, limit, before, after)
+
+    async def latest_messages(self, user_id: str, group_ids: List[str], peer_ids: List[str],
+                              limit: int) -> Dict[str, Tuple[int, List[dict]]]:
+        # ключ ленты в БД -> ключ чата в ответе
+        group_keys = {group_id: conversation_key("group", group_id) for group_id in group_ids}
+        dm_keys = {dm_key(user_id, peer_id): conversation_key("user", peer_id) for peer_id in peer_ids}
+
+        result: Dict[str, Tuple[int, List[dict]]] = {}
+        async with self.pool.acquire() as conn:
+            for timeline, keys in (("group", group_keys), ("dm", dm_keys)):
+                if not keys:
+                    continue
+                for row in await conn.fetch(LATEST_SQL[timeline], list(keys), limit):
+                    total, messages = result.setdefault(keys[row["key"]], (row["total"], []))
+                    if row["id"] is not None:
+                        messages.append(_isoformat_fields(
+                            {column: row[column] for column in MESSAGE_FIELDS}, "timestamp"
+                        ))
+        return result
+
+    async def count_messages(self) -> int:
+        # Сумма по сводкам чатов вместо count(*) по всей таблице сообщений
+        return await self.pool.fetchval("SELECT COALESCE(sum(message_count), 0)::bigint FROM conversations")
+
+    # Файлы. Строка blobs, заблокированная изменением refcount, служит
+    # блокировкой блоба: удаление блоба с последней ссылкой идёт до фиксации
+    # транзакции, и ACQUIRE_BLOB того же содержимого ждёт её конца
+    async def add_file(self, file: dict) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                refs = await conn.fetchval(ACQUIRE_BLOB, file["sha256"], file["size"])
+                await conn.execute(
+                    INSERT_FILE,
+                    file["id"], file["sha256"], file["filename"], file["content_type"],
+                    file["size"], file["uploaded_by"], datetime.fromisoformat(file["uploaded_at"]),
+                    file.get("width"), file.get("height")
+                )
+        return refs
+
+    async def get_file(self, file_id: str) -> Optional[dict]:
+        return _file(await self.pool.fetchrow(SELECT_FILE, file_id))
+
+    async def get_files(self, file_ids: List[str]) -> Dict[str, dict]:
+        rows = await self.pool.fetch(SELECT_FILES, file_ids)
+        return {row["id"]: _file(row) for row in rows}
+
+    async def update_file(self, file_id: str, fields: dict):
+        previews = fields.get("previews")
+        await self.pool.execute(
+            UPDATE_FILE, file_id, fields.get("width"), fields.get("height"),
+            json.dumps(previews) if previews is not None else None
+        )
+
+    async def delete_file(self, file_id: str, delete_blob: Callable[[str], Awaitable[None]]) -> Optional[int]:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                sha256 = await conn.fetchval("DELETE FROM files WHERE id = $1 RETURNING sha256", file_id)
+                if sha256 is None:
+                    return None
+                refs = await conn.fetchval(RELEASE_BLOB, sha256)
+                if refs <= 0:
+                    await conn.execute("DELETE FROM blobs WHERE sha256 = $1", sha256)
+                    await delete_blob(sha256)
+        return refs
+
+    # Сводка чатов
+    async def mark_read(self, user_id: str, key: str, message_id: Optional[str] = None) -> Optional[dict]:
+        async with self.pool.acquire() as conn:
+            target = await conn.fetchrow(SELECT_READ_TARGET, key, message_id)
+            if target is None:
+                return None
+            cursor = await conn.fetchrow(
+                UPSERT_READ_CURSOR, user_id, key, target["id"], target["conversation_seq"]
+            )
+        return {
+            "last_read_message_id": cursor["message_id"],
+            "unread_count": target["message_count"] - cursor["ordinal"]
+        }
+
+    async def conversation_summaries(self, user_id: str) -> List[dict]:
+        rows = await self.pool.fetch(SELECT_CONVERSATION_SUMMARIES, user_id)
+        return [
+            {
+                "key": row["key"],
+                "message_count": row["message_count"],
+                "unread_count": row["message_count"] - row["read_ordinal"],
+                "last_read_message_id": row["last_read_message_id"],
+                "last_message": _isoformat_fields(
+                    {field: row[field] for field in MESSAGE_FIELDS}, "timestamp"
+                ) if row["id"] is not None else None
+            }
+            for row in rows
+        ]
+
+    async def sync_messages(self, user_id: str, since: int, limit: int) -> List[dict]:
+        async with self.pool.acquire() as conn:
+            # Горизонт - отдельным запросом до чтения: снимок сообщений должен
+            # быть сделан после него
+            horizon = await conn.fetchval("SELECT message_seq_horizon()")
+            rows = await conn.fetch(SYNC_MESSAGES, user_id, since, limit, horizon)
+        return [_isoformat_fields(row, "timestamp") for row in rows]
+
+    async def search_messages(self, user_id: str, query: str, limit: int,
+                              before: Optional[str] = None) -> List[dict]:
+        async with self.pool.acquire() as conn:
+            upper = _MAX_KEY[1]
+            if before:
+                row = await conn.fetchrow(SELECT_MESSAGE_KEY, before)
+                if row is None:
+                    raise ValueError(f"Unknown cursor: {before}")
+                upper = row["seq"]
+            rows = await conn.fetch(SEARCH_MESSAGES, user_id, query, upper, limit)
+        return [_isoformat_fields(row, "timestamp") for row in rows]
+
+    async def _history(self, timeline: str, key: str, limit: int,
+                       before: Optional[str], after: Optional[str]) -> List[dict]:
+        async with self.pool.acquire() as conn:
+            before_key = await self._cursor_key(conn, before, after=False) if before else _MAX_KEY
+            after_key = await self._cursor_key(conn, after, after=True) if after else _MIN_KEY
+            forward = after is not None
+            rows = await conn.fetch(
+                HISTORY_SQL[(timeline, forward)],
+                key, after_key[0], after_key[1], before_key[0], before_key[1], limit
+            )
+
+        messages = [_isoformat_fields(row, "timestamp") for row in rows]
+        if not forward:
+            messages.reverse()
+        return messages
+
+    @staticmethod
+    async def _cursor_key(conn, cursor: str, after: bool) -> Tuple[datetime, int]:
+        row = await conn.fetchrow(SELECT_MESSAGE_KEY, cursor)
+        if row:
+            return row["timestamp"], row["seq"]
+        return parse_cursor_timestamp(cursor), _MAX_KEY[1] if after else 0
@@ -0,0 +1,75 @@
+"""Кеш пользователей get_current_user и его сброс"""
+import asyncio
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import main
+from auth_cache import MAX_INVALIDATIONS, PrincipalCache
+
+
+async def create_user() -> dict:
+    user = {
+        "id": str(uuid.uuid4()), "username": f"user-{uuid.uuid4().hex[:8]}", "email": "u@example.com",
+        "full_name": "U", "role": "user", "password_hash": "x", "created_at": datetime.utcnow().isoformat()
+    }
+    await main.storage.create_user(user)
+    return user
+
+
+def test_invalidation_during_lookup_is_not_overwritten(monkeypatch):
+    async def scenario():
+        user = await create_user()
+        token = main.create_access_token({"sub": user["username"]})
+        cache = PrincipalCache()
+        monkeypatch.setattr(main, "principal_cache", cache)
+
+        # Чтение пользователя ждёт, пока админ его меняет и сбрасывает кеш
+        reading, release = asyncio.Event(), asyncio.Event()
+        get_user = main.storage.get_user_by_username
+
+        async def slow_get_user(username):
+            found = await get_user(username)
+            reading.set()
+            await release.wait()
+            return found
+
+        monkeypatch.setattr(main.storage, "get_user_by_username", slow_get_user)
+        request = asyncio.create_task(main.get_current_user(token))
+        await reading.wait()
+        cache.invalidate_user(user["id"])
+        release.set()
+
+        assert (await request)["id"] == user["id"]
+        assert cache.get(token) is None, "прочитанная до сброса запись не должна попасть в кеш"
+
+        # Следующий запрос читает и кеширует пользователя как обычно
+        monkeypatch.setattr(main.storage, "get_user_by_username", get_user)
+        await main.get_current_user(token)
+        assert cache.get(token)["id"] == user["id"]
+
+    asyncio.run(scenario())
+
+
+def test_invalid_token_is_rejected():
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(main.get_current_user("not-a-jwt"))
+    assert exc_info.value.status_code == 401
+
+
+def test_invalidations_are_bounded():
+    cache = PrincipalCache()
+    user = {"id": "u"}
+    generation = cache.generation
+    for i in range(MAX_INVALIDATIONS * 3):
+        cache.invalidate_user(f"other-{i}")
+    assert len(cache._invalidated) == MAX_INVALIDATIONS
+
+    # Чтение старше забытых сбросов не кешируется, новое - кешируется
+    cache.put("old", user, time.time() + 60, generation)
+    assert cache.get("old") is None
+    cache.put("new", user, time.time() + 60, cache.generation)
+    assert cache.get("new") == user
@@ -0,0 +1,147 @@
+"""ConnectionManager поверх LocalBus: подписки при переподключениях"""
+import asyncio
+import json
+import uuid
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+import main
+from pubsub import LocalBus, group_channel, user_channel
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        pass
+
+
+class SlowUnsubscribeBus(LocalBus):
+    """Отписка ждёт release - как сетевой вызов в Redis"""
+
+    def __init__(self):
+        super().__init__()
+        self.unsubscribing = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def unsubscribe(self, channel: str):
+        self.unsubscribing.set()
+        await self.release.wait()
+        await super().unsubscribe(channel)
+
+
+async def create_group(member_ids):
+    group_id = str(uuid.uuid4())
+    await main.storage.create_group({
+        "id": group_id, "name": "g", "description": None, "members": member_ids,
+        "created_at": datetime.utcnow().isoformat(), "created_by": member_ids[0]
+    })
+    return group_id
+
+
+async def wait_sent(ws: FakeWebSocket, count: int):
+    for _ in range(100):
+        if len(ws.sent) >= count:
+            return
+        await asyncio.sleep(0.01)
+
+
+def test_reconnect_during_disconnect_keeps_subscriptions():
+    async def scenario():
+        bus = SlowUnsubscribeBus()
+        manager = main.ConnectionManager(bus)
+        await manager.startup()
+        user_id = str(uuid.uuid4())
+        group_id = await create_group([user_id])
+
+        old_ws, new_ws = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old_ws, user_id)
+        disconnecting = asyncio.create_task(manager.disconnect(user_id, old_ws))
+        await bus.unsubscribing.wait()
+
+        # Переподключение, пока старое подключение отписывается
+        await manager.connect(new_ws, user_id)
+        bus.release.set()
+        await disconnecting
+
+        assert manager.user_groups[user_id] == {group_id}
+        assert manager.local_group_members[group_id] == {user_id}
+        assert user_channel(user_id) in bus.channels
+        assert group_channel(group_id) in bus.channels
+
+        await manager.broadcast_to_group({"type": "group", "id": "m1"}, group_id)
+        await wait_sent(new_ws, 1)
+        assert len(new_ws.sent) == 1
+
+        await manager.disconnect(user_id, new_ws)
+        assert user_channel(user_id) not in bus.channels
+        assert group_channel(group_id) not in bus.channels
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_group_member_joins_while_last_member_leaves():
+    async def scenario():
+        bus = SlowUnsubscribeBus()
+        manager = main.ConnectionManager(bus)
+        await manager.startup()
+        leaving, joining = str(uuid.uuid4()), str(uuid.uuid4())
+        group_id = await create_group([leaving, joining])
+
+        leaving_ws, joining_ws = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(leaving_ws, leaving)
+        disconnecting = asyncio.create_task(manager.disconnect(leaving, leaving_ws))
+        await bus.unsubscribing.wait()
+        await manager.connect(joining_ws, joining)
+        bus.release.set()
+        await disconnecting
+
+        assert group_channel(group_id) in bus.channels
+        await manager.broadcast_to_group({"type": "group", "id": "m1"}, group_id)
+        await wait_sent(joining_ws, 1)
+        assert len(joining_ws.sent) == 1
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_stale_disconnect_after_reconnect_is_ignored():
+    async def scenario():
+        manager = main.ConnectionManager(LocalBus())
+        await manager.startup()
+        user_id = str(uuid.uuid4())
+        group_id = await create_group([user_id])
+
+        old_ws, new_ws = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(old_ws, user_id)
+        await manager.connect(new_ws, user_id)
+        await manager.disconnect(user_id, old_ws)
+
+        assert manager.active_connections[user_id].websocket is new_ws
+        assert manager.local_group_members[group_id] == {user_id}
+        await manager.disconnect(user_id, new_ws)
+        await manager.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_resume_ignores_non_integer_since():
+    with TestClient(main.app) as client:
+        with client.websocket_connect(f"/ws/{uuid.uuid4()}") as websocket:
+            for since in (True, False, "5", -1, 1.5):
+                websocket.send_text(json.dumps({"type": "resume", "since": since}))
+            websocket.send_text(json.dumps({"type": "ping"}))
+            assert json.loads(websocket.receive_text()) == {"type": "pong"}
+
+            websocket.send_text(json.dumps({"type": "resume", "since": 0}))
+            frame = json.loads(websocket.receive_text())
+            assert frame["type"] == "sync" and frame["last_seq"] == 0
@@ -0,0 +1,105 @@
+"""Сводка чатов: счётчики непрочитанных и курсоры прочтения"""
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+from conversations import ConversationIndex
+from storage import MemoryStorage
+
+
+def message(message_id: str, sender_id: str, recipient_id: str = None) -> dict:
+    return {"id": message_id, "sender_id": sender_id, "recipient_id": recipient_id}
+
+
+def test_sender_has_read_own_messages():
+    index = ConversationIndex()
+    index.record("group:g", message("m1", "alice"))
+    index.record("group:g", message("m2", "bob"))
+    index.record("group:g", message("m3", "bob"))
+
+    by_user = {user: index.summaries_for(user, ["group:g"])[0] for user in ("alice", "bob", "carol")}
+    assert {user: summary["unread_count"] for user, summary in by_user.items()} == \
+        {"alice": 2, "bob": 0, "carol": 3}
+    assert by_user["alice"]["last_read_message_id"] == "m1"
+    assert by_user["carol"]["last_read_message_id"] is None
+    assert by_user["carol"]["message_count"] == 3
+    assert by_user["carol"]["last_message"]["id"] == "m3"
+
+
+def test_read_cursor_only_moves_forward():
+    index = ConversationIndex()
+    for number in range(1, 5):
+        index.record("group:g", message(f"m{number}", "bob"))
+
+    assert index.mark_read("alice", "group:g", "m3") == ("m3", 3)
+    assert index.mark_read("alice", "group:g", "m1") == ("m3", 3)
+    assert index.summaries_for("alice", ["group:g"])[0]["unread_count"] == 1
+    assert index.mark_read("alice", "group:g") == ("m4", 4)
+    assert index.summaries_for("alice", ["group:g"])[0]["unread_count"] == 0
+
+    index.record("group:g", message("m5", "bob"))
+    assert index.summaries_for("alice", ["group:g"])[0]["unread_count"] == 1
+
+
+def test_mark_read_rejects_messages_of_other_chats():
+    index = ConversationIndex()
+    index.record("group:g", message("m1", "bob"))
+    index.record("group:h", message("m2", "bob"))
+    assert index.mark_read("alice", "group:g", "m2") is None
+    assert index.mark_read("alice", "group:g", "unknown") is None
+    assert index.mark_read("alice", "group:empty") is None
+    assert index.summaries_for("alice", ["group:g"])[0]["unread_count"] == 1
+
+
+def test_direct_messages_appear_for_both_participants():
+    index = ConversationIndex()
+    index.record("dm:alice:bob", message("d1", "alice", "bob"))
+    index.record("dm:alice:bob", message("d2", "alice", "bob"))
+    index.record("dm:alice:alice", message("d3", "alice", "alice"))
+
+    assert index.dm_keys("bob") == ["dm:alice:bob"]
+    assert [(s["key"], s["unread_count"]) for s in index.summaries_for("alice", [])] == \
+        [("dm:alice:bob", 0), ("dm:alice:alice", 0)]
+    assert [(s["key"], s["unread_count"]) for s in index.summaries_for("bob", [])] == [("dm:alice:bob", 2)]
+    # Группы без сообщений в сводку не попадают
+    assert index.summaries_for("carol", ["group:g"]) == []
+
+
+async def unread_counters_follow_messages_and_reads(storage):
+    alice, bob = str(uuid.uuid4()), str(uuid.uuid4())
+    group_id = str(uuid.uuid4())
+    await storage.create_group({
+        "id": group_id, "name": "g", "description": None, "members": [alice, bob],
+        "created_at": datetime.utcnow().isoformat(), "created_by": alice
+    })
+    started = datetime.utcnow()
+    ids = []
+    for number, (sender, recipient, group) in enumerate([
+        (bob, None, group_id), (bob, None, group_id), (alice, None, group_id),
+        (bob, alice, None), (bob, alice, None),
+    ]):
+        ids.append(str(uuid.uuid4()))
+        await storage.add_message({
+            "id": ids[-1], "sender_id": sender, "sender_name": "U", "content": "hi",
+            "recipient_id": recipient, "group_id": group,
+            "timestamp": (started + timedelta(seconds=number)).isoformat(),
+            "type": "group" if group else "personal", "file_url": None, "file_name": None, "file_size": None
+        })
+
+    async def unread(user_id):
+        return {summary["key"]: summary["unread_count"] for summary in await storage.conversation_summaries(user_id)}
+
+    group_key, dm_key = f"group:{group_id}", f"dm:{min(alice, bob)}:{max(alice, bob)}"
+    # Своё сообщение alice отмечает прочитанным всё до него
+    assert await unread(alice) == {group_key: 0, dm_key: 2}
+    assert await unread(bob) == {group_key: 1, dm_key: 0}
+
+    assert await storage.mark_read(alice, dm_key, ids[3]) == {"last_read_message_id": ids[3], "unread_count": 1}
+    assert await storage.mark_read(alice, dm_key, ids[0]) is None
+    assert await storage.mark_read(bob, group_key) == {"last_read_message_id": ids[2], "unread_count": 0}
+    assert await unread(alice) == {group_key: 0, dm_key: 1}
+    assert await unread(bob) == {group_key: 0, dm_key: 0}
+
+
+def test_storage_unread_counters():
+    asyncio.run(unread_counters_follow_messages_and_reads(MemoryStorage()))
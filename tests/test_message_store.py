@@ -0,0 +1,102 @@
+"""MessageStore: курсоры before/after и догрузка по seq"""
+import pytest
+
+from message_store import MessageStore
+
+
+def group_message(message_id: str, timestamp: str, group_id: str = "g", sender_id: str = "a") -> dict:
+    return {"id": message_id, "sender_id": sender_id, "recipient_id": None,
+            "group_id": group_id, "timestamp": timestamp}
+
+
+def make_store() -> MessageStore:
+    # m2 и m3 отправлены в одну и ту же секунду - их различает только seq
+    store = MessageStore()
+    for message_id, timestamp in [
+        ("m1", "2024-01-01T00:00:00"),
+        ("m2", "2024-01-01T00:00:01"),
+        ("m3", "2024-01-01T00:00:01"),
+        ("m4", "2024-01-01T00:00:02"),
+        ("m5", "2024-01-01T00:00:03"),
+    ]:
+        store.append(group_message(message_id, timestamp))
+    return store
+
+
+def ids(messages) -> list:
+    return [message["id"] for message in messages]
+
+
+def test_latest_page_without_cursors():
+    store = make_store()
+    assert ids(store.group_history("g", 2)) == ["m4", "m5"]
+    assert ids(store.group_history("g", 10)) == ["m1", "m2", "m3", "m4", "m5"]
+    assert store.group_history("g", 0) == []
+    assert store.group_history("missing", 10) == []
+
+
+def test_id_cursor_is_an_exact_position():
+    store = make_store()
+    # Сообщение с тем же timestamp, что и курсор, не теряется и не повторяется
+    assert ids(store.group_history("g", 10, before="m3")) == ["m1", "m2"]
+    assert ids(store.group_history("g", 10, after="m2")) == ["m3", "m4", "m5"]
+    assert ids(store.group_history("g", 1, before="m4")) == ["m3"]
+
+
+def test_timestamp_cursor_is_a_boundary_between_messages():
+    store = make_store()
+    # Все сообщения с timestamp курсора лежат по одну сторону границы
+    assert ids(store.group_history("g", 10, before="2024-01-01T00:00:01")) == ["m1"]
+    assert ids(store.group_history("g", 10, after="2024-01-01T00:00:01")) == ["m4", "m5"]
+    assert ids(store.group_history("g", 10, after="2024-01-01T00:00:01.500000")) == ["m4", "m5"]
+
+
+def test_after_pages_forward_from_the_cursor():
+    store = make_store()
+    assert ids(store.group_history("g", 2, after="m1")) == ["m2", "m3"]
+    assert ids(store.group_history("g", 2, after="m3")) == ["m4", "m5"]
+    assert store.group_history("g", 2, after="m5") == []
+
+
+def test_before_and_after_together_select_a_window():
+    store = make_store()
+    assert ids(store.group_history("g", 10, before="m5", after="m1")) == ["m2", "m3", "m4"]
+    # С after страница начинается от него, а не от before
+    assert ids(store.group_history("g", 2, before="m5", after="m1")) == ["m2", "m3"]
+    assert store.group_history("g", 10, before="m2", after="m4") == []
+
+
+def test_timezone_aware_cursor_is_converted_to_utc():
+    store = make_store()
+    assert ids(store.group_history("g", 10, before="2024-01-01T03:00:02+03:00")) == ["m1", "m2", "m3"]
+    assert ids(store.group_history("g", 10, after="2023-12-31T19:00:01-05:00")) == ["m4", "m5"]
+    assert ids(store.group_history("g", 10, before="2024-01-01T00:00:02Z")) == ["m1", "m2", "m3"]
+
+
+def test_unknown_cursor_is_rejected():
+    store = make_store()
+    with pytest.raises(ValueError):
+        store.group_history("g", 10, before="no-such-message")
+
+
+def test_dm_history_is_shared_by_both_participants():
+    store = MessageStore()
+    store.append({"id": "d1", "sender_id": "a", "recipient_id": "b", "group_id": None,
+                  "timestamp": "2024-01-01T00:00:00"})
+    store.append({"id": "d2", "sender_id": "b", "recipient_id": "a", "group_id": None,
+                  "timestamp": "2024-01-01T00:00:01"})
+    assert ids(store.dm_history("a", "b", 10)) == ids(store.dm_history("b", "a", 10)) == ["d1", "d2"]
+    assert ids(store.user_history("b", 10, after="d1")) == ["d2"]
+
+
+def test_since_merges_user_and_group_timelines_once():
+    store = MessageStore()
+    store.append(group_message("g1", "2024-01-01T00:00:00", sender_id="a"))
+    store.append({"id": "d1", "sender_id": "b", "recipient_id": "a", "group_id": None,
+                  "timestamp": "2024-01-01T00:00:01"})
+    store.append(group_message("g2", "2024-01-01T00:00:02", sender_id="b"))
+    store.append(group_message("x1", "2024-01-01T00:00:03", group_id="other", sender_id="b"))
+
+    assert ids(store.since("a", ["g"], 0, 10)) == ["g1", "d1", "g2"]
+    assert ids(store.since("a", ["g"], 1, 10)) == ["d1", "g2"]
+    assert ids(store.since("a", ["g"], 0, 2)) == ["g1", "d1"]
@@ -0,0 +1,141 @@
+"""
+PostgresStorage: гонки, которые видны только на настоящей базе
+
+Запускаются при заданном TEST_DATABASE_URL (отдельная база - схема
+создаётся в ней при старте хранилища), иначе пропускаются.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+from storage_postgres import PostgresStorage
+from test_conversations import unread_counters_follow_messages_and_reads
+from test_uploads import (
+    failed_put_keeps_no_reference, slow_puts_do_not_hold_storage, upload_same_content_while_last_reference_is_deleted
+)
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+def run(scenario):
+    async def wrapper():
+        storage = PostgresStorage(DATABASE_URL, pool_size=4, max_overflow=4)
+        await storage.startup()
+        try:
+            await scenario(storage)
+        finally:
+            await storage.shutdown()
+    asyncio.run(wrapper())
+
+
+async def create_group(storage: PostgresStorage, user_id: str) -> str:
+    group_id = str(uuid.uuid4())
+    await storage.create_group({
+        "id": group_id, "name": "g", "description": None, "members": [user_id],
+        "created_at": datetime.utcnow().isoformat(), "created_by": user_id
+    })
+    return group_id
+
+
+def make_message(user_id: str, group_id: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "sender_id": user_id, "sender_name": "U", "content": "hi",
+        "recipient_id": None, "group_id": group_id, "timestamp": datetime.utcnow().isoformat(),
+        "type": "group", "file_url": None, "file_name": None, "file_size": None
+    }
+
+
+def test_sync_returns_seq_only_after_earlier_transactions_commit():
+    async def scenario(storage):
+        user_id = str(uuid.uuid4())
+        first_group, second_group = await create_group(storage, user_id), await create_group(storage, user_id)
+
+        # Первая вставка держит транзакцию открытой; вторая (в другой чат)
+        # её не ждёт, но /sync не должен отдать её раньше первой
+        async with storage.pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            first_seq = await storage._insert_message(conn, make_message(user_id, first_group))
+            second_seq = await asyncio.wait_for(storage.add_message(make_message(user_id, second_group)), 5)
+            assert second_seq > first_seq
+            assert await storage.sync_messages(user_id, 0, 10) == []
+            await transaction.commit()
+
+        assert [msg["seq"] for msg in await storage.sync_messages(user_id, 0, 10)] == [first_seq, second_seq]
+
+    run(scenario)
+
+
+def test_incremental_sync_misses_nothing_under_concurrent_inserts():
+    async def scenario(storage):
+        user_id = str(uuid.uuid4())
+        group_ids = [await create_group(storage, user_id) for _ in range(4)]
+        writers_done = asyncio.Event()
+
+        async def writer(group_id):
+            for _ in range(25):
+                await storage.add_message(make_message(user_id, group_id))
+
+        async def reader():
+            seen, since = [], 0
+            while True:
+                finished = writers_done.is_set()
+                page = await storage.sync_messages(user_id, since, 1000)
+                seen.extend(msg["id"] for msg in page)
+                if page:
+                    since = page[-1]["seq"]
+                elif finished:
+                    return seen
+
+        reading = asyncio.create_task(reader())
+        await asyncio.gather(*(writer(group_id) for group_id in group_ids for _ in range(2)))
+        writers_done.set()
+        seen = await reading
+
+        assert len(seen) == len(set(seen)) == 200
+        assert seen == [msg["id"] for msg in await storage.sync_messages(user_id, 0, 1000)]
+
+    run(scenario)
+
+
+def test_upload_during_delete_of_last_reference_keeps_blob(tmp_path):
+    run(lambda storage: upload_same_content_while_last_reference_is_deleted(storage, tmp_path))
+
+
+def test_failed_blob_put_drops_file_reference(tmp_path):
+    run(lambda storage: failed_put_keeps_no_reference(storage, tmp_path))
+
+
+def test_slow_blob_put_does_not_hold_pool_connections(tmp_path):
+    # 12 загрузок при пуле из 8 соединений
+    run(lambda storage: slow_puts_do_not_hold_storage(storage, tmp_path))
+
+
+def test_unread_counters():
+    run(unread_counters_follow_messages_and_reads)
+
+
+def test_latest_messages_and_counts_come_from_conversation_summaries():
+    async def scenario(storage):
+        user_id, peer_id = str(uuid.uuid4()), str(uuid.uuid4())
+        group_id, empty_group = await create_group(storage, user_id), await create_group(storage, user_id)
+        before = await storage.count_messages()
+        group_messages = [make_message(user_id, group_id) for _ in range(3)]
+        direct = {**make_message(user_id, group_id), "group_id": None, "recipient_id": peer_id, "type": "personal"}
+        for message in group_messages + [direct]:
+            await storage.add_message(message)
+
+        latest = await storage.latest_messages(user_id, [group_id, empty_group], [peer_id], 2)
+        assert latest[f"group:{group_id}"][0] == 3
+        assert [msg["id"] for msg in latest[f"group:{group_id}"][1]] == [msg["id"] for msg in group_messages[1:]]
+        assert latest[f"group:{empty_group}"] == (0, [])
+        assert latest[f"user:{peer_id}"][0] == 1
+        assert await storage.count_messages() == before + 4
+
+    run(scenario)
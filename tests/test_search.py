@@ -0,0 +1,115 @@
+"""Полнотекстовый поиск: стеммер, индекс и постраничная выдача"""
+import asyncio
+
+import pytest
+
+from search_index import SearchIndex, stem, terms
+from storage import MemoryStorage
+
+
+@pytest.mark.parametrize("forms", [
+    "сообщение сообщения сообщений сообщению сообщениях",
+    "отчёт отчёты отчётов отчёта отчёте",
+    "файл файлы файла файлов",
+    "работает работают работала работали работать",
+    "учился училась учились",
+    "новый новая новое новые нового",
+    "message messages",
+    "file files",
+    "box boxes",
+    "process processing processed",
+])
+def test_word_forms_share_a_stem(forms):
+    assert len({stem(word) for word in forms.split()}) == 1
+
+
+def test_distinct_words_keep_distinct_stems():
+    assert stem("пакет") != stem("пака")
+    assert stem("отчёт") != stem("отчим")
+    assert stem("class") == "class"
+
+
+def test_stem_is_case_and_yo_insensitive():
+    assert stem("ЁЛКА") == stem("елка")
+
+
+def test_terms_are_unique_in_order():
+    assert terms("Привет, привет ПРИВЕТ мир!") == [stem("привет"), stem("мир")]
+    assert terms(None) == terms("") == []
+
+
+def build_index() -> SearchIndex:
+    index = SearchIndex()
+    for number, (key, content) in enumerate([
+        ("group:a", "отчёт за январь"),
+        ("group:b", "отчёты готовы"),
+        ("group:a", "обед"),
+        ("dm:x:y", "пришли отчёт за февраль"),
+        ("group:a", "отчёта пока нет"),
+        ("group:hidden", "секретный отчёт"),
+    ]):
+        index.add(key, {"id": f"m{number}", "content": content, "file_name": None})
+    return index
+
+
+def ids(messages) -> list:
+    return [message["id"] for message in messages]
+
+
+VISIBLE = ["group:a", "group:b", "dm:x:y"]
+
+
+def test_search_returns_visible_matches_newest_first():
+    index = build_index()
+    assert ids(index.search("Отчеты", VISIBLE, 10)) == ["m4", "m3", "m1", "m0"]
+    assert ids(index.search("отчёт январь", VISIBLE, 10)) == ["m0"]
+    assert index.search("отчёт март", VISIBLE, 10) == []
+    assert index.search("   ", VISIBLE, 10) == []
+
+
+def test_search_pages_with_before_cursor():
+    index = build_index()
+    pages, before = [], None
+    while True:
+        page = index.search("отчёт", VISIBLE, 2, before)
+        if not page:
+            break
+        pages.append(ids(page))
+        before = page[-1]["id"]
+    assert pages == [["m4", "m3"], ["m1", "m0"]]
+
+    # Курсор - любое сообщение, даже не подходящее под запрос
+    assert ids(index.search("отчёт", VISIBLE, 10, before="m2")) == ["m1", "m0"]
+    with pytest.raises(ValueError):
+        index.search("отчёт", VISIBLE, 10, before="unknown")
+
+
+def test_file_name_is_searchable():
+    index = SearchIndex()
+    index.add("group:a", {"id": "f1", "content": None, "file_name": "budget_report.xlsx"})
+    index.add("group:a", {"id": "f2", "content": "", "file_name": "Бюджет.xlsx"})
+    assert ids(index.search("xlsx", ["group:a"], 10)) == ["f2", "f1"]
+    assert ids(index.search("бюджета", ["group:a"], 10)) == ["f2"]
+
+
+def test_storage_search_sees_only_member_groups_and_own_dms():
+    async def scenario():
+        storage = MemoryStorage()
+        for group_id, members in (("g1", ["alice", "bob"]), ("g2", ["bob"])):
+            await storage.create_group({
+                "id": group_id, "name": group_id, "description": None, "members": members,
+                "created_at": "2024-01-01T00:00:00", "created_by": members[0]
+            })
+        for number, (sender, recipient, group) in enumerate([
+            ("bob", None, "g1"), ("bob", None, "g2"), ("bob", "alice", None), ("bob", "carol", None),
+        ]):
+            await storage.add_message({
+                "id": f"m{number}", "sender_id": sender, "sender_name": sender, "content": "квартальный отчёт",
+                "recipient_id": recipient, "group_id": group, "timestamp": f"2024-01-01T00:00:0{number}",
+                "type": "group" if group else "personal", "file_url": None, "file_name": None, "file_size": None
+            })
+        assert ids(await storage.search_messages("alice", "отчёты", 10)) == ["m2", "m0"]
+        assert ids(await storage.search_messages("alice", "отчёты", 1, before="m2")) == ["m0"]
+        assert ids(await storage.search_messages("bob", "отчёты", 10)) == ["m3", "m2", "m1", "m0"]
+
+    asyncio.run(scenario())
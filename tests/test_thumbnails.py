@@ -0,0 +1,71 @@
+"""Превью изображений: отказ от слишком больших изображений до декодирования"""
+import asyncio
+import logging
+import uuid
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import thumbnails
+from blobstore import FilesystemBlobStore
+from storage import MemoryStorage
+from uploads import upload_from_bytes
+
+
+def png(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_image_over_pixel_limit_is_not_decoded(monkeypatch):
+    data = png(200, 100)
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_MAX_PIXELS", 200 * 100 - 1)
+
+    def decode(*args, **kwargs):
+        raise AssertionError("image must not be decoded")
+
+    monkeypatch.setattr(Image.Image, "load", decode)
+    with pytest.raises(thumbnails.ImageTooLarge):
+        thumbnails.render_thumbnails(data)
+
+
+def test_pillow_decompression_bomb_warning_means_no_preview(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 150 * 100 - 1)
+    with pytest.raises(thumbnails.TOO_LARGE):
+        thumbnails.render_thumbnails(png(150, 100))
+    # Вдвое больше предела Pillow уже бросает DecompressionBombError
+    with pytest.raises(thumbnails.TOO_LARGE):
+        thumbnails.render_thumbnails(png(400, 100))
+
+
+def test_too_large_image_is_logged_without_previews(monkeypatch, tmp_path, caplog):
+    monkeypatch.setattr(thumbnails, "THUMBNAIL_MAX_PIXELS", 100)
+
+    async def scenario():
+        storage = MemoryStorage()
+        blob_store = FilesystemBlobStore(str(tmp_path / "blobs"))
+        upload = await upload_from_bytes(png(20, 20), "big.png", "image/png")
+        file = {
+            "id": str(uuid.uuid4()), "sha256": upload["sha256"], "filename": "big.png",
+            "content_type": "image/png", "size": upload["size"], "uploaded_by": "u",
+            "uploaded_at": "2024-01-01T00:00:00", "width": None, "height": None, "previews": None
+        }
+        await storage.add_file(file)
+        await blob_store.put(upload)
+
+        pipeline = thumbnails.ThumbnailPipeline(storage, blob_store, workers=1)
+        await pipeline.startup()
+        try:
+            pipeline.submit(file)
+            await asyncio.wait_for(pipeline.queue.join(), 5)
+        finally:
+            await pipeline.shutdown()
+        return await storage.get_file(file["id"])
+
+    with caplog.at_level(logging.INFO):
+        stored = asyncio.run(scenario())
+    assert stored["previews"] is None
+    assert any("thumbnails.too_large" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,122 @@
+"""Счётчик ссылок на блобы: загрузка и удаление одного содержимого"""
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime
+
+import pytest
+
+from blobstore import FilesystemBlobStore, store_upload
+from storage import MemoryStorage
+
+
+class SlowPutBlobStore(FilesystemBlobStore):
+    """Запись блоба ждёт release - как долгая загрузка в S3"""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.release = asyncio.Event()
+
+    async def put(self, upload: dict) -> bool:
+        await self.release.wait()
+        return await super().put(upload)
+
+
+class FailingPutBlobStore(FilesystemBlobStore):
+    async def put(self, upload: dict) -> bool:
+        raise OSError("disk full")
+
+
+class SlowDeleteBlobStore(FilesystemBlobStore):
+    """Удаление блоба ждёт release - как сетевой вызов в S3"""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.deleting = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def delete(self, sha256: str):
+        self.deleting.set()
+        await self.release.wait()
+        await super().delete(sha256)
+
+
+def make_upload(tmp_path, data: bytes) -> dict:
+    temp_path = tmp_path / f".upload-{uuid.uuid4()}.part"
+    temp_path.write_bytes(data)
+    return {
+        "filename": "a.txt", "content_type": "text/plain", "temp_path": str(temp_path),
+        "size": len(data), "sha256": hashlib.sha256(data).hexdigest()
+    }
+
+
+def make_file(upload: dict) -> dict:
+    return {
+        "id": str(uuid.uuid4()), "sha256": upload["sha256"], "filename": upload["filename"],
+        "content_type": upload["content_type"], "size": upload["size"], "uploaded_by": "u",
+        "uploaded_at": datetime.utcnow().isoformat(), "width": None, "height": None, "previews": None
+    }
+
+
+async def upload_same_content_while_last_reference_is_deleted(storage, tmp_path):
+    blob_store = SlowDeleteBlobStore(str(tmp_path / "blobs"))
+    data = f"same content {uuid.uuid4()}".encode()
+    first = make_upload(tmp_path, data)
+    first_file = make_file(first)
+    assert await store_upload(storage, blob_store, first_file, first)
+
+    deleting = asyncio.create_task(storage.delete_file(first_file["id"], blob_store.delete))
+    await blob_store.deleting.wait()
+
+    # Счётчик уже дошёл до нуля, блоб ещё на месте
+    second = make_upload(tmp_path, data)
+    second_file = make_file(second)
+    uploading = asyncio.create_task(store_upload(storage, blob_store, second_file, second))
+    await asyncio.sleep(0.1)
+    blob_store.release.set()
+
+    assert await deleting == 0
+    assert await uploading, "блоб должен быть записан заново после удаления"
+    assert await storage.get_file(second_file["id"]) is not None
+    assert await blob_store.read(second["sha256"]) == data
+
+
+async def failed_put_keeps_no_reference(storage, tmp_path):
+    blob_store = FilesystemBlobStore(str(tmp_path / "blobs"))
+    upload = make_upload(tmp_path, f"broken {uuid.uuid4()}".encode())
+    file = make_file(upload)
+
+    with pytest.raises(OSError):
+        await store_upload(storage, FailingPutBlobStore(blob_store.root), file, upload)
+    assert await storage.get_file(file["id"]) is None
+
+    # Следующая загрузка того же содержимого - единственная ссылка
+    retry = make_file(upload)
+    assert await store_upload(storage, blob_store, retry, upload)
+    assert await storage.delete_file(retry["id"], blob_store.delete) == 0
+
+
+async def slow_puts_do_not_hold_storage(storage, tmp_path):
+    blob_store = SlowPutBlobStore(str(tmp_path / "blobs"))
+    uploads = [make_upload(tmp_path, f"slow {uuid.uuid4()}".encode()) for _ in range(12)]
+    files = [make_file(upload) for upload in uploads]
+    putting = [asyncio.create_task(store_upload(storage, blob_store, file, upload))
+               for file, upload in zip(files, uploads)]
+    await asyncio.sleep(0.1)
+
+    # Пока блобы пишутся, хранилище доступно и загрузки уже видны
+    assert await asyncio.wait_for(storage.get_file(files[0]["id"]), 2) is not None
+    blob_store.release.set()
+    assert all(await asyncio.gather(*putting))
+
+
+def test_upload_during_delete_of_last_reference_keeps_blob(tmp_path):
+    asyncio.run(upload_same_content_while_last_reference_is_deleted(MemoryStorage(), tmp_path))
+
+
+def test_failed_blob_put_drops_file_reference(tmp_path):
+    asyncio.run(failed_put_keeps_no_reference(MemoryStorage(), tmp_path))
+
+
+def test_slow_blob_put_does_not_block_storage(tmp_path):
+    asyncio.run(slow_puts_do_not_hold_storage(MemoryStorage(), tmp_path))
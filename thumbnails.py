@@ -0,0 +1,177 @@
+"""
+Превью изображений
+
+После загрузки изображение ставится в очередь; фоновые воркеры читают
+блоб, в пуле потоков (Pillow отпускает GIL при декодировании и
+масштабировании) строят превью small/medium в JPEG и сохраняют их
+обычными загрузками с id "<file_id>-<размер>" - со своими блобами,
+ETag, Range и S3-редиректами. Размеры оригинала и превью записываются в
+метаданные файла (previews), откуда их берёт MessageResponse.
+
+Pillow входит в requirements.txt; если его нет (окружение разработки),
+превью не строятся.
+Очередь ограничена THUMBNAIL_QUEUE_SIZE; если она полна, превью для
+файла пропускается, а не задерживает загрузку.
+Изображения больше THUMBNAIL_MAX_PIXELS не декодируются: размер
+читается из заголовка, и "бомба" в несколько килобайт не развернётся
+в гигабайты памяти воркера.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import warnings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow не установлен
+    Image = None
+
+from blobstore import store_upload
+from logs import get_logger, log_event
+from uploads import discard_upload, upload_from_bytes
+
+# Длинная сторона превью в пикселях
+THUMBNAIL_SIZES = {"small": 160, "medium": 640}
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+THUMBNAIL_QUEUE_SIZE = int(os.getenv("THUMBNAIL_QUEUE_SIZE", "1000"))
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", "50000000"))
+THUMBNAIL_QUALITY = 80
+
+EXIF_ORIENTATION = 0x0112
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp"}
+
+logger = get_logger("thumbnails")
+
+
+class ImageTooLarge(Exception):
+    """Изображение больше THUMBNAIL_MAX_PIXELS - превью не строится"""
+
+
+if Image is not None:
+    # Собственная проверка Pillow (MAX_IMAGE_PIXELS) по умолчанию только
+    # предупреждает; для превью это тоже отказ, а не декодирование
+    warnings.simplefilter("error", Image.DecompressionBombWarning)
+    TOO_LARGE = (ImageTooLarge, Image.DecompressionBombError, Image.DecompressionBombWarning)
+else:  # pragma: no cover - Pillow не установлен
+    TOO_LARGE = (ImageTooLarge,)
+
+
+def render_thumbnails(data: bytes) -> Tuple[int, int, Dict[str, Tuple[bytes, int, int]]]:
+    """Построить превью: (ширина, высота оригинала, {размер: (jpeg, ширина, высота)})"""
+    with Image.open(BytesIO(data)) as image:
+        width, height = image.size
+        # Open читает только заголовок; пиксели ещё не декодированы. Предел
+        # Pillow тоже учитывается: его предупреждение может быть заглушено
+        # фильтрами warnings процесса
+        if width * height > min(THUMBNAIL_MAX_PIXELS, Image.MAX_IMAGE_PIXELS or THUMBNAIL_MAX_PIXELS):
+            raise ImageTooLarge(f"{width}x{height}")
+        if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEG декодируется сразу в уменьшенном масштабе (DCT scaling) -
+        # в разы быстрее и меньше памяти, чем полный кадр
+        image.draft("RGB", (max(THUMBNAIL_SIZES.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            # Прозрачность заливается белым: в JPEG альфа-канала нет
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, "white")
+            image.paste(rgba, mask=rgba.getchannel("A"))
+
+        thumbnails = {}
+        # От большего к меньшему: каждое превью масштабируется из предыдущего
+        for name, box in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+            image = image.copy()
+            image.thumbnail((box, box), Image.LANCZOS)
+            buffer = BytesIO()
+            image.save(buffer, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+            thumbnails[name] = (buffer.getvalue(), image.width, image.height)
+
+    return width, height, thumbnails
+
+
+class ThumbnailPipeline:
+    def __init__(self, storage, blob_store, workers: int = THUMBNAIL_WORKERS,
+                 queue_size: int = THUMBNAIL_QUEUE_SIZE):
+        self.storage = storage
+        self.blob_store = blob_store
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def enabled(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    async def startup(self):
+        if not self.enabled:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def submit(self, file: dict):
+        """Поставить загруженный файл в очередь, если это изображение"""
+        if not self._tasks or file["content_type"] not in IMAGE_TYPES:
+            return
+        try:
+            self.queue.put_nowait(file)
+        except asyncio.QueueFull:
+            log_event(logger, logging.WARNING, "thumbnails.queue_full", file_id=file["id"])
+
+    async def _worker(self):
+        while True:
+            file = await self.queue.get()
+            try:
+                await self.process(file)
+            except asyncio.CancelledError:
+                raise
+            except TOO_LARGE as exc:
+                log_event(logger, logging.INFO, "thumbnails.too_large", file_id=file["id"], error=repr(exc))
+            except Exception as exc:
+                # Битое или неподдерживаемое изображение - просто без превью
+                log_event(logger, logging.WARNING, "thumbnails.failed", file_id=file["id"], error=repr(exc))
+            finally:
+                self.queue.task_done()
+
+    async def process(self, file: dict):
+        data = await self.blob_store.read(file["sha256"])
+        loop = asyncio.get_running_loop()
+        width, height, thumbnails = await loop.run_in_executor(self._executor, render_thumbnails, data)
+
+        previews = {}
+        for name, (content, thumb_width, thumb_height) in thumbnails.items():
+            preview_id = f"{file['id']}-{name}"
+            upload = await upload_from_bytes(content, f"{name}.jpg", "image/jpeg")
+            try:
+                await store_upload(self.storage, self.blob_store, {
+                    "id": preview_id,
+                    "sha256": upload["sha256"],
+                    "filename": upload["filename"],
+                    "content_type": upload["content_type"],
+                    "size": upload["size"],
+                    "uploaded_by": file["uploaded_by"],
+                    "uploaded_at": datetime.utcnow().isoformat(),
+                    "width": thumb_width,
+                    "height": thumb_height,
+                    "previews": None
+                }, upload)
+            except BaseException:
+                await discard_upload(upload)
+                raise
+            previews[name] = {"url": f"/files/{preview_id}.jpg", "width": thumb_width, "height": thumb_height}
+
+        await self.storage.update_file(file["id"], {"width": width, "height": height, "previews": previews})
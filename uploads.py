@@ -0,0 +1,200 @@
+"""
+Потоковый приём загружаемых файлов
+
+Тело multipart-запроса разбирается по мере поступления: содержимое файла
+пишется на диск кусками по UPLOAD_CHUNK_SIZE через aiofiles (без
+блокировки event loop), SHA-256 считается на лету, а при превышении
+MAX_FILE_SIZE приём прерывается сразу - файл целиком в памяти не
+держится ни в обработчике, ни во временном буфере Starlette.
+
+Файл сначала пишется во временный файл в UPLOAD_DIR и переносится в
+хранилище только после успешного приёма (см. blobstore.BlobStore.put).
+"""
+from typing import List, Optional, Tuple
+import hashlib
+import os
+import re
+import uuid
+
+import aiofiles
+import aiofiles.os
+from multipart.multipart import MultipartParseError, MultipartParser, parse_options_header
+from starlette.requests import Request
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Запас на границы и заголовки частей multipart сверх размера самого файла
+MULTIPART_OVERHEAD = 16 * 1024
+
+_EXTENSION_RE = re.compile(r"^[A-Za-z0-9]{1,16}$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class InvalidUpload(ValueError):
+    pass
+
+
+def safe_extension(filename: str) -> str:
+    """Расширение файла без точки; пустая строка, если оно подозрительное"""
+    if "." not in filename:
+        return ""
+    extension = filename.rsplit(".", 1)[-1]
+    return extension.lower() if _EXTENSION_RE.match(extension) else ""
+
+
+class _PartCollector:
+    """Колбэки парсера multipart; события копятся до обработки в receive_upload"""
+
+    def __init__(self):
+        self.events: List[Tuple[str, object]] = []
+        self._headers: List[Tuple[bytes, bytes]] = []
+        self._header_name = b""
+        self._header_value = b""
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+        }
+
+    def on_part_begin(self):
+        self._headers = []
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        self.events.append(("data", data[start:end]))
+
+    def on_part_end(self):
+        self.events.append(("end", None))
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers.append((self._header_name.lower(), self._header_value))
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        self.events.append(("part", dict(self._headers)))
+
+
+async def receive_upload(request: Request, field_name: str = "file",
+                         max_size: int = MAX_FILE_SIZE) -> dict:
+    """
+    Принять файл из поля field_name multipart-запроса.
+
+    Возвращает filename, content_type, size, sha256 и temp_path. Бросает
+    UploadTooLarge при превышении max_size и InvalidUpload, если запрос не
+    multipart или поля с файлом нет.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise UploadTooLarge()
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise InvalidUpload("Expected multipart/form-data")
+
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    collector = _PartCollector()
+    parser = MultipartParser(boundary, collector.callbacks())
+
+    upload: Optional[dict] = None
+    temp_file = None
+    in_file_part = False
+    buffer = bytearray()
+    received = 0
+    size = 0
+    hasher = hashlib.sha256()
+
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_size + MULTIPART_OVERHEAD:
+                raise UploadTooLarge()
+            parser.write(chunk)
+
+            for event, payload in collector.events:
+                if event == "part":
+                    _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                    in_file_part = (
+                        upload is None
+                        and options.get(b"name") == field_name.encode()
+                        and b"filename" in options
+                    )
+                    if in_file_part:
+                        upload = {
+                            "filename": options[b"filename"].decode("utf-8", "replace"),
+                            "content_type": payload.get(b"content-type", b"application/octet-stream").decode("latin-1"),
+                            "temp_path": os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4()}.part"),
+                        }
+                        temp_file = await aiofiles.open(upload["temp_path"], "wb")
+                elif event == "data" and in_file_part:
+                    size += len(payload)
+                    if size > max_size:
+                        raise UploadTooLarge()
+                    hasher.update(payload)
+                    buffer += payload
+                    if len(buffer) >= UPLOAD_CHUNK_SIZE:
+                        await temp_file.write(bytes(buffer))
+                        buffer.clear()
+                elif event == "end":
+                    in_file_part = False
+            collector.events.clear()
+
+        parser.finalize()
+        if upload is None:
+            raise InvalidUpload("File is required")
+
+        if buffer:
+            await temp_file.write(bytes(buffer))
+        await temp_file.close()
+        temp_file = None
+    except BaseException as exc:
+        if temp_file is not None:
+            await temp_file.close()
+        if upload is not None:
+            await discard_upload(upload)
+        if isinstance(exc, MultipartParseError):
+            raise InvalidUpload("Malformed multipart body") from exc
+        raise
+
+    upload["size"] = size
+    upload["sha256"] = hasher.hexdigest()
+    return upload
+
+
+async def upload_from_bytes(data: bytes, filename: str, content_type: str) -> dict:
+    """Временный файл из готовых данных в том же виде, что и у receive_upload"""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload = {
+        "filename": filename,
+        "content_type": content_type,
+        "temp_path": os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4()}.part"),
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+    async with aiofiles.open(upload["temp_path"], "wb") as f:
+        await f.write(data)
+    return upload
+
+
+async def discard_upload(upload: dict):
+    try:
+        await aiofiles.os.remove(upload["temp_path"])
+    except FileNotFoundError:
+        pass
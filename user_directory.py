@@ -0,0 +1,56 @@
+"""
+Справочник пользователей
+
+Пользователи доступны по id, username и email за O(1), а число
+пользователей каждой роли поддерживается инкрементально - статистика
+админки не обходит всех пользователей. Все изменения должны идти через
+методы справочника, иначе индексы разойдутся.
+"""
+from collections import Counter
+from typing import Dict, Iterator, Optional
+
+
+class UserDirectory:
+    def __init__(self):
+        self.by_id: Dict[str, dict] = {}
+        self.by_username: Dict[str, dict] = {}
+        self.by_email: Dict[str, dict] = {}
+        self.role_counts: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self.by_id.values())
+
+    def add(self, user: dict):
+        self.by_id[user["id"]] = user
+        self.by_username[user["username"]] = user
+        self.by_email[user["email"]] = user
+        self.role_counts[user.get("role", "user")] += 1
+
+    def update(self, user_id: str, fields: dict) -> Optional[dict]:
+        """Обновить поля пользователя с переиндексацией email и счётчиков ролей"""
+        user = self.by_id.get(user_id)
+        if user is None:
+            return None
+
+        if "email" in fields and fields["email"] != user["email"]:
+            del self.by_email[user["email"]]
+            self.by_email[fields["email"]] = user
+        if "role" in fields and fields["role"] != user.get("role", "user"):
+            self.role_counts[user.get("role", "user")] -= 1
+            self.role_counts[fields["role"]] += 1
+
+        user.update(fields)
+        return user
+
+    def remove(self, user_id: str) -> Optional[dict]:
+        user = self.by_id.pop(user_id, None)
+        if user is None:
+            return None
+
+        del self.by_username[user["username"]]
+        del self.by_email[user["email"]]
+        self.role_counts[user.get("role", "user")] -= 1
+        return user
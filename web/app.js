@@ -12,6 +12,12 @@ let groups = [];
 let messages = {};
 let typingTimeout = null;
 let unreadMessages = {}; // { chatId: count }
+let lastMessages = {}; // { "user:<id>" | "group:<id>": последнее сообщение }
+let lastSeq = 0; // Наибольший глобальный номер полученного сообщения (для resume)
+let pendingReads = {}; // { "user:<id>" | "group:<id>": { type, chatId, messageId, timer } }
+
+// Отметки прочтения входящих в открытом чате копятся и уходят одним запросом
+const READ_DEBOUNCE_MS = 1500;
 
 // Звук уведомления
 const notificationSound = new Audio('/static/notification.mp3');
@@ -51,16 +57,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Переподключение WebSocket при возврате в приложение (для iOS Safari)
     document.addEventListener('visibilitychange', () => {
+        if (document.hidden) {
+            // Вкладку могут закрыть - отправить отложенные отметки прочтения
+            Object.keys(pendingReads).forEach(flushChatRead);
+        }
         if (!document.hidden && currentUser && ws) {
             // Приложение стало видимым
             console.log('[WebSocket] Проверка соединения после возврата');
+            // Догружаем только пропущенные сообщения (после переподключения - в onopen)
             if (ws.readyState !== WebSocket.OPEN) {
                 console.log('[WebSocket] Переподключение...');
                 connectWebSocket();
-            }
-            // Обновляем список сообщений активного чата
-            if (activeChat) {
-                loadMessages();
+            } else {
+                resumeSync();
             }
         }
     });
@@ -202,8 +211,7 @@ function showChatScreen() {
     initChatListeners();
 
     connectWebSocket();
-    loadUsers();
-    loadGroups();
+    Promise.all([loadUsers(), loadGroups()]).then(loadConversations);
 }
 
 function showAdminButton() {
@@ -222,6 +230,7 @@ function connectWebSocket() {
 
     ws.onopen = () => {
         console.log('WebSocket подключен');
+        resumeSync();
         // Отправляем пинг каждые 30 секунд
         setInterval(() => {
             if (ws.readyState === WebSocket.OPEN) {
@@ -232,7 +241,12 @@ function connectWebSocket() {
 
     ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
-        handleWebSocketMessage(data);
+        // При склейке на сервере (WS_COALESCE_WINDOW_MS) кадр - массив событий
+        if (Array.isArray(data)) {
+            data.forEach(handleWebSocketMessage);
+        } else {
+            handleWebSocketMessage(data);
+        }
     };
 
     ws.onerror = (error) => {
@@ -245,6 +259,25 @@ function connectWebSocket() {
     };
 }
 
+// Запросить сообщения, пришедшие после lastSeq (ответ - кадр sync)
+function resumeSync() {
+    if (lastSeq > 0 && ws && ws.readyState === WebSocket.OPEN) {
+        ws.send(JSON.stringify({ type: 'resume', since: lastSeq }));
+    }
+}
+
+function handleSync(data) {
+    console.log(`[Sync] ${data.messages.length} missed messages, has_more=${data.has_more}`);
+    // Сообщения, успевшие прийти по WebSocket, не обрабатываются повторно
+    data.messages
+        .filter(msg => !(messages[cacheChatId(msg)] || []).some(m => m.id === msg.id))
+        .forEach(msg => handleWebSocketMessage(msg));
+    lastSeq = Math.max(lastSeq, data.last_seq);
+    if (data.has_more) {
+        resumeSync();
+    }
+}
+
 // === НЕПРОЧИТАННЫЕ СООБЩЕНИЯ ===
 function getUnreadCount(chatId, type) {
     return unreadMessages[chatId] || 0;
@@ -321,6 +354,11 @@ function handleWebSocketMessage(data) {
         return;
     }
 
+    if (data.type === 'sync') {
+        handleSync(data);
+        return;
+    }
+
     if (data.type === 'typing') {
         // Показать индикатор "печатает"
         if (activeChat &&
@@ -359,6 +397,9 @@ function handleWebSocketMessage(data) {
             if (!existingMessage) {
                 appendMessage(data);
             }
+            if (data.sender_id !== currentUser.id) {
+                scheduleChatRead(activeChat.type, activeChat.id, data.id);
+            }
         } else if (data.sender_id !== currentUser.id) {
             // Если сообщение не в видимом чате и не от нас - увеличить счётчик непрочитанных
             const chatId = data.group_id || data.sender_id;
@@ -517,6 +558,95 @@ async function loadGroups() {
     }
 }
 
+// Последние сообщения и непрочитанные всех чатов одним запросом
+async function loadConversations() {
+    try {
+        const response = await fetch(`${API_URL}/conversations`, {
+            headers: {
+                'Authorization': `Bearer ${token}`
+            }
+        });
+        const summaries = await response.json();
+        summaries.forEach(summary => {
+            const chatId = summary.conversation.split(':')[1];
+            unreadMessages[chatId] = summary.unread_count;
+            if (summary.last_message) {
+                lastMessages[summary.conversation] = summary.last_message;
+                lastSeq = Math.max(lastSeq, summary.last_message.seq || 0);
+            }
+        });
+
+        renderActiveContactsTab();
+    } catch (error) {
+        console.error('Ошибка загрузки списка чатов:', error);
+    }
+}
+
+function renderActiveContactsTab() {
+    const activeTab = document.querySelector('.sidebar-tab.active').dataset.type;
+    if (activeTab === 'users') {
+        renderContactsList(users.filter(u => u.id !== currentUser.id), 'user');
+    } else if (activeTab === 'groups') {
+        renderContactsList(groups, 'group');
+    }
+}
+
+// Сохранить курсор прочтения на сервере (по умолчанию - весь чат)
+async function markChatRead(type, chatId, messageId = null) {
+    try {
+        await fetch(`${API_URL}/conversations/${type}:${chatId}/read`, {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ message_id: messageId }),
+            keepalive: true // отметка при закрытии вкладки
+        });
+    } catch (error) {
+        console.error('Ошибка отметки прочтения:', error);
+    }
+}
+
+// Отметить прочтение не сразу, а через READ_DEBOUNCE_MS - только последнее сообщение
+function scheduleChatRead(type, chatId, messageId) {
+    const key = `${type}:${chatId}`;
+    const pending = pendingReads[key];
+    if (pending) {
+        pending.messageId = messageId;
+        return;
+    }
+    pendingReads[key] = {
+        type,
+        chatId,
+        messageId,
+        timer: setTimeout(() => flushChatRead(key), READ_DEBOUNCE_MS)
+    };
+}
+
+function cancelChatRead(key) {
+    const pending = pendingReads[key];
+    if (pending) {
+        clearTimeout(pending.timer);
+        delete pendingReads[key];
+    }
+    return pending;
+}
+
+function flushChatRead(key) {
+    const pending = cancelChatRead(key);
+    if (pending) {
+        markChatRead(pending.type, pending.chatId, pending.messageId);
+    }
+}
+
+function lastMessagePreview(contact, type) {
+    const msg = lastMessages[`${type}:${contact.id}`];
+    if (!msg) return null;
+    const text = msg.content || (msg.file_name ? `📎 ${msg.file_name}` : '');
+    return escapeHtml(text.length > 40 ? text.slice(0, 40) + '…' : text);
+}
+
 function renderContactsList(contacts, type) {
     const container = document.getElementById('contacts-list');
     container.innerHTML = '';
@@ -534,7 +664,8 @@ function renderContactsList(contacts, type) {
 
         const emoji = type === 'group' ? '💼' : '👤';
         const name = type === 'group' ? contact.name : contact.full_name;
-        const status = type === 'group' ? `${contact.members.length} участников` : 'Online';
+        const status = lastMessagePreview(contact, type)
+            || (type === 'group' ? `${contact.members.length} участников` : 'Online');
 
         // Подсчёт непрочитанных сообщений
         const unreadCount = getUnreadCount(contact.id, type);
@@ -569,6 +700,8 @@ async function openChat(contact, type) {
 
     // Обнулить счётчик непрочитанных
     clearUnreadCount(contact.id);
+    cancelChatRead(`${type}:${contact.id}`); // весь чат отмечается ниже
+    markChatRead(type, contact.id);
 
     // Обновить UI
     document.querySelectorAll('.contact-item').forEach(item => {
@@ -659,8 +792,18 @@ function appendMessage(msg, scroll = true) {
 
     let contentHTML = '';
 
-    // Если есть файл - показать его
-    if (msg.file_url) {
+    // Если есть превью изображения - показать его вместо ссылки на оригинал
+    const preview = msg.file_previews && msg.file_previews.medium;
+    if (msg.file_url && preview) {
+        contentHTML += `
+            <div class="message-bubble">
+                <a href="${API_URL}${msg.file_url}" target="_blank" class="message-image-link">
+                    <img src="${API_URL}${preview.url}" width="${preview.width}" height="${preview.height}"
+                         loading="lazy" alt="${escapeHtml(msg.file_name || '')}" class="message-image-preview">
+                </a>
+            </div>
+        `;
+    } else if (msg.file_url) {
         const fileSize = msg.file_size ? formatFileSize(msg.file_size) : '';
         contentHTML += `
             <div class="message-bubble">
@@ -794,8 +937,13 @@ async function createGroup() {
     }
 }
 
+function cacheChatId(msg) {
+    return msg.group_id || (msg.sender_id === currentUser.id ? msg.recipient_id : msg.sender_id);
+}
+
 function addMessageToCache(msg) {
-    const chatId = msg.group_id || (msg.sender_id === currentUser.id ? msg.recipient_id : msg.sender_id);
+    lastSeq = Math.max(lastSeq, msg.seq || 0);
+    const chatId = cacheChatId(msg);
     if (!messages[chatId]) {
         messages[chatId] = [];
     }
@@ -807,7 +955,18 @@ function addMessageToCache(msg) {
 }
 
 function updateContactLastMessage(msg) {
-    // TODO: Обновить последнее сообщение в списке контактов
+    const key = msg.group_id
+        ? `group:${msg.group_id}`
+        : `user:${msg.sender_id === currentUser.id ? msg.recipient_id : msg.sender_id}`;
+    lastMessages[key] = msg;
+
+    const [type, chatId] = key.split(':');
+    const preview = document.querySelector(
+        `.contact-item[data-id="${chatId}"][data-type="${type}"] .contact-last-message`
+    );
+    if (preview) {
+        preview.innerHTML = lastMessagePreview({ id: chatId }, type);
+    }
 }
 
 async function uploadAndSendFile(file) {
@@ -922,6 +1081,7 @@ function formatFileSize(bytes) {
 }
 
 function logout() {
+    Object.keys(pendingReads).forEach(flushChatRead);
     localStorage.removeItem('token');
     localStorage.removeItem('user');
 